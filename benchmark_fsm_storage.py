@@ -0,0 +1,75 @@
+"""
+Пропускная способность хранилищ состояний FSM: обновлений в секунду.
+
+Каждое обновление повторяет работу обработчика ответа: чтение состояния,
+запись состояния и обновление данных для случайного пользователя.
+Сравниваются:
+- MemoryStorage aiogram (без сохранения);
+- SqliteStorage с пакетной записью раз в --flush-interval обновлений;
+- SqliteStorage с записью после каждого обновления (как хранилище без буфера).
+
+Пример:
+    python benchmark_fsm_storage.py --updates 50000 --users 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from utils.sqlite_fsm_storage import SqliteStorage
+
+STATES = ["FullVersionStates:SELECTING_TOPIC", "FullVersionStates:ANSWERING"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обновлений состояний FSM в секунду")
+    parser.add_argument("--updates", type=int, default=50000, help="количество обновлений")
+    parser.add_argument("--users", type=int, default=5000, help="количество пользователей")
+    parser.add_argument("--flush-interval", type=int, default=500,
+                        help="пакетная запись раз в столько обновлений (~0.5 с при 1000 обновлений/с)")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+async def run(storage, keys, flush_every):
+    """Возвращает время выполнения обновлений в секундах"""
+    started_at = time.perf_counter()
+    for i, key in enumerate(keys, 1):
+        await storage.get_state(key)
+        await storage.set_state(key, STATES[i & 1])
+        await storage.update_data(key, {"answered": i})
+        if flush_every and i % flush_every == 0:
+            storage.flush()
+    if flush_every:
+        storage.flush()
+    return time.perf_counter() - started_at
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    users = [StorageKey(bot_id=1, chat_id=user_id, user_id=user_id) for user_id in range(args.users)]
+    keys = [random.choice(users) for _ in range(args.updates)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        results.append(("MemoryStorage", asyncio.run(run(MemoryStorage(), keys, 0)), None))
+        for name, flush_every in (("SQLite, пакеты", args.flush_interval), ("SQLite, без буфера", 1)):
+            storage = SqliteStorage(os.path.join(directory, f"fsm_{flush_every}.db"))
+            elapsed = asyncio.run(run(storage, keys, flush_every))
+            results.append((name, elapsed, storage.flushes))
+            asyncio.run(storage.close())
+
+    print(f"Обновлений: {args.updates}, пользователей: {args.users}")
+    print(f"{'хранилище':<20} {'обновлений/с':>13} {'транзакций':>11}")
+    for name, elapsed, flushes in results:
+        print(f"{name:<20} {args.updates / elapsed:>13.0f} {flushes if flushes is not None else '-':>11}")
+
+
+if __name__ == "__main__":
+    main()
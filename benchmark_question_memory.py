@@ -0,0 +1,113 @@
+"""
+Сравнение памяти банка вопросов: словари JSON и компактные записи.
+
+Генерирует синтетический банк (вопросы разбираются из строк JSON, как при
+загрузке пакетов) и измеряет через tracemalloc память, которую занимают
+вопросы вместе с индексами QuestionService:
+- словари: вопрос как dict, индексы по строковым тегам и ID вопросов;
+- записи: QuestionRecord со __slots__, теги — ID из tag_vocabulary,
+  индексы по целочисленным ID тегов и uid вопросов.
+
+Пример:
+    python benchmark_question_memory.py --questions 100000 --tags 300
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from services.question_model import QuestionRecord, tag_vocabulary
+
+WORDS = ["интерфейс", "пользователь", "исследование", "прототип", "сценарий", "контраст",
+         "навигация", "кнопка", "форма", "сетка", "типографика", "доступность", "персона",
+         "интервью", "метрика", "гипотеза", "макет", "компонент", "состояние", "ошибка"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Память банка вопросов: словари и записи")
+    parser.add_argument("--questions", type=int, default=50000, help="количество вопросов в банке")
+    parser.add_argument("--tags", type=int, default=200, help="количество различных тегов")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def make_lines(count, tags_count):
+    """Строки JSON синтетических вопросов (как в пакетах *.jsonl)"""
+    tags = [f"тег_{i}" for i in range(tags_count)]
+    lines = []
+    for i in range(count):
+        question = {
+            "id": f"q_{i}",
+            "question": " ".join(random.choices(WORDS, k=10)) + "?",
+            "options": [" ".join(random.choices(WORDS, k=3)) for _ in range(4)],
+            "correct_answer": random.randrange(4),
+            "tags": random.sample(tags, random.randint(1, 3))
+        }
+        lines.append(json.dumps(question, ensure_ascii=False))
+    return lines
+
+
+def build_dicts(lines):
+    """Прежнее представление: словари и индексы по строкам"""
+    questions = [json.loads(line) for line in lines]
+    question_index = {}
+    tag_index = {}
+    theme_index = []
+    for question in questions:
+        question_index[question["id"]] = question
+        theme_index.append(question["id"])
+        for tag in question["tags"]:
+            tag_index.setdefault(tag, set()).add(question["id"])
+    return questions, question_index, tag_index, theme_index
+
+
+def build_records(lines):
+    """Компактное представление: записи и индексы по целым числам"""
+    records = [QuestionRecord.from_dict(uid, json.loads(line)) for uid, line in enumerate(lines)]
+    question_index = {}
+    tag_index = {}
+    theme_index = []
+    for record in records:
+        question_index[record.id] = record.uid
+        theme_index.append(record.uid)
+        for tag_id in record.tag_ids:
+            tag_index.setdefault(tag_id, set()).add(record.uid)
+    return records, question_index, tag_index, theme_index
+
+
+def measure(builder, lines):
+    """Возвращает (занятая память в байтах, время построения в секундах)"""
+    gc.collect()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    result = builder(lines)
+    elapsed = time.perf_counter() - started_at
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, elapsed
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    lines = make_lines(args.questions, args.tags)
+    # Словарь тегов общий для процесса; заполняем его заранее, чтобы не учитывать в замере
+    tag_vocabulary.intern_all(f"тег_{i}" for i in range(args.tags))
+
+    dicts_memory, dicts_time = measure(build_dicts, lines)
+    records_memory, records_time = measure(build_records, lines)
+
+    print(f"Вопросов: {args.questions}, тегов: {args.tags}")
+    print(f"{'представление':<16} {'память':>10} {'на вопрос':>10} {'построение':>11}")
+    for name, memory, elapsed in (("словари", dicts_memory, dicts_time),
+                                  ("записи", records_memory, records_time)):
+        print(f"{name:<16} {memory / 1024 / 1024:>8.1f}МБ {memory / args.questions:>9.0f}Б {elapsed:>10.2f}с")
+    print(f"Экономия: {(1 - records_memory / dicts_memory) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Микро-бенчмарк разбора ответов модели.
+
+Сравнивает services/ai_response_parser с прежним разбором (поиск блока кода
+регулярным выражением по всему ответу и вычисление Python-литерала) на
+образцах ответов из data/benchmarks/ai_response_samples.jsonl: время разбора
+одного ответа и количество полученных элементов. Прежний разбор вызывал
+eval; здесь вместо него ast.literal_eval, который не выполняет код из
+ответа модели, а только разбирает литералы.
+
+Пример:
+    python benchmark_response_parser.py --iterations 500
+"""
+import argparse
+import ast
+import json
+import re
+import time
+
+from services.ai_response_parser import parse_questions, parse_question_groups, parse_checklist
+
+SAMPLES_FILE = "data/benchmarks/ai_response_samples.jsonl"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора ответов модели")
+    parser.add_argument("--samples", default=SAMPLES_FILE, help="JSONL-файл с образцами ответов")
+    parser.add_argument("--iterations", type=int, default=200, help="повторов разбора каждого образца")
+    return parser.parse_args()
+
+
+def legacy_parse(sample):
+    """Прежний разбор из AIService: блок кода регулярным выражением, затем литерал Python (без eval)"""
+    text = sample["text"]
+    code_match = re.search(r'```(?:python)?(.*?)```', text, re.DOTALL)
+    result = ast.literal_eval(code_match.group(1).strip() if code_match else text)
+    if sample["kind"] == "checklist":
+        return len(result["resources"])
+    if isinstance(result, dict):
+        result = result.get("questions") or result.get("groups") or [result]
+    if sample["kind"] == "batch":
+        return sum(len(group["questions"]) for group in result)
+    return len(result)
+
+
+def new_parse(sample):
+    text = sample["text"]
+    if sample["kind"] == "checklist":
+        return len(parse_checklist(text)["resources"])
+    if sample["kind"] == "batch":
+        return sum(len(group) for group in parse_question_groups(text, sample["groups"]) if group)
+    return len(parse_questions(text))
+
+
+def measure(func, sample, iterations):
+    """Возвращает (среднее время разбора в мкс, количество элементов) или (None, текст ошибки)"""
+    try:
+        items = func(sample)
+    except Exception as e:
+        return None, type(e).__name__
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        func(sample)
+    return (time.perf_counter() - started_at) / iterations * 1e6, items
+
+
+def format_result(result):
+    elapsed, items = result
+    if elapsed is None:
+        return f"{'ошибка':>10} {items:>14}"
+    return f"{elapsed:>8.1f}мкс {items:>14}"
+
+
+def main():
+    args = parse_args()
+    with open(args.samples, "r", encoding="utf-8") as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+
+    print(f"{'образец':<22} {'размер':>8} {'прежний':>10} {'элементов':>14} {'парсер':>10} {'элементов':>14}")
+    for sample in samples:
+        legacy = measure(legacy_parse, sample, args.iterations)
+        new = measure(new_parse, sample, args.iterations)
+        print(f"{sample['name']:<22} {len(sample['text']):>8} {format_result(legacy)} {format_result(new)}")
+
+
+if __name__ == "__main__":
+    main()
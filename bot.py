@@ -11,14 +11,46 @@ from handlers.full_version_handler import FullVersionHandler
 from utils.logger import logger
 from utils.message_manager import message_manager
 from services.analytics_service import analytics_service
+from services.content_repository import content_repository
+from services.question_model import tag_vocabulary
+from services.question_sampler import question_sampler
+from services.session_store import flush_stores, session_backend
+from utils.bounded_store import sweep_stores
+from utils.sqlite_fsm_storage import SqliteStorage
 
 # Инициализация бота и диспетчера с хранилищем состояний
 bot = Bot(token=config.bot_token)
-dp = Dispatcher(storage=MemoryStorage())
+if config.fsm_storage_file:
+    fsm_storage = SqliteStorage(config.fsm_storage_file, ttl=config.fsm_state_ttl,
+                                max_entries=config.fsm_cache_max_entries)
+else:
+    fsm_storage = MemoryStorage()
+dp = Dispatcher(storage=fsm_storage)
 
 # Регистрация обработчиков
 test_handler = TestHandler()
 full_version_handler = FullVersionHandler()
+analytics_service.register_runtime_stats("Файлы контента", content_repository.get_stats)
+analytics_service.register_runtime_stats("Выборка вопросов без повторов", question_sampler.get_stats)
+analytics_service.register_runtime_stats("Словарь тегов", tag_vocabulary.get_stats)
+
+# Хранилища данных пользователей с ограничением по TTL и размеру
+bounded_stores = [
+    test_handler.test_service.user_sessions,
+    test_handler.test_service.user_results,
+    full_version_handler.user_sessions,
+    full_version_handler.user_tag_errors,
+    message_manager.last_messages
+]
+for store in bounded_stores:
+    analytics_service.register_runtime_stats(store.name, store.get_stats)
+# Сессии тестов, которые сохраняются во внешнее хранилище
+session_stores = [test_handler.test_service.user_sessions, full_version_handler.user_sessions]
+# Статистика выборки и квот уже зарегистрирована, их записи тоже периодически очищаются
+bounded_stores += [question_sampler, full_version_handler.ai_service.quota]
+if isinstance(fsm_storage, SqliteStorage):
+    analytics_service.register_runtime_stats(fsm_storage.name, fsm_storage.get_stats)
+    bounded_stores.append(fsm_storage)
 
 
 @dp.message(Command("start"))
@@ -114,6 +146,48 @@ async def cmd_stats(message: types.Message):
     message_manager.last_messages[user_id] = new_message
 
 
+@dp.message(Command("quota"))
+async def cmd_quota(message: types.Message):
+    """
+    Обработчик команды /quota
+    /quota <user_id> — расход и лимиты пользователя на запросы к ИИ
+    /quota <user_id> calls_per_day=300 tokens_per_hour=none — индивидуальные лимиты
+    /quota <user_id> reset — вернуть стандартные лимиты
+    Доступно только для администратора.
+    """
+    user_id = message.from_user.id
+
+    if user_id != config.admin_id:
+        logger.info(f"User {user_id} tried to access quota but is not an admin")
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+
+    quota = full_version_handler.ai_service.quota
+    args = (message.text or "").split()[1:]
+    if not args or not args[0].isdigit():
+        await message.answer("Использование: /quota <user_id> [calls_per_hour=N tokens_per_day=none ...|reset]")
+        return
+
+    target_id = int(args[0])
+    try:
+        if len(args) > 1 and args[1] == "reset":
+            quota.set_override(target_id, None)
+        elif len(args) > 1:
+            limits = dict(quota.overrides.get(target_id, {}))
+            for arg in args[1:]:
+                name, _, value = arg.partition("=")
+                limits[name] = None if value.lower() in ("none", "∞") else int(value)
+            quota.set_override(target_id, limits)
+    except ValueError as e:
+        await message.answer(f"Неверные лимиты: {str(e)}")
+        return
+
+    logger.info(f"Admin {user_id} requested quota of user {target_id}: {' '.join(args[1:])}")
+    lines = [f"<b>Квота пользователя {target_id}</b>"]
+    lines.extend(f"{name}: {value}" for name, value in quota.get_user_usage(target_id).items())
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
 @dp.message(Command("echo"))
 async def cmd_echo(message: types.Message):
     """
@@ -415,6 +489,13 @@ async def handle_back_to_main_button(callback_query: types.CallbackQuery):
 
 async def main():
     logger.info("Starting bot...")
+    content_watch_task = None
+    sweep_task = None
+    flush_task = None
+    fsm_flush_task = None
+    harvest_index_task = None
+    ai_calls_task = None
+    pool_flush_task = None
     try:
         # Проверяем наличие токена
         if not config.bot_token:
@@ -426,6 +507,24 @@ async def main():
             types.BotCommand(command="start", description="Меню")
         ])
 
+        # Перезагрузка файлов контента при их изменении без перезапуска бота
+        content_watch_task = asyncio.create_task(content_repository.watch())
+        # Индекс дубликатов для сбора ИИ-вопросов строится в фоне, бот отвечает сразу
+        harvest_index_task = asyncio.create_task(full_version_handler.question_harvester.build_index())
+        # Удаление брошенных сессий, старых результатов и сообщений
+        sweep_task = asyncio.create_task(sweep_stores(bounded_stores, config.store_sweep_interval))
+        # Пакетная запись изменений сессий во внешнее хранилище
+        flush_task = asyncio.create_task(flush_stores(session_stores, config.session_flush_interval))
+        if isinstance(fsm_storage, SqliteStorage):
+            # Пакетная запись состояний FSM
+            fsm_flush_task = asyncio.create_task(flush_stores([fsm_storage], config.fsm_flush_interval))
+        # Пакетная запись изменений пула ИИ-вопросов
+        pool_flush_task = asyncio.create_task(
+            flush_stores([full_version_handler.question_pool], config.question_pool_flush_interval)
+        )
+        # Пакетная запись метрик запросов к AI API в базу аналитики
+        ai_calls_task = asyncio.create_task(analytics_service.write_ai_calls(config.ai_calls_flush_interval))
+
         logger.info("Bot initialization completed successfully")
         logger.info("Starting polling...")
 
@@ -436,6 +535,34 @@ async def main():
         logger.error(f"Critical error while running bot: {str(e)}",
                      exc_info=True)
         raise
+    finally:
+        if content_watch_task is not None:
+            content_watch_task.cancel()
+        if sweep_task is not None:
+            sweep_task.cancel()
+        if flush_task is not None:
+            flush_task.cancel()
+        if fsm_flush_task is not None:
+            fsm_flush_task.cancel()
+        if harvest_index_task is not None:
+            harvest_index_task.cancel()
+        if ai_calls_task is not None:
+            ai_calls_task.cancel()
+        if pool_flush_task is not None:
+            pool_flush_task.cancel()
+        # Записываем последние изменения сессий, чтобы тесты продолжились после перезапуска
+        for store in session_stores:
+            store.flush()
+        session_backend.close()
+        # Записываем несохраненные состояния FSM и закрываем базу
+        await fsm_storage.close()
+        # Останавливаем фоновое пополнение пула вопросов (с записью его изменений)
+        # и закрываем общую HTTP-сессию AI-сервиса
+        await full_version_handler.question_pool.close()
+        full_version_handler.question_harvester.close()
+        await full_version_handler.ai_service.close()
+        # Записываем метрики последних запросов к AI API
+        analytics_service.flush_ai_calls()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,44 @@
+"""
+Компиляция файла контента и пакетов вопросов в базу SQLite для
+QuestionService (config.content_backend = "sqlite").
+
+База собирается во временном файле и заменяет старую целиком; работающий
+бот продолжает читать открытую им версию до перезапуска.
+
+Пример:
+    python build_content_store.py
+    CONTENT_BACKEND=sqlite python bot.py
+"""
+import argparse
+import time
+
+from config import config
+from services.content_store import compile_content_store
+from services.question_signatures import SignatureCache
+from utils.text_similarity import MinHasher
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Компиляция банка вопросов в SQLite")
+    parser.add_argument("--content-file", default=config.content_file, help="JSON-файл контента")
+    parser.add_argument("--packs-dir", default=config.question_packs_dir, help="каталог пакетов *.jsonl")
+    parser.add_argument("--output", default=config.content_store_file, help="файл базы")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started_at = time.monotonic()
+    # Сигнатуры неизмененных вопросов берутся из кэша сборщика ИИ-вопросов
+    signature_cache = SignatureCache(config.harvest_signature_cache_file, MinHasher())
+    try:
+        stats = compile_content_store(args.content_file, args.packs_dir, args.output, signature_cache)
+    finally:
+        signature_cache.close()
+    print(f"{args.output}: тем {stats['themes']}, вопросов {stats['questions']}, "
+          f"связей с тегами {stats['tags']}, пропущено дубликатов ID {stats['duplicates']}, "
+          f"{time.monotonic() - started_at:.1f} сек")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,13 @@ class Config:
         self.bot_token = os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
         self.content_file = "data/ux_ui_content.json"
         self.demo_content_file = "data/demo_ux_ui_content.json"  # Файл с отобранными вопросами для демо-теста
+        self.content_reload_interval = float(os.getenv("CONTENT_RELOAD_INTERVAL", "30"))  # Проверка изменений файлов контента, сек (0 — без перезагрузки)
+        self.question_packs_dir = "data/packs"  # Пакеты дополнительных вопросов (*.jsonl) для полной версии
+        # Хранилище вопросов полной версии: "json" — файл контента и пакеты в памяти,
+        # "sqlite" — скомпилированная база (build_content_store.py) с ленивой загрузкой вопросов
+        self.content_backend = os.getenv("CONTENT_BACKEND", "json")
+        self.content_store_file = "data/content.sqlite"
+        self.content_store_cache_size = 5000  # Сколько разобранных вопросов базы держать в памяти (LRU)
         self.log_file = "bot.log"
         
         # ID администратора бота для получения уведомлений
@@ -16,6 +23,116 @@ class Config:
         self.ai_api_key = os.getenv("OPENAI_API_KEY", "")  # Используем ту же переменную
         self.ai_api_url = "https://api.aimlapi.com/v1/chat/completions"
         self.ai_model = "claude-3-haiku-20240307"  # Модель от Anthropic, которая должна хорошо работать
+        # Цены моделей в долларах за 1 млн токенов: (запрос, ответ) — для расчета стоимости запросов
+        self.ai_model_prices = {
+            "claude-3-haiku-20240307": (0.25, 1.25)
+        }
+        
+        # Настройки HTTP-клиента для AI API (одна общая сессия на весь процесс)
+        self.ai_http_connector_limit = int(os.getenv("AI_HTTP_CONNECTOR_LIMIT", "100"))  # Всего одновременных соединений
+        self.ai_http_limit_per_host = int(os.getenv("AI_HTTP_LIMIT_PER_HOST", "20"))  # Соединений на один хост
+        self.ai_http_keepalive_timeout = float(os.getenv("AI_HTTP_KEEPALIVE_TIMEOUT", "30"))  # Сколько держать простаивающее соединение, сек
+        self.ai_http_connect_timeout = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", "5"))  # Таймаут установки соединения, сек
+        self.ai_http_read_timeout = float(os.getenv("AI_HTTP_READ_TIMEOUT", "30"))  # Таймаут ожидания данных от API, сек
+        self.ai_http_total_timeout = float(os.getenv("AI_HTTP_TOTAL_TIMEOUT", "60"))  # Общий таймаут запроса, сек
+        
+        # Сколько ждать фоновую генерацию ИИ-вопросов, если она ещё не завершилась к моменту показа, сек
+        self.ai_prefetch_wait_timeout = float(os.getenv("AI_PREFETCH_WAIT_TIMEOUT", "20"))
+        # Потоковая генерация (stream: true): вопросы показываются по мере готовности, а не после всего ответа
+        self.ai_streaming_enabled = os.getenv("AI_STREAMING_ENABLED", "1") == "1"
+        self.ai_json_mode = os.getenv("AI_JSON_MODE", "1") == "1"  # Запрашивать ответ в JSON-режиме (response_format)
+        
+        # Контроль допуска запросов к AI API (см. services/ai_scheduler.py)
+        self.ai_max_concurrency = int(os.getenv("AI_MAX_CONCURRENCY", "8"))  # Одновременных запросов к API
+        self.ai_max_queue = int(os.getenv("AI_MAX_QUEUE", "50"))  # Максимум запросов в очереди ожидания
+        self.ai_requests_per_minute = float(os.getenv("AI_REQUESTS_PER_MINUTE", "60"))  # Лимит запросов в минуту
+        self.ai_tokens_per_minute = float(os.getenv("AI_TOKENS_PER_MINUTE", "100000"))  # Лимит токенов в минуту
+        # Допустимое ожидание в очереди по приоритетам, сек (None — без ограничения):
+        # 0 — вопросы для пользователя, 1 — чек-листы, 2 — фоновая генерация
+        self.ai_admission_deadlines = {0: 3.0, 1: 10.0, 2: None}
+        
+        # Квоты пользователей на запросы к AI API (None — без ограничения)
+        self.ai_quota_calls_per_hour = 30  # Запросов в час на пользователя
+        self.ai_quota_tokens_per_hour = 60000  # Токенов в час на пользователя
+        self.ai_quota_calls_per_day = 150  # Запросов в сутки на пользователя
+        self.ai_quota_tokens_per_day = 300000  # Токенов в сутки на пользователя
+        self.ai_quota_file = "cache_data/ai_quota.json"  # Файл счетчиков и лимитов администратора, None — только в памяти
+        self.ai_quota_persist_interval = 60  # Как часто сохранять счетчики, сек
+        # Индивидуальные лимиты по ID пользователя (остальные лимиты — стандартные)
+        self.ai_quota_overrides = {
+            self.admin_id: {"calls_per_hour": None, "tokens_per_hour": None, "calls_per_day": None, "tokens_per_day": None}
+        }
+        
+        # Выключатель (circuit breaker) для AI API
+        self.ai_breaker_window_seconds = 60  # Окно, по которому считаются доля ошибок и p95, сек
+        self.ai_breaker_min_calls = 10  # Минимум запросов в окне для срабатывания
+        self.ai_breaker_error_rate = 0.5  # Доля ошибок, при которой выключатель размыкается
+        self.ai_breaker_p95_latency = 30.0  # p95 длительности запроса, при котором выключатель размыкается, сек
+        self.ai_breaker_open_seconds = 30  # Сколько держать выключатель разомкнутым до пробных запросов, сек
+        self.ai_breaker_half_open_probes = 2  # Сколько успешных пробных запросов нужно для замыкания
+        
+        # Хеджирование запросов: если ответа нет дольше задержки, отправляется второй такой же запрос
+        self.ai_hedge_enabled = os.getenv("AI_HEDGE_ENABLED", "0") == "1"
+        self.ai_hedge_delay = None  # Фиксированная задержка перед вторым запросом, сек (None — наблюдаемый p90)
+        self.ai_hedge_default_delay = 8.0  # Задержка, пока наблюдений для p90 недостаточно, сек
+        self.ai_hedge_min_delay = 2.0  # Нижняя граница задержки, вычисленной по p90, сек
+        self.ai_hedge_max_ratio = 0.1  # Максимальная доля хеджирующих запросов от основных
+        self.ai_hedge_model = os.getenv("AI_HEDGE_MODEL") or None  # Запасная модель для второго запроса (None — та же)
+        
+        # Микро-батчинг: запросы генерации из разных сессий объединяются в один вызов API
+        self.ai_batching_enabled = os.getenv("AI_BATCHING_ENABLED", "0") == "1"
+        self.ai_batch_window = 0.2  # Сколько собирать запросы в батч, сек
+        self.ai_batch_max_requests = 4  # Максимум запросов в одном батче
+        
+        # Записи о запросах к AI API (таблица ai_calls) пишутся в базу аналитики пакетами в фоновом потоке
+        self.ai_calls_flush_interval = float(os.getenv("AI_CALLS_FLUSH_INTERVAL", "5"))  # Период записи пакета, сек
+        self.ai_calls_buffer_max = 10000  # Максимум ожидающих записи запросов (старые отбрасываются)
+        
+        # Пул заранее сгенерированных ИИ-вопросов (ключ: тема + набор тегов)
+        self.question_pool_file = "cache_data/question_pool.db"  # SQLite-файл пула, None — без сохранения на диск
+        self.question_pool_ttl = 7 * 24 * 3600  # Время жизни вопроса в пуле, сек
+        self.question_pool_max_keys = 500  # Максимум ключей (тема + тег) в пуле (вытеснение по LRU)
+        self.question_pool_max_per_key = 50  # Максимум вопросов на один ключ
+        self.question_pool_low_water = 10  # Порог, ниже которого пул пополняется в фоне
+        self.question_pool_refill_batch = 10  # Сколько вопросов генерировать при пополнении
+        self.question_pool_refill_min_requests = 2  # Пополняются только ключи, запрошенные хотя бы столько раз
+        self.question_pool_max_seen_per_user = 500  # Сколько показанных вопросов помнить на пользователя
+        self.question_pool_flush_interval = 1.0  # Период пакетной записи изменений пула в SQLite, сек
+        
+        # Сбор проверенных ИИ-вопросов в банк вопросов
+        self.harvested_questions_file = "data/packs/harvested.jsonl"  # Пакет собранных вопросов, None — не собирать
+        self.harvest_similarity_threshold = 0.7  # Сходство (оценка Жаккара), с которого вопрос считается дубликатом
+        self.harvest_signature_cache_file = "cache_data/question_signatures.db"  # Кэш MinHash-сигнатур вопросов банка, None — только в памяти
+        self.harvest_min_bank_size = 20  # Сколько собранных вопросов по набору тегов нужно, чтобы не обращаться к ИИ
+        
+        # Кэш персонализированных чек-листов (ключ: тема + теги с ошибками)
+        self.checklist_cache_max_size = 1000  # Максимум чек-листов в кэше (вытеснение по LRU)
+        self.checklist_cache_file = "cache_data/checklist_cache.json"  # Файл кэша, None — только в памяти
+        
+        # Ограничение памяти под сессии, результаты и последние сообщения пользователей
+        self.session_ttl = float(os.getenv("SESSION_TTL", "21600"))  # Брошенная сессия теста удаляется через, сек
+        self.session_max_entries = int(os.getenv("SESSION_MAX_ENTRIES", "50000"))  # Максимум сессий каждого режима (LRU)
+        self.session_max_memory_mb = float(os.getenv("SESSION_MAX_MEMORY_MB", "64"))  # Бюджет памяти сессий режима, МБ (0 — без ограничения)
+        self.results_ttl = float(os.getenv("RESULTS_TTL", "86400"))  # Результаты демо-теста хранятся для чек-листа, сек
+        self.results_max_entries = int(os.getenv("RESULTS_MAX_ENTRIES", "100000"))  # Максимум сохраненных результатов (LRU)
+        self.last_message_ttl = 48 * 3600  # Telegram не дает удалять сообщения бота старше 48 часов
+        self.last_message_max_entries = int(os.getenv("LAST_MESSAGE_MAX_ENTRIES", "100000"))  # Максимум отслеживаемых сообщений
+        # Внешнее хранилище сессий тестов: "memory" — в памяти процесса, "sqlite" — файл SQLite (WAL),
+        # "redis" — сервер Redis (нужен пакет redis); сессии в sqlite/redis переживают перезапуск бота
+        self.session_backend = os.getenv("SESSION_BACKEND", "memory")
+        self.session_db_file = os.getenv("SESSION_DB_FILE", "cache_data/sessions.db")  # Файл SQLite для сессий
+        self.session_redis_url = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")  # Адрес Redis для сессий
+        self.session_flush_interval = float(os.getenv("SESSION_FLUSH_INTERVAL", "1"))  # Период пакетной записи изменений сессий, сек
+        # Состояния FSM (выбор темы, ответы на вопросы) хранятся в SQLite и переживают перезапуск бота;
+        # пустой путь — MemoryStorage aiogram (состояния теряются при перезапуске)
+        self.fsm_storage_file = os.getenv("FSM_STORAGE_FILE", "cache_data/fsm_states.db")
+        self.fsm_flush_interval = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))  # Период пакетной записи состояний FSM, сек
+        self.fsm_state_ttl = float(os.getenv("FSM_STATE_TTL", str(7 * 86400)))  # Состояние без обновлений сбрасывается через, сек
+        self.fsm_cache_max_entries = int(os.getenv("FSM_CACHE_MAX_ENTRIES", "100000"))  # Максимум состояний в памяти (LRU)
+        self.store_sweep_interval = float(os.getenv("STORE_SWEEP_INTERVAL", "60"))  # Период удаления устаревших записей, сек
+        self.user_state_ttl = float(os.getenv("USER_STATE_TTL", str(30 * 86400)))  # Ошибки по тегам и показанные вопросы неактивного пользователя хранятся, сек
+        self.user_state_max_entries = int(os.getenv("USER_STATE_MAX_ENTRIES", "200000"))  # Максимум пользователей (наборов) в таких хранилищах (LRU)
+        self.tag_vocabulary_max_free_tags = int(os.getenv("TAG_VOCABULARY_MAX_FREE_TAGS", "5000"))  # Теги ИИ-вопросов в словаре тегов сверх контента (0 — без ограничения)
         
         # Список разрешенных пользователей для полной версии
         self.authorized_users: List[int] = [764044921, 325878232, 379294891]  # ID пользователей с доступом к полной версии
@@ -0,0 +1,301 @@
+"""
+Офлайн-генерация пакетов вопросов через AIService.
+
+Для каждой комбинации тегов темы генерирует заданное количество вопросов
+пулом воркеров с ограниченной параллельностью, проверяет их, отсеивает почти
+одинаковые и дописывает в JSONL-пакет, который загружает QuestionService.
+Прогресс сохраняется в файл контрольной точки, поэтому прерванную генерацию
+можно продолжить повторным запуском с теми же параметрами.
+
+Попыткой комбинации считается только запрос, на который API ответил (даже
+если вопросы оказались непригодными). Отказы без ответа — разомкнутый
+выключатель, ошибки 5xx/429, таймауты — не расходуют попытки: воркер ждет
+(пока выключатель не начнет пропускать запросы, и с растущей задержкой) и
+повторяет запрос. После --max-failures таких отказов подряд генерация
+останавливается, и повторный запуск продолжит с того же места.
+
+Пример:
+    python generate_question_packs.py --topic ux_ui_basics --per-combo 30 --workers 4 --rpm 30
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+
+from config import config
+from services.question_signatures import question_text, text_digest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Генерация пакетов вопросов для QuestionService")
+    parser.add_argument("--topic", action="append", help="ключ темы (по умолчанию — все темы контента)")
+    parser.add_argument("--tags-per-combo", type=int, default=2, help="сколько тегов в одной комбинации")
+    parser.add_argument("--max-combos", type=int, default=None, help="ограничение числа комбинаций на тему")
+    parser.add_argument("--per-combo", type=int, default=20, help="сколько вопросов сгенерировать на комбинацию")
+    parser.add_argument("--batch-size", type=int, default=10, help="вопросов в одном запросе к API")
+    parser.add_argument("--workers", type=int, default=4, help="одновременных запросов к API")
+    parser.add_argument("--rpm", type=float, default=None, help="лимит запросов в минуту")
+    parser.add_argument("--tpm", type=float, default=None, help="лимит токенов в минуту")
+    parser.add_argument("--output-dir", default=config.question_packs_dir, help="каталог пакетов")
+    parser.add_argument("--max-failures", type=int, default=20,
+                        help="остановиться после стольких запросов подряд без ответа API")
+    parser.add_argument("--max-backoff", type=float, default=60.0, help="максимальная пауза после отказа, сек")
+    return parser.parse_args()
+
+
+def load_themes():
+    """Возвращает темы контента: ключ -> (название, список тегов)"""
+    with open(config.content_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    themes = data.get("themes", [])
+    if isinstance(themes, dict):
+        themes = [dict(theme, id=theme_id) for theme_id, theme in themes.items()]
+
+    result = {}
+    for theme in themes:
+        tags = list(theme.get("tags") or [])
+        if not tags:
+            # У темы нет списка тегов — собираем их из вопросов
+            tags = sorted({tag for q in theme.get("questions", []) for tag in q.get("tags", [])})
+        result[theme["id"]] = (theme.get("name", theme["id"]), tags)
+    return result
+
+
+def is_valid(question):
+    """Дополнительная проверка сверх AIService._validate_question"""
+    if not str(question.get("question", "")).strip():
+        return False
+    options = [str(option).strip() for option in question["options"]]
+    if not all(options) or len(set(options)) != len(options):
+        return False
+    return isinstance(question.get("tags"), list)
+
+
+class PackWriter:
+    """JSONL-пакет темы с отсевом дубликатов и контрольной точкой"""
+
+    def __init__(self, path, index, model, signature_cache=None):
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint.json"
+        self.index = index
+        self.signature_cache = signature_cache
+        self.model = model
+        # Ключ комбинации -> количество сгенерированных вопросов и попыток
+        self.generated = {}
+        self.attempts = {}
+        self.duplicates = 0
+        self.rejected = 0
+        self._resume()
+
+    @staticmethod
+    def combo_key(tags):
+        return ",".join(sorted(tags))
+
+    def _resume(self):
+        """Восстанавливает прогресс: количество вопросов — по пакету, попытки — по контрольной точке"""
+        if os.path.exists(self.path):
+            records = []
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    key = self.combo_key(record.get("request_tags", []))
+                    self.generated[key] = self.generated.get(key, 0) + 1
+                    records.append(record)
+            if self.signature_cache is not None:
+                for record, sig in zip(records, self.signature_cache.signatures(records)):
+                    self.index.add_signature(record["id"], sig)
+            else:
+                for record in records:
+                    self.index.add(record["id"], question_text(record))
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                self.attempts = json.load(f).get("attempts", {})
+
+    def save_checkpoint(self):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"attempts": self.attempts, "generated": self.generated}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def add(self, theme_id, tags, questions):
+        """Дописывает в пакет новые вопросы; возвращает количество добавленных"""
+        key = self.combo_key(tags)
+        added = 0
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for question in questions:
+                if not is_valid(question):
+                    self.rejected += 1
+                    continue
+                text = question_text(question)
+                if self.index.query(text):
+                    self.duplicates += 1
+                    continue
+                digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+                record = {
+                    "id": f"g_{digest}",
+                    "question": question["question"],
+                    "options": question["options"],
+                    "correct_answer": question["correct_answer"],
+                    "tags": question["tags"],
+                    "theme": theme_id,
+                    "request_tags": sorted(tags),
+                    "source": {
+                        "type": "ai",
+                        "model": self.model,
+                        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+                    }
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                sig = self.index.add(record["id"], text)
+                if self.signature_cache is not None:
+                    self.signature_cache.put_many([(text_digest(text), sig)])
+                added += 1
+        self.generated[key] = self.generated.get(key, 0) + added
+        return added
+
+
+class ApiBackoff:
+    """Паузы после запросов без ответа API; общие для всех воркеров"""
+
+    def __init__(self, ai_service, max_failures, max_backoff):
+        self.ai_service = ai_service
+        self.max_failures = max_failures
+        self.max_backoff = max_backoff
+        # Отказы подряд (сбрасываются первым ответом API)
+        self.failures = 0
+        self.total_failures = 0
+
+    @property
+    def exhausted(self):
+        return self.failures >= self.max_failures
+
+    async def request(self, topic, num, priority):
+        """
+        Запрашивает вопросы. Возвращает список вопросов, если API ответил
+        (пустой — если ответ непригоден), или None после паузы, если ответа не было
+        """
+        from services.ai_scheduler import AdmissionRejected
+        from services.ai_service import AIProviderError
+        from services.circuit_breaker import CircuitOpenError
+        import aiohttp
+
+        try:
+            questions = await self.ai_service.request_questions(topic, num, priority=priority)
+        except CircuitOpenError:
+            # Запрос не отправлялся: ждем, пока выключатель начнет пропускать пробные запросы
+            await self._pause(self.ai_service.circuit_breaker.retry_after(), "выключатель разомкнут")
+            return None
+        except (AIProviderError, AdmissionRejected, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            await self._pause(0.0, str(e) or type(e).__name__)
+            return None
+        except ValueError as e:
+            # Ответ получен, но не разобран (или ошибка 4xx): попытка засчитывается
+            print(f"Непригодный ответ API: {e}")
+            questions = []
+        self.failures = 0
+        return questions
+
+    async def _pause(self, at_least, reason):
+        self.failures += 1
+        self.total_failures += 1
+        delay = max(at_least, min(self.max_backoff, 2 ** (self.failures - 1)))
+        print(f"Нет ответа API ({reason}), отказ {self.failures} подряд, пауза {delay:.0f} сек")
+        await asyncio.sleep(delay)
+
+
+async def run(args):
+    # Лимиты задаются до создания AIService: их применяет его планировщик
+    config.ai_max_concurrency = args.workers
+    if args.rpm is not None:
+        config.ai_requests_per_minute = args.rpm
+    if args.tpm is not None:
+        config.ai_tokens_per_minute = args.tpm
+
+    from services.ai_scheduler import PRIORITY_BACKGROUND
+    from services.ai_service import AIService
+    from services.question_service import QuestionService
+    from services.question_signatures import SignatureCache, iter_question_signatures
+    from utils.text_similarity import LSHIndex
+
+    if not config.ai_api_key:
+        print("Не задан OPENAI_API_KEY")
+        return
+
+    ai_service = AIService()
+    themes = load_themes()
+    topics = args.topic or list(themes)
+
+    # Индекс дубликатов включает уже имеющийся банк вопросов и загруженные пакеты;
+    # сигнатуры берутся из скомпилированной базы и кэша, вопросы базы не разбираются
+    question_service = QuestionService()
+    index = LSHIndex(threshold=config.harvest_similarity_threshold)
+    signature_cache = SignatureCache(config.harvest_signature_cache_file, index.hasher)
+    for theme_id, question_id, sig in iter_question_signatures(question_service, signature_cache):
+        index.add_signature(f"{theme_id}:{question_id}", sig)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    max_attempts_per_combo = math.ceil(args.per_combo / args.batch_size) * 3
+    backoff = ApiBackoff(ai_service, args.max_failures, args.max_backoff)
+
+    try:
+        for theme_id in topics:
+            if theme_id not in themes:
+                print(f"Тема {theme_id} не найдена в {config.content_file}")
+                continue
+            if backoff.exhausted:
+                break
+            theme_name, tags = themes[theme_id]
+            combos = list(itertools.combinations(sorted(tags), args.tags_per_combo))[:args.max_combos]
+            writer = PackWriter(os.path.join(args.output_dir, f"generated_{theme_id}.jsonl"), index,
+                                ai_service.model, signature_cache)
+
+            queue = asyncio.Queue()
+            for combo in combos:
+                queue.put_nowait(combo)
+            total_target = len(combos) * args.per_combo
+            started_at = time.monotonic()
+
+            async def worker():
+                while not backoff.exhausted:
+                    try:
+                        combo = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    key = writer.combo_key(combo)
+                    while (writer.generated.get(key, 0) < args.per_combo
+                           and writer.attempts.get(key, 0) < max_attempts_per_combo):
+                        if backoff.exhausted:
+                            return
+                        num = min(args.batch_size, args.per_combo - writer.generated.get(key, 0))
+                        topic = f"{theme_name} по следующим тегам: {', '.join(combo)}"
+                        questions = await backoff.request(topic, num, PRIORITY_BACKGROUND)
+                        if questions is None:
+                            # Ответа не было: попытка не засчитывается и не сохраняется
+                            continue
+                        writer.attempts[key] = writer.attempts.get(key, 0) + 1
+                        writer.add(theme_id, list(combo), questions)
+                        writer.save_checkpoint()
+
+                        done = sum(min(count, args.per_combo) for count in writer.generated.values())
+                        elapsed = time.monotonic() - started_at
+                        print(f"[{theme_id}] {done}/{total_target} вопросов, "
+                              f"дубликатов {writer.duplicates}, отклонено {writer.rejected}, {elapsed:.0f} сек")
+
+            await asyncio.gather(*(worker() for _ in range(args.workers)))
+            print(f"Пакет {writer.path}: {sum(writer.generated.values())} вопросов")
+        if backoff.exhausted:
+            print(f"API не отвечает ({backoff.failures} отказов подряд), генерация остановлена; "
+                  f"прогресс сохранен, повторите запуск позже")
+    finally:
+        signature_cache.close()
+        await ai_service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -2,16 +2,23 @@ from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import json
 import asyncio
 
 from services.ai_service import AIService
+from services.ai_quota import current_user, user_context
 from services.question_service import QuestionService
+from services.quiz_session import QuizSession
+from services.question_pool_service import QuestionPool
+from services.question_harvest_service import QuestionHarvester
+from services.analytics_service import analytics_service
 from services.test_service import TestService
 from services.checklist_service import ChecklistService
 from config import config
 from utils.logger import logger
+from services.session_store import SessionStore, session_backend
+from utils.bounded_store import BoundedStore
 from utils.message_manager import message_manager
 
 class FullVersionStates(StatesGroup):
@@ -20,15 +27,82 @@ class FullVersionStates(StatesGroup):
     ANSWERING = State()
     GETTING_RESULTS = State()
 
+class FullVersionSession(QuizSession):
+    """Сессия полной версии: движок теста и данные темы, тегов и фоновых генераций"""
+    __slots__ = ("topic_key", "topic_name", "tags", "last_failed_tags", "needs_ai_questions",
+                 "ai_questions_count", "expected_total", "ai_prefetch", "next_batch_prefetch")
+    
+    def __init__(self, topic_key: str, topic_name: str):
+        super().__init__()
+        self.topic_key = topic_key
+        self.topic_name = topic_name
+        # Теги вопросов из базы — для генерации ИИ-вопросов
+        self.tags: List[str] = []
+        # Теги с ошибками последнего теста: [(название, количество)]
+        self.last_failed_tags: List[Any] = []
+        self.needs_ai_questions = False
+        self.ai_questions_count = 0
+        # Ожидаемое число вопросов, пока ИИ-вопросы догружаются в фоне (None — сколько есть)
+        self.expected_total: Optional[int] = None
+        # Описания фоновых генераций (см. _start_ai_prefetch)
+        self.ai_prefetch: Optional[Dict[str, Any]] = None
+        self.next_batch_prefetch: Optional[Dict[str, Any]] = None
+    
+    def to_state(self) -> Dict[str, Any]:
+        state = super().to_state()
+        state.update({
+            "topic_key": self.topic_key,
+            "topic_name": self.topic_name,
+            "tags": self.tags,
+            "last_failed_tags": self.last_failed_tags,
+            "needs_ai_questions": self.needs_ai_questions,
+            "ai_questions_count": self.ai_questions_count
+        })
+        return state
+    
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        super().restore_state(state)
+        self.topic_key = state.get("topic_key", "ux_ui_basics")
+        self.topic_name = state.get("topic_name", "UX/UI дизайн")
+        self.tags = state.get("tags", [])
+        self.last_failed_tags = [tuple(item) for item in state.get("last_failed_tags", [])]
+        self.needs_ai_questions = state.get("needs_ai_questions", False)
+        self.ai_questions_count = state.get("ai_questions_count", 0)
+        # Фоновые генерации не переживают перезапуск: тест продолжается с уже полученными вопросами
+        self.expected_total = None
+        self.ai_prefetch = None
+        self.next_batch_prefetch = None
+
 class FullVersionHandler:
     def __init__(self):
         self.ai_service = AIService()
         self.question_service = QuestionService()
+        if self.question_service.store is not None:
+            analytics_service.register_runtime_stats("Хранилище вопросов", self.question_service.store.get_stats)
+        analytics_service.register_runtime_stats(
+            "Выбор вопросов по слабым темам", lambda: self.question_service.weakness_sampler.get_stats()
+        )
+        self.question_harvester = QuestionHarvester(self.question_service)
+        analytics_service.register_runtime_stats("Банк собранных ИИ-вопросов", self.question_harvester.get_stats)
+        self.question_pool = QuestionPool(self.ai_service, harvester=self.question_harvester)
         self.test_service = TestService()
         self.checklist_service = ChecklistService()
         
         # Данные по пользователям и их тестам
-        self.user_sessions: Dict[int, Dict[str, Any]] = {}
+        # Сессии сохраняются во внешнее хранилище (config.session_backend); брошенные удаляются
+        # по TTL (вместе с их фоновыми генерациями), число и память сессий в процессе ограничены
+        self.user_sessions: Dict[int, FullVersionSession] = SessionStore(
+            "Сессии полной версии", "full", FullVersionSession, session_backend,
+            ttl=config.session_ttl, max_entries=config.session_max_entries,
+            max_bytes=int(config.session_max_memory_mb * 1024 * 1024),
+            on_evict=lambda user_id, session: self._cancel_ai_prefetch(session),
+            on_load=self._resume_ai_prefetch
+        )
+        # Накопленные ошибки пользователя по тегам (для выбора вопросов по слабым темам)
+        # (удаляются, если пользователь не проходил тесты дольше config.user_state_ttl)
+        self.user_tag_errors: Dict[int, Dict[int, int]] = BoundedStore(
+            "Ошибки пользователей по тегам", ttl=config.user_state_ttl, max_entries=config.user_state_max_entries
+        )
         
         # Количество вопросов в тесте
         self.total_questions = 10
@@ -38,6 +112,157 @@ class FullVersionHandler:
         
         logger.info("FullVersionHandler initialized")
         
+    def _validate_ai_questions(self, ai_questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Оставляет только сгенерированные вопросы со всеми необходимыми ключами"""
+        valid_ai_questions = []
+        for q in ai_questions:
+            if all(key in q for key in ['question', 'options', 'correct_answer']):
+                # Добавляем идентификаторы к вопросам, чтобы избежать конфликтов
+                if 'id' not in q:
+                    q['id'] = f"ai_{len(valid_ai_questions)}"
+                valid_ai_questions.append(q)
+            else:
+                logger.error(f"Сгенерированный вопрос не содержит все необходимые ключи: {q}")
+        return valid_ai_questions
+        
+    def _start_ai_prefetch(self, user_id: int, session: FullVersionSession, num_questions: int,
+                           target: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Запускает фоновую потоковую генерацию ИИ-вопросов для сессии.
+        Вопросы добавляются в список target по одному, как только готовы.
+        Возвращает описание генерации (задача, список, событие) или None,
+        если генерация невозможна (нет ключа API или тегов).
+        """
+        if not config.ai_api_key or not session.tags:
+            return None
+            
+        prefetch = {
+            "questions": target,
+            "event": asyncio.Event(),
+            "received": 0
+        }
+        prefetch["task"] = asyncio.create_task(self._stream_ai_questions(user_id, session, num_questions, prefetch))
+        return prefetch
+        
+    def _resume_ai_prefetch(self, user_id: int, session: FullVersionSession) -> None:
+        """
+        Сессия восстановлена из хранилища без фоновой генерации: если ИИ-вопросы
+        текущего теста еще не получены, генерация запускается заново
+        """
+        missing = self.total_questions - len(session.questions)
+        if (session.current >= self.total_questions or missing <= 0
+                or not (session.needs_ai_questions or session.ai_questions_count)):
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        prefetch = self._start_ai_prefetch(user_id, session, missing, session.questions)
+        if prefetch is not None:
+            session.ai_prefetch = prefetch
+            session.expected_total = self.total_questions
+            logger.info(f"Фоновая генерация {missing} ИИ-вопросов возобновлена для пользователя {user_id}")
+
+    async def _stream_ai_questions(self, user_id: int, session: FullVersionSession, num_questions: int,
+                                   prefetch: Dict[str, Any]) -> None:
+        """Получает вопросы ИИ по теме и тегам (из пула или потоковой генерацией) и добавляет валидные в сессию"""
+        unique_tags = session.tags
+        logger.info(f"Генерация вопросов с тегами: {', '.join(unique_tags)}")
+        # Задача генерации выполняется в своем контексте: запросы к API учитываются в квоте пользователя
+        current_user.set(user_id)
+        
+        try:
+            async for question in self.question_pool.stream_questions(
+                user_id=user_id,
+                topic_key=session.topic_key,
+                topic_name=session.topic_name,
+                tags=unique_tags,
+                count=num_questions
+            ):
+                valid_ai_questions = self._validate_ai_questions([question])
+                if valid_ai_questions:
+                    prefetch["questions"].extend(valid_ai_questions)
+                    prefetch["received"] += 1
+                    prefetch["event"].set()
+            logger.info(f"Получено {prefetch['received']} сгенерированных вопросов")
+        except Exception as e:
+            logger.error(f"Error generating questions: {str(e)}")
+        finally:
+            # Будим ожидающего, чтобы он увидел завершение генерации
+            prefetch["event"].set()
+            
+    async def _wait_for_ai_question(self, prefetch: Dict[str, Any], index: int) -> bool:
+        """
+        Дожидается, пока в списке вопросов генерации появится вопрос с индексом index.
+        Ждет не дольше config.ai_prefetch_wait_timeout; при таймауте отменяет генерацию.
+        
+        Returns:
+            True, если вопрос готов, иначе False (генерация завершилась или не уложилась во время)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config.ai_prefetch_wait_timeout
+        task = prefetch["task"]
+        event = prefetch["event"]
+        
+        while len(prefetch["questions"]) <= index:
+            if task.done():
+                return False
+            remaining = deadline - loop.time()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=max(remaining, 0))
+            except asyncio.TimeoutError:
+                logger.error(f"Фоновая генерация вопросов не уложилась в {config.ai_prefetch_wait_timeout} сек")
+                task.cancel()
+                return False
+            event.clear()
+        return True
+            
+    def _fill_with_db_questions(self, user_id: int, session: FullVersionSession, count: int) -> int:
+        """
+        Добавляет в сессию до count вопросов из базы по теме сессии, которых в ней еще нет.
+        Используется, когда ИИ-генерация недоступна или отклонена планировщиком.
+        
+        Returns:
+            Количество добавленных вопросов
+        """
+        if count <= 0:
+            return 0
+            
+        used_ids = {q.get("id") for q in session.questions}
+        db_questions = self._pick_db_questions(user_id, session, count, used_ids)
+        
+        session.questions.extend(db_questions)
+        logger.info(f"ИИ-вопросы недоступны, добавлено {len(db_questions)} вопросов из базы")
+        return len(db_questions)
+        
+    def _pick_db_questions(self, user_id: int, session: FullVersionSession, count: int,
+                           exclude_ids: Optional[set] = None) -> List[Dict[str, Any]]:
+        """
+        Выбирает из базы до count вопросов темы сессии: сначала по слабым тегам
+        пользователя (с ошибками, а если их нет — тегам сессии), затем любые
+        """
+        topic_key = session.topic_key
+        exclude_ids = set(exclude_ids or ())
+        weak_tags = [tag for tag, _ in session.last_failed_tags] or session.tags
+        
+        questions = self.question_service.get_questions_by_tags(
+            weak_tags, count, theme_key=topic_key, exclude_ids=exclude_ids
+        )
+        if len(questions) < count:
+            exclude_ids.update(q.get("id") for q in questions)
+            candidates = self.question_service.get_questions_by_theme(
+                topic_key, count + len(exclude_ids), user_id=user_id
+            )
+            questions.extend([q for q in candidates if q.get("id") not in exclude_ids][:count - len(questions)])
+        return questions
+        
+    def _cancel_ai_prefetch(self, session: FullVersionSession) -> None:
+        """Отменяет незавершенные фоновые генерации сессии"""
+        for prefetch in (session.ai_prefetch, session.next_batch_prefetch):
+            if prefetch is not None and not prefetch["task"].done():
+                prefetch["task"].cancel()
+        session.ai_prefetch = session.next_batch_prefetch = None
+        
     async def handle_full_version_start(self, callback_query: types.CallbackQuery, state: FSMContext = None):
         """Обработчик начала взаимодействия с полной версией"""
         user_id = callback_query.from_user.id
@@ -121,15 +346,13 @@ class FullVersionHandler:
         # Сохраняем как последнее сообщение
         message_manager.last_messages[user_id] = preparing_message
         
+        # Отменяем фоновые генерации предыдущей сессии, если она была
+        previous_session = self.user_sessions.get(user_id)
+        if previous_session:
+            self._cancel_ai_prefetch(previous_session)
+        
         # Инициализация сессии пользователя
-        self.user_sessions[user_id] = {
-            "topic": topic_key,
-            "topic_name": topic_name,
-            "current_question": 0,
-            "questions": [],
-            "answers": [],
-            "correct_count": 0
-        }
+        self.user_sessions[user_id] = FullVersionSession(topic_key, topic_name)
         
         # Получаем вопросы из соответствующего файла по теме
         theme_mapping = {
@@ -141,32 +364,39 @@ class FullVersionHandler:
         
         # В полной версии всегда генерируем точно 5 тематических вопросов
         db_questions_count = 5
-        db_questions = self.question_service.get_questions_by_theme(theme_key, db_questions_count)
+        # Вопросы по тегам, в которых пользователь ошибался, выпадают чаще
+        db_questions = self.question_service.get_weighted_questions(
+            theme_key, db_questions_count, self.user_tag_errors.get(user_id, {}), user_id=user_id
+        )
         
         # Логируем информацию о загруженных вопросах
         logger.info(f"Загружено {len(db_questions)} вопросов по теме {theme_key}")
         
-        # На первом этапе используем только вопросы из базы данных
-        # Генерацию ИИ-вопросов будем делать после ответа на 5-й вопрос
-        ai_questions = []
-        
         # Сохраняем информацию о необходимости генерации вопросов после 5-го
-        self.user_sessions[user_id]["needs_ai_questions"] = True
-        self.user_sessions[user_id]["ai_questions_count"] = self.total_questions - len(db_questions)
-        self.user_sessions[user_id]["topic_name"] = topic_name
-        self.user_sessions[user_id]["topic_key"] = theme_key
+        self.user_sessions[user_id].needs_ai_questions = True
+        self.user_sessions[user_id].ai_questions_count = self.total_questions - len(db_questions)
+        self.user_sessions[user_id].topic_name = topic_name
+        self.user_sessions[user_id].topic_key = theme_key
         
         # Сохраняем теги для будущей генерации
         unique_tags = self.question_service.get_tags_from_questions_list(db_questions)
-        self.user_sessions[user_id]["tags"] = unique_tags
+        self.user_sessions[user_id].tags = unique_tags
         
         logger.info(f"Сохранены теги для будущей генерации вопросов: {', '.join(unique_tags)}")
         
-        # Объединяем вопросы из базы и сгенерированные (изначально ai_questions пустой)
-        all_questions = db_questions + ai_questions
+        # На первом этапе показываем вопросы из базы данных, а ИИ-вопросы генерируются
+        # в фоне, пока пользователь на них отвечает, и дописываются в тот же список
+        all_questions = db_questions
+        self.user_sessions[user_id].questions = all_questions
+        ai_prefetch = self._start_ai_prefetch(
+            user_id, self.user_sessions[user_id], self.user_sessions[user_id].ai_questions_count, all_questions
+        )
         
-        # Если вопросов меньше чем нужно, добавляем вопросы из другой темы
-        if len(all_questions) < self.total_questions:
+        if ai_prefetch is not None:
+            self.user_sessions[user_id].ai_prefetch = ai_prefetch
+            self.user_sessions[user_id].expected_total = self.total_questions
+        elif len(all_questions) < self.total_questions:
+            # Генерация невозможна — добавляем вопросы из другой темы
             logger.warning(f"Недостаточно вопросов ({len(all_questions)}), добавляем из другой темы")
             
             # Определяем ключ другой темы
@@ -175,41 +405,39 @@ class FullVersionHandler:
             # Получаем дополнительные вопросы
             additional_count = self.total_questions - len(all_questions)
             additional_questions = self.question_service.get_questions_by_theme(
-                other_theme_key, additional_count
+                other_theme_key, additional_count, user_id=user_id
             )
             
             all_questions.extend(additional_questions)
             logger.info(f"Добавлено {len(additional_questions)} вопросов из темы {other_theme_key}")
-        
-        # Ограничиваем количество вопросов до total_questions
-        all_questions = all_questions[:self.total_questions]
+            
+            # Ограничиваем количество вопросов до total_questions
+            del all_questions[self.total_questions:]
+            
         logger.info(f"Итого подготовлено {len(all_questions)} вопросов для теста")
         
-        # Сохраняем вопросы в сессии пользователя
-        self.user_sessions[user_id]["questions"] = all_questions
-        
         # Переход к первому вопросу
         await self._send_question(callback_query, user_id)
         
         # Устанавливаем состояние ответа на вопросы
         await state.set_state(FullVersionStates.ANSWERING)
         
-    async def _send_question(self, callback_query: types.CallbackQuery, user_id: int):
-        """Отправляет текущий вопрос пользователю"""
+    async def _send_question(self, callback_query: types.CallbackQuery, user_id: int, state: FSMContext = None):
+        """Отправляет текущий вопрос пользователю (state нужен, чтобы сбросить состояние после результатов)"""
         session = self.user_sessions.get(user_id)
         if not session:
             await callback_query.message.answer("Ошибка: сессия не найдена. Пожалуйста, начните заново.")
             return
             
-        current_q_idx = session["current_question"]
+        current_q_idx = session.current
         
         # Проверяем, завершился ли тест
-        if current_q_idx >= len(session["questions"]) or current_q_idx >= self.total_questions:
-            await self._send_results(callback_query, user_id)
+        if current_q_idx >= len(session.questions) or current_q_idx >= self.total_questions:
+            await self._send_results(callback_query, user_id, state)
             return
             
         # Получаем текущий вопрос
-        question = session["questions"][current_q_idx]
+        question = session.questions[current_q_idx]
         
         # Формируем текст вариантов ответов, который будет частью сообщения
         options_text = ""
@@ -218,7 +446,7 @@ class FullVersionHandler:
         
         # Формируем текст вопроса со всеми вариантами ответов
         question_text = f"""
-<b>Вопрос {current_q_idx + 1}/{min(len(session['questions']), self.total_questions)}</b>
+<b>Вопрос {current_q_idx + 1}/{min(session.expected_total or len(session.questions), self.total_questions)}</b>
 
 {question['question']}
 
@@ -253,111 +481,77 @@ class FullVersionHandler:
             await callback_query.answer("Ошибка: сессия не найдена.")
             return
             
-        current_q_idx = session["current_question"]
-        question = session["questions"][current_q_idx]
-        
-        # Записываем ответ пользователя
-        session["answers"].append({
-            "question_idx": current_q_idx,
-            "user_answer": answer_idx,
-            "correct_answer": question["correct_answer"],
-            "is_correct": answer_idx == question["correct_answer"],
-            "tags": question.get("tags", [])
-        })
+        question = session.current_question()
+        if question is None:
+            await callback_query.answer("Ошибка: вопрос не найден.")
+            return
         
-        # Если ответ правильный, увеличиваем счетчик
-        if answer_idx == question["correct_answer"]:
-            session["correct_count"] += 1
+        # Записываем ответ пользователя и переходим к следующему вопросу; ошибки по тегам
+        # сразу учитываются в сессии и в накопленных ошибках пользователя
+        if session.answer(answer_idx, self.user_tag_errors.setdefault(user_id, {})):
             await callback_query.answer("Верно! ✅")
         else:
             await callback_query.answer(f"Неверно! Правильный ответ: {question['options'][question['correct_answer']]}")
         
         # Больше не нужно удалять сообщение явно, т.к. используем message_manager
         
-        # Переходим к следующему вопросу
-        session["current_question"] += 1
-        
-        # Проверяем, нужно ли генерировать AI-вопросы
-        if session.get("needs_ai_questions", False) and session["current_question"] == 5:
-            # Уже ответили на 5 вопросов из базы данных, теперь генерируем AI-вопросы
-            
-            # Удаляем предыдущее сообщение
-            await message_manager.delete_last_message(user_id)
+        # Проверяем, включена ли генерация AI-вопросов
+        if session.needs_ai_questions and session.current == 5:
+            # Уже ответили на 5 вопросов из базы данных, дальше идут AI-вопросы
+            session.needs_ai_questions = False
             
-            # Отправляем сообщение о генерации
-            generating_message = await callback_query.message.answer("Генерация персонализированных вопросов с помощью ИИ...")
-            
-            # Сохраняем как последнее сообщение
-            message_manager.last_messages[user_id] = generating_message
-            
-            try:
-                # Проверяем наличие ключа API
-                if not config.ai_api_key:
-                    logger.error("API ключ не найден, ИИ-генерация отключена")
-                    
-                    # Удаляем предыдущее сообщение
-                    await message_manager.delete_last_message(user_id)
-                    
-                    # Отправляем сообщение об ошибке
-                    error_message = await callback_query.message.answer(
-                        "ИИ-генерация отключена. Используем только вопросы из базы данных."
-                    )
-                    
-                    # Сохраняем как последнее сообщение
-                    message_manager.last_messages[user_id] = error_message
-                else:
-                    # Получаем количество вопросов для генерации
-                    ai_questions_count = session.get("ai_questions_count", 5)
-                    topic_name = session.get("topic_name", "UX/UI дизайн")
-                    unique_tags = session.get("tags", [])
-                    
-                    if unique_tags:
-                        tags_text = ", ".join(unique_tags)
-                        logger.info(f"Генерация вопросов с тегами: {tags_text}")
-                        
-                        # Используем теги вместе с темой для более точной генерации вопросов
-                        topic_with_tags = f"{topic_name} по следующим тегам: {tags_text}"
-                        
-                        ai_questions = await self.ai_service.generate_questions(
-                            topic=topic_with_tags, 
-                            num_questions=ai_questions_count
-                        )
-                        
-                        # Проверяем что каждый сгенерированный вопрос содержит все необходимые ключи
-                        valid_ai_questions = []
-                        for q in ai_questions:
-                            if all(key in q for key in ['question', 'options', 'correct_answer']):
-                                # Добавляем идентификаторы к вопросам, чтобы избежать конфликтов
-                                if 'id' not in q:
-                                    q['id'] = f"ai_{len(valid_ai_questions)}"
-                                valid_ai_questions.append(q)
-                            else:
-                                logger.error(f"Сгенерированный вопрос не содержит все необходимые ключи: {q}")
-                        
-                        # Добавляем сгенерированные вопросы в список вопросов пользователя
-                        session["questions"].extend(valid_ai_questions)
-                        logger.info(f"Добавлено {len(valid_ai_questions)} сгенерированных вопросов")
-                        
-                        # Отключаем флаг генерации, чтобы больше не генерировать
-                        session["needs_ai_questions"] = False
-            except Exception as e:
-                logger.error(f"Error generating questions: {str(e)}")
+            if session.ai_prefetch is None:
+                logger.error("API ключ не найден, ИИ-генерация отключена")
                 
                 # Удаляем предыдущее сообщение
                 await message_manager.delete_last_message(user_id)
                 
                 # Отправляем сообщение об ошибке
                 error_message = await callback_query.message.answer(
-                    "Произошла ошибка при генерации вопросов. Используем только вопросы из базы данных."
+                    "ИИ-генерация отключена. Используем только вопросы из базы данных."
                 )
                 
                 # Сохраняем как последнее сообщение
                 message_manager.last_messages[user_id] = error_message
+                
+        # Если следующий AI-вопрос еще генерируется в фоне, дожидаемся его
+        prefetch = session.ai_prefetch
+        next_q_idx = session.current
+        if (prefetch is not None
+                and next_q_idx >= len(session.questions)
+                and next_q_idx < (session.expected_total or 0)):
+            if not prefetch["task"].done():
+                # Удаляем предыдущее сообщение
+                await message_manager.delete_last_message(user_id)
+                
+                # Отправляем сообщение о генерации
+                generating_message = await callback_query.message.answer("Генерация персонализированных вопросов с помощью ИИ...")
+                
+                # Сохраняем как последнее сообщение
+                message_manager.last_messages[user_id] = generating_message
+                
+            if not await self._wait_for_ai_question(prefetch, next_q_idx):
+                # Больше ИИ-вопросов не будет — добираем недостающие вопросы из базы
+                session.ai_prefetch = None
+                self._fill_with_db_questions(user_id, session, session.expected_total - len(session.questions))
+                session.expected_total = len(session.questions)
+                
+                if next_q_idx >= len(session.questions):
+                    # Удаляем предыдущее сообщение
+                    await message_manager.delete_last_message(user_id)
+                    
+                    # Отправляем сообщение об ошибке
+                    error_message = await callback_query.message.answer(
+                        "Произошла ошибка при генерации вопросов. Используем только вопросы из базы данных."
+                    )
+                    
+                    # Сохраняем как последнее сообщение
+                    message_manager.last_messages[user_id] = error_message
         
         # Отправляем следующий вопрос или результаты
-        await self._send_question(callback_query, user_id)
+        await self._send_question(callback_query, user_id, state)
         
-    async def _send_results(self, callback_query: types.CallbackQuery, user_id: int):
+    async def _send_results(self, callback_query: types.CallbackQuery, user_id: int, state: FSMContext = None):
         """Отправляет результаты теста"""
         session = self.user_sessions.get(user_id)
         if not session:
@@ -372,23 +566,16 @@ class FullVersionHandler:
             return
             
         # Формируем статистику
-        total_questions = len(session["answers"])
-        correct_answers = session["correct_count"]
+        total_questions = session.answered
+        correct_answers = session.correct_count
         percentage = (correct_answers / total_questions) * 100 if total_questions > 0 else 0
         
-        # Собираем информацию о тегах с ошибками
-        tag_errors = {}
-        for answer in session["answers"]:
-            if not answer["is_correct"]:
-                for tag in answer["tags"]:
-                    tag_errors[tag] = tag_errors.get(tag, 0) + 1
-                    
-        # Сортируем теги по количеству ошибок
-        sorted_tags = sorted(tag_errors.items(), key=lambda x: x[1], reverse=True)
+        # Ошибки по тегам накоплены сессией при ответах, отсортированы по количеству ошибок
+        sorted_tags = session.failed_tags()
         
         # Формируем результаты теста
         result_text = f"""
-📊 <b>Результаты теста по теме "{session['topic_name']}"</b>
+📊 <b>Результаты теста по теме "{session.topic_name}"</b>
 
 ✅ Правильных ответов: {correct_answers} из {total_questions} ({percentage:.1f}%)
 
@@ -410,7 +597,13 @@ class FullVersionHandler:
         markup = types.InlineKeyboardMarkup(inline_keyboard=buttons)
         
         # Сохраняем информацию о тегах с ошибками для генерации чек-листа
-        session["failed_tags"] = sorted_tags
+        session.last_failed_tags = sorted_tags
+        
+        # Пока пользователь смотрит результаты, заранее генерируем вопросы для продолжения теста
+        self._cancel_ai_prefetch(session)
+        next_batch_prefetch = self._start_ai_prefetch(user_id, session, self.total_questions, [])
+        if next_batch_prefetch is not None:
+            session.next_batch_prefetch = next_batch_prefetch
         
         # Удаляем предыдущее сообщение
         await message_manager.delete_last_message(user_id)
@@ -421,17 +614,12 @@ class FullVersionHandler:
         # Сохраняем сообщение как последнее
         message_manager.last_messages[user_id] = new_message
         
-        # Сбрасываем состояние
-        try:
-            # Получаем текущее состояние из контекста бота
-            from aiogram.fsm.context import FSMContext
-            state = FSMContext(
-                storage=callback_query.bot.get_current().fsm_storage,
-                key=callback_query.from_user.id
-            )
-            await state.clear()
-        except Exception as e:
-            logger.error(f"Error clearing state: {str(e)}")
+        # Сбрасываем состояние ответа на вопросы
+        if state is not None:
+            try:
+                await state.clear()
+            except Exception as e:
+                logger.error(f"Error clearing state: {str(e)}")
         
     async def handle_checklist_request(self, callback_query: types.CallbackQuery):
         """Обработчик запроса на получение персонализированного чек-листа"""
@@ -439,7 +627,7 @@ class FullVersionHandler:
         
         # Проверяем, есть ли сессия пользователя
         session = self.user_sessions.get(user_id)
-        if not session or not session.get("failed_tags"):
+        if not session or not session.last_failed_tags:
             # Отвечаем на callback
             await callback_query.answer("Ошибка: данные о тесте не найдены.")
             
@@ -465,8 +653,8 @@ class FullVersionHandler:
         message_manager.last_messages[user_id] = generating_message
         
         # Получаем информацию о тегах с ошибками
-        failed_tags = session.get("failed_tags", [])
-        topic_name = session.get("topic_name", "UX/UI Дизайн")
+        failed_tags = session.last_failed_tags
+        topic_name = session.topic_name
         
         # Если нет ошибок, отправляем стандартный чек-лист
         if not failed_tags:
@@ -507,10 +695,11 @@ class FullVersionHandler:
             
         try:
             # Генерируем персонализированный чек-лист с помощью ИИ
-            ai_checklist = await self.ai_service.generate_personalized_checklist(
-                failed_tags=failed_tags,
-                topic=topic_name
-            )
+            with user_context(user_id):
+                ai_checklist = await self.ai_service.generate_personalized_checklist(
+                    failed_tags=failed_tags,
+                    topic=topic_name
+                )
             
             # Если генерация успешна, отправляем результат
             if ai_checklist and ai_checklist.get("resources"):
@@ -618,61 +807,45 @@ class FullVersionHandler:
         # Сохраняем как последнее сообщение
         message_manager.last_messages[user_id] = generating_message
         
-        # Получаем текущую тему и теги
-        topic_name = session.get("topic_name", "UX/UI дизайн")
-        topic_key = session.get("topic_key", "ux_ui_basics")
-        unique_tags = session.get("tags", [])
+        # Получаем текущую тему
+        topic_key = session.topic_key
         
         # Сбрасываем данные для нового круга вопросов
-        session["current_question"] = 0
-        session["questions"] = []
+        session.current = 0
+        session.questions = []
+        session.expected_total = None
         
         try:
-            # Генерация новых вопросов с помощью ИИ
-            if unique_tags and config.ai_api_key:
-                tags_text = ", ".join(unique_tags)
-                logger.info(f"Генерация новых вопросов с тегами: {tags_text}")
+            # Используем вопросы, которые начали генерироваться в фоне во время показа результатов
+            next_batch_prefetch, session.next_batch_prefetch = session.next_batch_prefetch, None
+            if next_batch_prefetch is None:
+                next_batch_prefetch = self._start_ai_prefetch(user_id, session, self.total_questions, [])
                 
-                # Используем теги вместе с темой для более точной генерации вопросов
-                topic_with_tags = f"{topic_name} по следующим тегам: {tags_text}"
-                
-                ai_questions = await self.ai_service.generate_questions(
-                    topic=topic_with_tags, 
-                    num_questions=self.total_questions
-                )
-                
-                # Проверяем что каждый сгенерированный вопрос содержит все необходимые ключи
-                valid_ai_questions = []
-                for q in ai_questions:
-                    if all(key in q for key in ['question', 'options', 'correct_answer']):
-                        # Добавляем идентификаторы к вопросам, чтобы избежать конфликтов
-                        if 'id' not in q:
-                            q['id'] = f"ai_{len(valid_ai_questions)}"
-                        valid_ai_questions.append(q)
-                    else:
-                        logger.error(f"Сгенерированный вопрос не содержит все необходимые ключи: {q}")
-                
-                # Если удалось сгенерировать вопросы, используем их
-                if valid_ai_questions:
-                    session["questions"] = valid_ai_questions
-                    logger.info(f"Сгенерировано {len(valid_ai_questions)} новых вопросов")
+            if next_batch_prefetch is not None:
+                # Достаточно дождаться первого вопроса, остальные догружаются во время ответов
+                if await self._wait_for_ai_question(next_batch_prefetch, 0):
+                    session.questions = next_batch_prefetch["questions"]
+                    session.ai_prefetch = next_batch_prefetch
+                    session.expected_total = self.total_questions
+                    logger.info(f"Получен первый из {self.total_questions} новых вопросов, остальные генерируются")
                 else:
                     # Если генерация не удалась, берем вопросы из базы
-                    db_questions = self.question_service.get_questions_by_theme(topic_key, self.total_questions)
-                    session["questions"] = db_questions
+                    db_questions = self._pick_db_questions(user_id, session, self.total_questions)
+                    session.questions = db_questions
                     logger.info(f"Не удалось сгенерировать вопросы, используем {len(db_questions)} вопросов из базы")
             else:
                 # Если нет тегов или API ключа, берем вопросы из базы
-                db_questions = self.question_service.get_questions_by_theme(topic_key, self.total_questions)
-                session["questions"] = db_questions
+                db_questions = self.question_service.get_questions_by_theme(topic_key, self.total_questions, user_id=user_id)
+                session.questions = db_questions
                 logger.info(f"Используем {len(db_questions)} вопросов из базы")
                 
         except Exception as e:
             logger.error(f"Error generating new questions: {str(e)}")
             
             # В случае ошибки берем вопросы из базы
-            db_questions = self.question_service.get_questions_by_theme(topic_key, self.total_questions)
-            session["questions"] = db_questions
+            db_questions = self.question_service.get_questions_by_theme(topic_key, self.total_questions, user_id=user_id)
+            session.questions = db_questions
+            session.expected_total = None
             logger.info(f"Ошибка генерации, используем {len(db_questions)} вопросов из базы")
         
         # Переход к первому вопросу нового круга
@@ -685,8 +858,9 @@ class FullVersionHandler:
         """Обработчик возврата в главное меню"""
         user_id = callback_query.from_user.id
         
-        # Очищаем сессию пользователя
+        # Очищаем сессию пользователя и отменяем её фоновые генерации
         if user_id in self.user_sessions:
+            self._cancel_ai_prefetch(self.user_sessions[user_id])
             del self.user_sessions[user_id]
             
         # Отвечаем на callback
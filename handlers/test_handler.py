@@ -119,10 +119,10 @@ class TestHandler:
         reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
         
         # Получаем общее количество вопросов
-        total_questions = len(self.test_service.user_sessions[user_id]['questions'])
+        total_questions = len(self.test_service.user_sessions[user_id].questions)
         
         # Определяем текущий индекс вопроса (начиная с 0)
-        current_index = self.test_service.user_sessions[user_id]['current_question']
+        current_index = self.test_service.user_sessions[user_id].current
         
         # ID вопроса для отображения (проверяем тип и при необходимости обрабатываем префикс)
         current_question_id = question['id']
@@ -0,0 +1,162 @@
+"""
+Микро-батчинг генерации вопросов.
+
+Запросы на генерацию от разных сессий собираются в течение короткого окна
+(или до заданного количества) и отправляются одним запросом к API с общей
+инструкцией и несколькими группами тем. Разобранный ответ раздается
+ожидающим; группы, которые не удалось разобрать, генерируются отдельными
+запросами. Токены общего запроса делятся между квотами пользователей батча
+пропорционально количеству запрошенных ими вопросов.
+"""
+import asyncio
+from typing import Dict, List, Any, Optional
+from config import config
+from services.ai_quota import current_token_shares, current_user
+from utils.logger import logger
+
+
+class _BatchItem:
+    """Запрос, ожидающий отправки в составе батча"""
+    __slots__ = ("topic", "num_questions", "priority", "future", "user_id")
+
+    def __init__(self, topic: str, num_questions: int, priority: int, future: asyncio.Future,
+                 user_id: Optional[int]):
+        self.topic = topic
+        self.num_questions = num_questions
+        self.priority = priority
+        self.future = future
+        self.user_id = user_id
+
+
+class QuestionBatcher:
+    """
+    Собирает запросы генерации вопросов в батчи перед AIService
+    """
+
+    def __init__(self, ai_service):
+        self.ai_service = ai_service
+        self.enabled = config.ai_batching_enabled
+        self.window = config.ai_batch_window
+        self.max_requests = config.ai_batch_max_requests
+
+        self._pending: List[_BatchItem] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+        # Счетчики для статистики: режим ("single" / "batched") -> [токены, вопросы]
+        self._usage: Dict[str, List[int]] = {"single": [0, 0], "batched": [0, 0]}
+        self.batches = 0
+        self.batched_requests = 0
+        self.fallbacks = 0
+
+    async def submit(self, topic: str, num_questions: int, priority: int) -> List[Dict[str, Any]]:
+        """
+        Добавляет запрос в текущий батч и ждет его вопросы
+
+        Args:
+            topic: тема для генерации вопросов
+            num_questions: количество вопросов
+            priority: приоритет запроса в очереди планировщика
+
+        Returns:
+            List[Dict]: валидированные вопросы
+        """
+        if not self.enabled:
+            return await self.ai_service._request_questions(topic, num_questions, priority)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_BatchItem(topic, num_questions, priority, future, current_user.get()))
+        if len(self._pending) >= self.max_requests:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Отправляет накопленные запросы одним батчем"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[_BatchItem]) -> None:
+        if len(batch) == 1:
+            await self._run_single(batch[0])
+            return
+
+        # Токены общего запроса делятся между пользователями батча по количеству вопросов
+        current_user.set(None)
+        current_token_shares.set([(item.user_id, item.num_questions) for item in batch])
+        self.batches += 1
+        self.batched_requests += len(batch)
+        logger.info(f"Батч генерации вопросов: {len(batch)} запросов в одном обращении к API")
+
+        try:
+            groups = await self.ai_service._request_questions_batch(
+                [(item.topic, item.num_questions) for item in batch],
+                min(item.priority for item in batch)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка батча генерации вопросов, запросы будут выполнены по отдельности: {str(e)}")
+            groups = [None] * len(batch)
+
+        failed = []
+        for item, questions in zip(batch, groups):
+            if questions:
+                self._resolve(item, questions[:item.num_questions])
+            else:
+                failed.append(item)
+
+        if failed:
+            self.fallbacks += len(failed)
+            await asyncio.gather(*(self._run_single(item) for item in failed))
+
+    async def _run_single(self, item: _BatchItem) -> None:
+        current_user.set(item.user_id)
+        current_token_shares.set(None)
+        try:
+            questions = await self.ai_service._request_questions(item.topic, item.num_questions, item.priority)
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+            return
+        self._resolve(item, questions)
+
+    @staticmethod
+    def _resolve(item: _BatchItem, questions: List[Dict[str, Any]]) -> None:
+        if not item.future.done():
+            item.future.set_result(questions)
+
+    def record_usage(self, mode: str, tokens: Optional[int], questions: int) -> None:
+        """Учитывает токены, потраченные на генерацию вопросов (mode: "single" или "batched")"""
+        if tokens is None or questions <= 0:
+            return
+        usage = self._usage[mode]
+        usage[0] += tokens
+        usage[1] += questions
+
+    def _tokens_per_question(self, mode: str) -> str:
+        tokens, questions = self._usage[mode]
+        return f"{tokens / questions:.0f}" if questions else "—"
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику батчинга"""
+        return {
+            "enabled": self.enabled,
+            "batches": self.batches,
+            "batched_requests": self.batched_requests,
+            "fallbacks": self.fallbacks,
+            "tokens_per_question_single": self._tokens_per_question("single"),
+            "tokens_per_question_batched": self._tokens_per_question("batched")
+        }
+
+    async def close(self) -> None:
+        """Отправляет накопленные запросы и дожидается батчей (вызывается при остановке бота)"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,166 @@
+"""
+Учет запросов к AI API: длительность, время до первого байта, токены,
+успешность разбора ответа и стоимость.
+
+Каждый логический запрос (генерация вопросов, батч, поток, чек-лист)
+описывается записью, которая заполняется по ходу запроса: транспортный
+уровень добавляет время до первого байта, токены и стоимость (в том числе
+хеджирующих запросов), вызывающий — результат разбора ответа. Завершенные
+записи попадают в гистограммы процесса и в таблицу ai_calls базы аналитики
+(пакетами из фонового потока, см. AnalyticsService.write_ai_calls).
+"""
+import bisect
+import contextvars
+import time
+from typing import Dict, Any, Optional
+from config import config
+from services.analytics_service import analytics_service
+from utils.logger import logger
+
+# Запись текущего логического запроса (видна во вложенных задачах, например хеджирующих)
+current_call: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("ai_current_call", default=None)
+
+
+def mark_parse(ok: bool) -> None:
+    """Отмечает в текущей записи, удалось ли разобрать ответ модели"""
+    record = current_call.get()
+    if record is not None:
+        record["parse_ok"] = ok
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными экспоненциальными границами корзин (сек)
+    """
+
+    BOUNDS = [0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Верхняя граница корзины, в которую попадает перцентиль q (None, если данных нет)"""
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.BOUNDS[index] if index < len(self.BOUNDS) else float("inf")
+        return float("inf")
+
+    def format(self) -> str:
+        if not self.total:
+            return "—"
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return f"ср. {self.sum / self.total:.1f} сек, p50 ≤{p50:g}, p95 ≤{p95:g} сек"
+
+
+def compute_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Стоимость запроса в долларах по ценам config.ai_model_prices (за 1 млн токенов)"""
+    prompt_price, completion_price = config.ai_model_prices.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class AICallMetrics:
+    """
+    Агрегаты по запросам к AI API в разрезе видов запросов
+    """
+
+    def __init__(self):
+        self.latency: Dict[str, Histogram] = {}
+        self.ttfb: Dict[str, Histogram] = {}
+        self.calls = 0
+        self.errors = 0
+        self.parse_failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    @staticmethod
+    def new_record(kind: str, model: str) -> Dict[str, Any]:
+        """Создает запись логического запроса"""
+        return {
+            "kind": kind,
+            "model": model,
+            "priority": None,
+            "started_at": time.monotonic(),
+            "latency": None,
+            "ttfb": None,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost": 0.0,
+            "status": "ok",
+            "parse_ok": None
+        }
+
+    @staticmethod
+    def set_priority(priority: int) -> None:
+        """Запоминает в текущей записи приоритет запроса"""
+        record = current_call.get()
+        if record is not None and record["priority"] is None:
+            record["priority"] = priority
+
+    @staticmethod
+    def add_transport_usage(model: str, usage: Optional[Dict[str, Any]]) -> None:
+        """Добавляет к текущей записи токены и стоимость одного HTTP-запроса"""
+        record = current_call.get()
+        if record is None or not usage:
+            return
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        record["prompt_tokens"] += prompt_tokens
+        record["completion_tokens"] += completion_tokens
+        record["cost"] += compute_cost(model, prompt_tokens, completion_tokens)
+
+    @staticmethod
+    def mark_first_byte(sent_at: float) -> None:
+        """Отмечает время до первого байта ответа (первого из HTTP-запросов записи)"""
+        record = current_call.get()
+        if record is not None and record["ttfb"] is None:
+            record["ttfb"] = time.monotonic() - sent_at
+
+    def finish(self, record: Dict[str, Any]) -> None:
+        """Учитывает завершенный запрос в гистограммах и ставит его в очередь записи в базу аналитики"""
+        record["latency"] = time.monotonic() - record["started_at"]
+        kind = record["kind"]
+
+        self.calls += 1
+        if record["status"] != "ok":
+            self.errors += 1
+        if record["parse_ok"] is False:
+            self.parse_failures += 1
+        self.prompt_tokens += record["prompt_tokens"]
+        self.completion_tokens += record["completion_tokens"]
+        self.cost += record["cost"]
+        self.latency.setdefault(kind, Histogram()).observe(record["latency"])
+        if record["ttfb"] is not None:
+            self.ttfb.setdefault(kind, Histogram()).observe(record["ttfb"])
+
+        try:
+            analytics_service.log_ai_call(record)
+        except Exception as e:
+            logger.error(f"Error saving AI call metrics: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает метрики запросов с начала работы процесса"""
+        stats: Dict[str, Any] = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "parse_failures": self.parse_failures,
+            "tokens": f"{self.prompt_tokens} + {self.completion_tokens}",
+            "cost": f"${self.cost:.4f}"
+        }
+        for kind, histogram in sorted(self.latency.items()):
+            stats[f"latency_{kind}"] = histogram.format()
+        for kind, histogram in sorted(self.ttfb.items()):
+            stats[f"ttfb_{kind}"] = histogram.format()
+        return stats
@@ -0,0 +1,298 @@
+"""
+Квоты пользователей на запросы к AI API.
+
+Для каждого пользователя считаются запросы и токены за текущий час и
+текущие сутки. Перед запросом к API проверяется, не исчерпана ли квота;
+если исчерпана, запрос отклоняется (QuotaExceeded), и вызывающий использует
+вопросы из базы. ID пользователя передается через contextvar current_user,
+который обработчики устанавливают перед обращением к AIService.
+Счетчики периодически сохраняются в JSON-файл, индивидуальные лимиты
+администратор задает по ID пользователя.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+from config import config
+from services.ai_scheduler import AdmissionRejected
+from utils.logger import logger
+
+# Пользователь, от имени которого выполняются запросы к AI API (None — системные запросы)
+current_user: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("ai_current_user", default=None)
+# Доли пользователей в общем запросе (батче): (ID пользователя, вес); токены запроса делятся по весам
+current_token_shares: contextvars.ContextVar[Optional[List[Tuple[Optional[int], int]]]] = contextvars.ContextVar(
+    "ai_current_token_shares", default=None
+)
+
+LIMIT_NAMES = ("calls_per_hour", "tokens_per_hour", "calls_per_day", "tokens_per_day")
+
+
+class QuotaExceeded(AdmissionRejected):
+    """Квота пользователя на запросы к AI API исчерпана"""
+
+
+@contextmanager
+def user_context(user_id: int) -> Iterator[None]:
+    """Выполняет блок от имени пользователя (запросы к API учитываются в его квоте)"""
+    token = current_user.set(user_id)
+    try:
+        yield
+    finally:
+        current_user.reset(token)
+
+
+class _UserUsage:
+    """Расход пользователя за текущий час и текущие сутки"""
+    __slots__ = ("hour", "hour_calls", "hour_tokens", "day", "day_calls", "day_tokens")
+
+    def __init__(self, hour: int = 0, hour_calls: int = 0, hour_tokens: int = 0,
+                 day: int = 0, day_calls: int = 0, day_tokens: int = 0):
+        self.hour = hour
+        self.hour_calls = hour_calls
+        self.hour_tokens = hour_tokens
+        self.day = day
+        self.day_calls = day_calls
+        self.day_tokens = day_tokens
+
+    def roll(self, now: float) -> None:
+        """Обнуляет счетчики, если начался новый час или новые сутки"""
+        hour, day = int(now // 3600), int(now // 86400)
+        if hour != self.hour:
+            self.hour, self.hour_calls, self.hour_tokens = hour, 0, 0
+        if day != self.day:
+            self.day, self.day_calls, self.day_tokens = day, 0, 0
+
+    def to_list(self) -> list:
+        return [self.hour, self.hour_calls, self.hour_tokens, self.day, self.day_calls, self.day_tokens]
+
+
+class AIQuota:
+    """
+    Почасовые и суточные квоты пользователей на запросы и токены
+    """
+    name = "Квоты пользователей на ИИ"
+
+    def __init__(self, file_path: Optional[str] = None):
+        self.file_path = file_path if file_path is not None else config.ai_quota_file
+        self.persist_interval = config.ai_quota_persist_interval
+        self.default_limits = {
+            "calls_per_hour": config.ai_quota_calls_per_hour,
+            "tokens_per_hour": config.ai_quota_tokens_per_hour,
+            "calls_per_day": config.ai_quota_calls_per_day,
+            "tokens_per_day": config.ai_quota_tokens_per_day
+        }
+        # ID пользователя -> лимиты, отличающиеся от стандартных (None — без ограничения)
+        self.overrides: Dict[int, Dict[str, Optional[int]]] = {
+            user_id: dict(limits) for user_id, limits in config.ai_quota_overrides.items()
+        }
+
+        self._usage: Dict[int, _UserUsage] = {}
+        self._dirty = False
+        self._persist_task: Optional[asyncio.Task] = None
+
+        # Счетчики для статистики
+        self.rejected = 0
+
+        if self.file_path:
+            self._load()
+
+    def _load(self) -> None:
+        """Загружает сохраненные счетчики и лимиты администратора"""
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading AI quota: {str(e)}")
+            return
+
+        now = time.time()
+        for user_id, values in data.get("usage", {}).items():
+            usage = _UserUsage(*values)
+            usage.roll(now)
+            if usage.day_calls or usage.day_tokens:
+                self._usage[int(user_id)] = usage
+        for user_id, limits in data.get("overrides", {}).items():
+            self.overrides[int(user_id)] = limits
+        logger.info(f"AI quota loaded: {len(self._usage)} users, {len(self.overrides)} overrides")
+
+    def save(self) -> None:
+        """Сохраняет счетчики текущих суток и лимиты администратора"""
+        if not self.file_path:
+            return
+        self.sweep()
+        data = {
+            "usage": {str(uid): usage.to_list() for uid, usage in self._usage.items()},
+            "overrides": {str(uid): limits for uid, limits in self.overrides.items()}
+        }
+        try:
+            directory = os.path.dirname(self.file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.file_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.file_path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"Error saving AI quota: {str(e)}")
+
+    def sweep(self) -> int:
+        """
+        Забывает пользователей без расхода за текущие сутки (вызывается при сохранении
+        и периодически, см. utils/bounded_store.sweep_stores)
+
+        Returns:
+            int: количество удаленных записей
+        """
+        now = time.time()
+        for usage in self._usage.values():
+            usage.roll(now)
+        # Пользователи без расхода за сутки не нужны ни в памяти, ни в файле
+        before = len(self._usage)
+        self._usage = {uid: u for uid, u in self._usage.items() if u.day_calls or u.day_tokens}
+        return before - len(self._usage)
+
+    def _ensure_persist_task(self) -> None:
+        """Запускает периодическое сохранение при первом расходе квоты"""
+        if not self.file_path or (self._persist_task is not None and not self._persist_task.done()):
+            return
+        try:
+            self._persist_task = asyncio.get_running_loop().create_task(self._persist_loop())
+        except RuntimeError:
+            # Нет запущенного цикла событий — сохраним при закрытии
+            pass
+
+    async def _persist_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            if self._dirty:
+                self.save()
+
+    def limits_for(self, user_id: int) -> Dict[str, Optional[int]]:
+        """Лимиты пользователя с учетом индивидуальных настроек администратора"""
+        limits = dict(self.default_limits)
+        limits.update(self.overrides.get(user_id, {}))
+        return limits
+
+    def _get_usage(self, user_id: int) -> _UserUsage:
+        usage = self._usage.get(user_id)
+        if usage is None:
+            usage = _UserUsage()
+            self._usage[user_id] = usage
+        usage.roll(time.time())
+        return usage
+
+    def _exhausted(self, user_id: int) -> Optional[str]:
+        """Возвращает название исчерпанного лимита или None"""
+        usage = self._get_usage(user_id)
+        used = {
+            "calls_per_hour": usage.hour_calls,
+            "tokens_per_hour": usage.hour_tokens,
+            "calls_per_day": usage.day_calls,
+            "tokens_per_day": usage.day_tokens
+        }
+        for name, limit in self.limits_for(user_id).items():
+            if limit is not None and used[name] >= limit:
+                return name
+        return None
+
+    def allows(self, user_id: int) -> bool:
+        """Проверяет, есть ли у пользователя квота на запрос"""
+        return self._exhausted(user_id) is None
+
+    def acquire(self, user_id: Optional[int]) -> None:
+        """
+        Проверяет квоту и учитывает запрос; при исчерпанной квоте выбрасывает QuotaExceeded
+
+        Args:
+            user_id: ID пользователя (None — системный запрос без квоты)
+        """
+        if user_id is None:
+            return
+        exhausted = self._exhausted(user_id)
+        if exhausted is not None:
+            self.rejected += 1
+            logger.warning(f"AI-запрос пользователя {user_id} отклонен: исчерпан лимит {exhausted}")
+            raise QuotaExceeded(f"user {user_id} exceeded {exhausted}")
+        usage = self._get_usage(user_id)
+        usage.hour_calls += 1
+        usage.day_calls += 1
+        self._dirty = True
+        self._ensure_persist_task()
+
+    def charge_tokens(self, user_id: Optional[int], tokens: int) -> None:
+        """Учитывает фактически израсходованные токены запроса"""
+        if user_id is None or not tokens:
+            return
+        usage = self._get_usage(user_id)
+        usage.hour_tokens += tokens
+        usage.day_tokens += tokens
+        self._dirty = True
+
+    def charge_tokens_shared(self, shares: List[Tuple[Optional[int], int]], tokens: int) -> None:
+        """
+        Делит токены общего запроса между пользователями пропорционально весам
+        (например, количеству запрошенных вопросов); остаток от деления — последнему
+        """
+        total_weight = sum(weight for _, weight in shares)
+        if not tokens or total_weight <= 0:
+            return
+        charged = 0
+        for position, (user_id, weight) in enumerate(shares):
+            part = tokens - charged if position == len(shares) - 1 else tokens * weight // total_weight
+            charged += part
+            self.charge_tokens(user_id, part)
+
+    def set_override(self, user_id: int, limits: Optional[Dict[str, Optional[int]]]) -> None:
+        """
+        Задает пользователю индивидуальные лимиты (None — вернуть стандартные)
+
+        Args:
+            user_id: ID пользователя
+            limits: словарь с ключами из LIMIT_NAMES; значение None — без ограничения
+        """
+        if limits is None:
+            self.overrides.pop(user_id, None)
+        else:
+            unknown = set(limits) - set(LIMIT_NAMES)
+            if unknown:
+                raise ValueError(f"Unknown quota limits: {', '.join(sorted(unknown))}")
+            self.overrides[user_id] = dict(limits)
+        self.save()
+
+    def get_user_usage(self, user_id: int) -> Dict[str, Any]:
+        """Расход и лимиты пользователя (для администратора)"""
+        usage = self._get_usage(user_id)
+        limits = self.limits_for(user_id)
+        used = {
+            "calls_per_hour": usage.hour_calls,
+            "tokens_per_hour": usage.hour_tokens,
+            "calls_per_day": usage.day_calls,
+            "tokens_per_day": usage.day_tokens
+        }
+        return {
+            name: f"{used[name]} / {limits[name] if limits[name] is not None else '∞'}"
+            for name in LIMIT_NAMES
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику квот"""
+        return {
+            "users_tracked": len(self._usage),
+            "overrides": len(self.overrides),
+            "rejected": self.rejected
+        }
+
+    async def close(self) -> None:
+        """Останавливает периодическое сохранение и сохраняет счетчики (вызывается при остановке бота)"""
+        if self._persist_task is not None and not self._persist_task.done():
+            self._persist_task.cancel()
+            await asyncio.gather(self._persist_task, return_exceptions=True)
+        self._persist_task = None
+        if self._dirty:
+            self.save()
@@ -0,0 +1,286 @@
+"""
+Разбор ответов модели со структурированными данными (вопросы, группы
+вопросов батча, чек-лист).
+
+Ответ запрашивается в JSON-режиме, поэтому быстрый путь — json.loads всего
+текста. Если модель обернула ответ в markdown или добавила пояснения,
+извлекается только литерал (блок кода или фрагмент от первой открывающей
+до последней закрывающей скобки), и лишь его при неудаче JSON разбирает
+ast.literal_eval — код ответа никогда не выполняется. Если литерал
+поврежден (например, ответ обрезан по лимиту токенов), из текста
+спасаются все завершенные объекты. Схема проверяется за один проход:
+некорректные элементы отбрасываются, остальные возвращаются.
+"""
+import ast
+import json
+from typing import List, Dict, Any, Optional
+from utils.logger import logger
+
+
+class IncrementalQuestionParser:
+    """
+    Инкрементальный разбор ответа модели со списком вопросов.
+    Получает текст фрагментами и возвращает каждый объект вопроса, как только
+    его закрывающая скобка получена. Объекты разбираются как JSON, а при
+    неудаче — через ast.literal_eval (без выполнения кода).
+    """
+    def __init__(self):
+        self._stack: List[str] = []
+        self._quote: Optional[str] = None
+        self._escape = False
+        self._comment = False
+        # Текст объекта верхнего уровня (на случай одиночного вопроса без списка)
+        self._top: List[str] = []
+        # Текст текущего объекта внутри списка
+        self._item: List[str] = []
+        self._item_depth: Optional[int] = None
+        self._items_found = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Принимает очередной фрагмент текста и возвращает завершенные объекты"""
+        completed = []
+        for ch in text:
+            if self._comment:
+                # Комментарий Python внутри литерала (модель может повторить его из примера)
+                if ch == "\n":
+                    self._comment = False
+                    self._append(ch)
+                continue
+
+            if self._stack:
+                self._append(ch)
+
+            if self._quote is not None:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._quote:
+                    self._quote = None
+                continue
+
+            if not self._stack:
+                # Вне литерала (текст модели, markdown) интересует только начало списка или объекта
+                if ch in "[{":
+                    self._stack.append(ch)
+                    self._top = [ch] if ch == "{" else []
+                    self._items_found = 0
+                continue
+
+            if ch in ("'", '"'):
+                self._quote = ch
+            elif ch == "#":
+                self._comment = True
+                self._unappend()
+            elif ch in "[{":
+                # Вопрос — объект, лежащий непосредственно в списке верхнего уровня
+                # (или в списке внутри объекта-обертки, например {"questions": [...]})
+                if ch == "{" and self._item_depth is None and self._stack[-1] == "[" and len(self._stack) <= 2:
+                    self._item_depth = len(self._stack)
+                    self._item = [ch]
+                self._stack.append(ch)
+            elif ch in "]}":
+                self._stack.pop()
+                if self._item_depth is not None and len(self._stack) == self._item_depth:
+                    obj = self._parse_object("".join(self._item))
+                    self._item_depth = None
+                    self._item = []
+                    if obj is not None:
+                        self._items_found += 1
+                        completed.append(obj)
+                elif not self._stack and ch == "}" and self._items_found == 0:
+                    # Модель вернула один объект вопроса вместо списка
+                    obj = self._parse_object("".join(self._top))
+                    if obj is not None and "question" in obj:
+                        completed.append(obj)
+        return completed
+
+    def _append(self, ch: str) -> None:
+        if self._top:
+            self._top.append(ch)
+        if self._item_depth is not None:
+            self._item.append(ch)
+
+    def _unappend(self) -> None:
+        if self._top:
+            self._top.pop()
+        if self._item_depth is not None:
+            self._item.pop()
+
+    @staticmethod
+    def _parse_object(text: str) -> Optional[Dict[str, Any]]:
+        try:
+            obj = loads(text)
+        except ValueError as e:
+            logger.error(f"Не удалось разобрать объект из потока: {str(e)}")
+            return None
+        return obj if isinstance(obj, dict) else None
+
+
+def extract_literal(text: str) -> str:
+    """
+    Возвращает фрагмент ответа с литералом: содержимое первого блока кода
+    markdown или текст от первой открывающей до последней закрывающей скобки
+    """
+    text = text.strip()
+    fence = text.find("```")
+    if fence != -1:
+        # Пропускаем язык блока (```json, ```python) до конца строки
+        start = text.find("\n", fence)
+        end = text.find("```", start + 1) if start != -1 else -1
+        if start != -1:
+            return text[start + 1:end if end != -1 else len(text)].strip()
+
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    if not starts:
+        return text
+    start = min(starts)
+    end = max(text.rfind("]"), text.rfind("}"))
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def loads(text: str) -> Any:
+    """
+    Разбирает литерал: JSON, а при неудаче — литерал Python через
+    ast.literal_eval (ответы в старом формате с одинарными кавычками).
+    При ошибке выбрасывает ValueError
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError) as e:
+        raise ValueError(f"не удалось разобрать литерал: {str(e)}")
+
+
+def _load_response(text: str) -> Any:
+    """Быстрый путь для чистого JSON, иначе — разбор извлеченного литерала"""
+    stripped = text.strip()
+    if stripped[:1] in ("[", "{"):
+        try:
+            return json.loads(stripped)
+        except ValueError:
+            pass
+    return loads(extract_literal(stripped))
+
+
+def _salvage_objects(text: str) -> List[Dict[str, Any]]:
+    """Извлекает из поврежденного ответа все завершенные объекты списка"""
+    return IncrementalQuestionParser().feed(text)
+
+
+def validate_question(q: Any) -> None:
+    """Проверяет структуру сгенерированного вопроса; при ошибке выбрасывает ValueError"""
+    if not isinstance(q, dict) or not all(key in q for key in ['question', 'options', 'correct_answer', 'tags']):
+        raise ValueError("Invalid question format in API response")
+    if not isinstance(q['options'], list) or len(q['options']) != 4:
+        raise ValueError("Each question must have exactly 4 options")
+    if not isinstance(q['correct_answer'], int) or not 0 <= q['correct_answer'] <= 3:
+        raise ValueError("Correct answer index must be between 0 and 3")
+
+
+def _valid_questions(items: Any) -> List[Dict[str, Any]]:
+    """Оставляет только вопросы, прошедшие проверку схемы"""
+    if isinstance(items, dict):
+        items = items.get("questions", [items])
+    if not isinstance(items, list):
+        return []
+    valid = []
+    for q in items:
+        try:
+            validate_question(q)
+        except ValueError as e:
+            logger.error(f"Пропущен некорректный вопрос из ответа: {str(e)}")
+            continue
+        valid.append(q)
+    return valid
+
+
+def parse_questions(text: str) -> List[Dict[str, Any]]:
+    """
+    Разбирает ответ со списком вопросов (список, объект {"questions": [...]}
+    или одиночный вопрос)
+
+    Returns:
+        List[Dict]: вопросы, прошедшие проверку; при поврежденном ответе — спасенные
+
+    Raises:
+        ValueError: в ответе нет ни одного корректного вопроса
+    """
+    try:
+        questions = _valid_questions(_load_response(text))
+    except ValueError as e:
+        questions = _valid_questions(_salvage_objects(text))
+        logger.warning(f"Ответ с вопросами поврежден ({str(e)}), спасено вопросов: {len(questions)}")
+    if not questions:
+        raise ValueError("в ответе нет корректных вопросов")
+    return questions
+
+
+def parse_question_groups(text: str, num_groups: int) -> List[Optional[List[Dict[str, Any]]]]:
+    """
+    Разбирает ответ батч-запроса: список групп (или объект {"groups": [...]}),
+    у каждой группы номер "group" и список "questions"
+
+    Returns:
+        List: вопросы каждой группы; None для групп без корректных вопросов
+    """
+    try:
+        groups = _load_response(text)
+    except ValueError as e:
+        groups = _salvage_objects(text)
+        logger.warning(f"Ответ батч-запроса поврежден ({str(e)}), спасено групп: {len(groups)}")
+    if isinstance(groups, dict):
+        groups = groups.get("groups", [])
+    if not isinstance(groups, list):
+        raise ValueError(f"API вернул неожиданный тип данных: {type(groups)}")
+
+    results: List[Optional[List[Dict[str, Any]]]] = [None] * num_groups
+    for position, group in enumerate(groups):
+        if not isinstance(group, dict):
+            continue
+        index = group.get("group", position + 1)
+        if not isinstance(index, int) or not 1 <= index <= num_groups:
+            continue
+        results[index - 1] = _valid_questions(group.get("questions") or []) or None
+    return results
+
+
+def _valid_resources(items: Any) -> List[Dict[str, Any]]:
+    if not isinstance(items, list):
+        return []
+    return [
+        r for r in items
+        if isinstance(r, dict) and isinstance(r.get("title"), str) and isinstance(r.get("description"), str)
+    ]
+
+
+def parse_checklist(text: str) -> Dict[str, Any]:
+    """
+    Разбирает ответ с чек-листом {"resources": [...], "explanation": "..."}
+
+    Returns:
+        Dict: ресурсы с названием и описанием и объяснение (пустое, если его нет
+        или ответ обрезан)
+
+    Raises:
+        ValueError: в ответе нет ни одного корректного ресурса
+    """
+    try:
+        data = _load_response(text)
+        if not isinstance(data, dict):
+            raise ValueError(f"API вернул неожиданный тип данных: {type(data)}")
+        resources = _valid_resources(data.get("resources"))
+        explanation = data.get("explanation")
+    except ValueError as e:
+        resources = _valid_resources(_salvage_objects(text))
+        explanation = None
+        logger.warning(f"Ответ с чек-листом поврежден ({str(e)}), спасено ресурсов: {len(resources)}")
+    if not resources:
+        raise ValueError("в ответе нет корректных ресурсов")
+    return {
+        "resources": resources,
+        "explanation": explanation if isinstance(explanation, str) else ""
+    }
@@ -0,0 +1,241 @@
+"""
+Планировщик запросов к AI API.
+
+Ограничивает число одновременных запросов и их частоту (запросы и токены
+в минуту, алгоритм token bucket). Запросы, которые не могут выполниться сразу,
+ждут в ограниченной очереди с приоритетами. Если ожидаемое время ожидания
+превышает допустимый для запроса срок, запрос сразу отклоняется, чтобы
+вызывающий мог без задержки перейти на вопросы из базы.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, AsyncIterator
+from config import config
+from utils.logger import logger
+
+# Приоритеты запросов: чем меньше число, тем выше приоритет
+PRIORITY_INTERACTIVE = 0  # Вопросы, которых пользователь ждет прямо сейчас
+PRIORITY_CHECKLIST = 1  # Персонализированные чек-листы
+PRIORITY_BACKGROUND = 2  # Фоновое пополнение пула и офлайн-генерация
+
+
+class AdmissionRejected(Exception):
+    """Запрос к AI API отклонен планировщиком (очередь переполнена или ожидание слишком долгое)"""
+
+
+class TokenBucket:
+    """
+    Token bucket: емкость пополняется равномерно со скоростью rate_per_minute
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Возвращает, через сколько секунд будет доступно amount токенов"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, amount: float) -> None:
+        """Списывает токены (баланс может уйти в минус при корректировке по факту)"""
+        self._refill()
+        self.tokens -= amount
+
+
+class AIScheduler:
+    """
+    Контроль допуска запросов к AI API
+    """
+
+    def __init__(self):
+        self.max_concurrency = config.ai_max_concurrency
+        self.max_queue = config.ai_max_queue
+        self.deadlines = dict(config.ai_admission_deadlines)
+        self.request_bucket = TokenBucket(config.ai_requests_per_minute)
+        self.token_bucket = TokenBucket(config.ai_tokens_per_minute)
+
+        self._active = 0
+        # Очередь ожидающих: (приоритет, порядковый номер, future, оценка токенов)
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        # Скользящая оценка длительности запроса для прогноза ожидания
+        self._avg_duration = 5.0
+
+        # Счетчики для статистики
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def _estimate_wait(self, priority: int, tokens: int) -> float:
+        """Оценивает, сколько запрос с таким приоритетом простоит в очереди"""
+        ahead = sum(1 for item in self._queue if item[0] <= priority)
+        free_slots = self.max_concurrency - self._active
+        slot_wait = 0.0
+        if ahead + 1 > free_slots:
+            slot_wait = ((ahead + 1 - free_slots) / self.max_concurrency) * self._avg_duration
+        rate_wait = max(
+            self.request_bucket.time_until(ahead + 1),
+            self.token_bucket.time_until(tokens * (ahead + 1))
+        )
+        return max(slot_wait, rate_wait)
+
+    def _can_start(self, tokens: int) -> bool:
+        return (self._active < self.max_concurrency
+                and self.request_bucket.time_until(1) == 0
+                and self.token_bucket.time_until(tokens) == 0)
+
+    def has_capacity(self, tokens: int) -> bool:
+        """Проверяет, будет ли запрос допущен сразу, без ожидания в очереди"""
+        return not self._queue and self._can_start(tokens)
+
+    def _start(self, tokens: int) -> None:
+        self._active += 1
+        self.request_bucket.consume(1)
+        self.token_bucket.consume(tokens)
+        self.admitted += 1
+
+    async def acquire(self, priority: int, tokens: int) -> None:
+        """
+        Получает разрешение на запрос или выбрасывает AdmissionRejected
+
+        Args:
+            priority: приоритет запроса (PRIORITY_*)
+            tokens: оценка количества токенов запроса
+        """
+        deadline = self.deadlines.get(priority)
+
+        if not self._queue and self._can_start(tokens):
+            self._start(tokens)
+            return
+
+        expected_wait = self._estimate_wait(priority, tokens)
+        if deadline is not None and expected_wait > deadline:
+            self.rejected += 1
+            logger.warning(
+                f"AI-запрос (приоритет {priority}) отклонен: ожидание ~{expected_wait:.1f} сек > {deadline} сек"
+            )
+            raise AdmissionRejected(f"expected wait {expected_wait:.1f}s exceeds deadline {deadline}s")
+
+        if len(self._queue) >= self.max_queue:
+            # Очередь заполнена: вытесняем самый низкоприоритетный запрос, если новый важнее
+            worst = max(self._queue)
+            if worst[0] <= priority:
+                self.rejected += 1
+                logger.warning(f"AI-запрос (приоритет {priority}) отклонен: очередь заполнена")
+                raise AdmissionRejected("queue is full")
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            if not worst[2].done():
+                worst[2].set_exception(AdmissionRejected("displaced by a higher priority request"))
+            self.rejected += 1
+
+        future = asyncio.get_running_loop().create_future()
+        item = (priority, next(self._seq), future, tokens)
+        heapq.heappush(self._queue, item)
+        started_at = time.monotonic()
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=deadline)
+        except asyncio.TimeoutError:
+            self._drop(item)
+            self.rejected += 1
+            logger.warning(f"AI-запрос (приоритет {priority}) отклонен: истек срок ожидания {deadline} сек")
+            raise AdmissionRejected(f"waited longer than {deadline}s")
+        except asyncio.CancelledError:
+            self._drop(item)
+            raise
+
+        self.total_wait += time.monotonic() - started_at
+
+    def _drop(self, item: tuple) -> None:
+        """Убирает запрос из очереди; если слот уже был выдан — возвращает его"""
+        future = item[2]
+        if future.done() and not future.cancelled() and future.exception() is None:
+            self.release(0, 0)
+            return
+        if item in self._queue:
+            self._queue.remove(item)
+            heapq.heapify(self._queue)
+        if not future.done():
+            future.cancel()
+
+    def _dispatch(self) -> None:
+        """Выдает слоты ожидающим в порядке приоритета"""
+        while self._queue:
+            priority, _, future, tokens = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if self._active >= self.max_concurrency:
+                return
+            wait = max(self.request_bucket.time_until(1), self.token_bucket.time_until(tokens))
+            if wait > 0:
+                # Лимит частоты исчерпан: повторим, когда пополнятся токены
+                if self._wakeup is None:
+                    self._wakeup = asyncio.get_running_loop().call_later(wait, self._on_wakeup)
+                return
+            heapq.heappop(self._queue)
+            self._start(tokens)
+            future.set_result(None)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int], duration: Optional[float] = None) -> None:
+        """
+        Освобождает слот после завершения запроса
+
+        Args:
+            estimated_tokens: оценка токенов, списанная при допуске
+            actual_tokens: фактическое количество токенов (из поля usage), если известно
+            duration: длительность запроса, сек
+        """
+        self._active = max(0, self._active - 1)
+        if actual_tokens is not None:
+            self.token_bucket.consume(actual_tokens - estimated_tokens)
+        if duration is not None:
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+        if self._queue:
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int, tokens: int) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Контекстный менеджер на время запроса. В словарь можно записать
+        фактическое количество токенов (ключ "tokens") для корректировки лимита.
+        """
+        await self.acquire(priority, tokens)
+        usage: Dict[str, Any] = {"tokens": None}
+        started_at = time.monotonic()
+        try:
+            yield usage
+        finally:
+            self.release(tokens, usage["tokens"], time.monotonic() - started_at)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику планировщика"""
+        return {
+            "active": self._active,
+            "queued": len(self._queue),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": f"{(self.total_wait / self.admitted) if self.admitted else 0:.2f} сек"
+        }
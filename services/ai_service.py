@@ -1,23 +1,560 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Hashable, Callable, Awaitable, AsyncIterator
 import aiohttp
+import copy
+import functools
+import inspect
 import json
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from config import config
+from services.analytics_service import analytics_service
+from services.ai_batcher import QuestionBatcher
+from services.ai_metrics import AICallMetrics, current_call, mark_parse
+from services.ai_quota import AIQuota, current_token_shares, current_user
+from services.ai_response_parser import (
+    IncrementalQuestionParser, parse_questions, parse_question_groups, parse_checklist, validate_question
+)
+from services.ai_scheduler import AIScheduler, AdmissionRejected, PRIORITY_INTERACTIVE, PRIORITY_CHECKLIST
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.hedge_policy import HedgePolicy
+from services.checklist_cache_service import ChecklistCache
 from utils.logger import logger
 
+class AIProviderError(ValueError):
+    """Ошибка на стороне AI API (5xx, 429, таймаут) — учитывается выключателем"""
+
+
+def _call_status(error: BaseException) -> str:
+    """Итог запроса для учета по исключению, которым он завершился"""
+    if isinstance(error, AdmissionRejected):
+        return "rejected"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, (AIProviderError, aiohttp.ClientError, asyncio.TimeoutError)):
+        return "provider_error"
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    return "error"
+
+
+def _tracked(kind: str):
+    """
+    Декоратор методов AIService, выполняющих один логический запрос к API
+    (с хеджированием — несколько HTTP-запросов). Создает запись учета
+    (см. services/ai_metrics.py), доступную транспорту через current_call,
+    и по завершении передает ее в AICallMetrics. Поддерживает корутины
+    и асинхронные генераторы.
+    """
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def gen_wrapper(self, *args, **kwargs):
+                record = self.call_metrics.new_record(kind, self.model)
+                user_id = current_user.get()
+                shares = current_token_shares.get()
+                token = current_call.set(record)
+                try:
+                    async for item in func(self, *args, **kwargs):
+                        yield item
+                except BaseException as e:
+                    record["status"] = _call_status(e)
+                    raise
+                finally:
+                    try:
+                        current_call.reset(token)
+                    except ValueError:
+                        # Генератор закрыт из другого контекста (например, сборщиком мусора)
+                        pass
+                    self.call_metrics.finish(record)
+                    self._charge_tokens(user_id, shares, record)
+            return gen_wrapper
+            
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            record = self.call_metrics.new_record(kind, self.model)
+            user_id = current_user.get()
+            shares = current_token_shares.get()
+            token = current_call.set(record)
+            try:
+                return await func(self, *args, **kwargs)
+            except BaseException as e:
+                record["status"] = _call_status(e)
+                raise
+            finally:
+                current_call.reset(token)
+                self.call_metrics.finish(record)
+                self._charge_tokens(user_id, shares, record)
+        return wrapper
+    return decorator
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые одновременные запросы: пока запрос с ключом выполняется,
+    остальные вызывающие с тем же ключом ждут его результат (или исключение)
+    вместо отправки собственного запроса.
+    """
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        
+        # Счетчики для статистики
+        self.calls = 0
+        self.coalesced = 0
+        
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Возвращает результат запроса с ключом key, запуская factory() только
+        если такой запрос еще не выполняется
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.coalesced += 1
+            logger.info(f"Запрос {key[0]} объединен с уже выполняющимся")
+            
+        # shield: отмена одного ожидающего не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+        
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Потоковый вариант do(): все вызывающие с одинаковым ключом получают
+        элементы одного потока (каждый — свою копию, с начала потока).
+        Если все читатели ушли (отменены или закрыли поток), запрос к API прерывается
+        """
+        shared = self._in_flight.get(key)
+        if shared is None:
+            self.calls += 1
+            shared = _SharedStream(factory())
+            self._in_flight[key] = shared
+            shared.task.add_done_callback(lambda t: self._on_done(key, shared))
+        else:
+            self.coalesced += 1
+            logger.info(f"Запрос {key[0]} объединен с уже выполняющимся")
+            
+        shared.readers += 1
+        try:
+            async for item in shared.iterate():
+                yield copy.deepcopy(item)
+        finally:
+            shared.readers -= 1
+            if shared.readers == 0 and not shared.done:
+                # Результат больше никому не нужен: не дочитываем ответ и не расходуем токены
+                if self._in_flight.get(key) is shared:
+                    del self._in_flight[key]
+                shared.task.cancel()
+            
+    def in_flight(self, key: Hashable) -> bool:
+        """Выполняется ли уже запрос с ключом key (новый вызывающий к нему присоединится)"""
+        return key in self._in_flight
+        
+    def _on_done(self, key: Hashable, task: Any) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Забираем исключение, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+            
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику объединения запросов"""
+        return {
+            "api_calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight)
+        }
+
+
+class _SharedStream:
+    """Поток, который читается один раз и раздается нескольким потребителям"""
+    def __init__(self, source: AsyncIterator[Any]):
+        self.items: List[Any] = []
+        self.done = False
+        # Сколько потребителей сейчас читают поток
+        self.readers = 0
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+        
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        
+    def cancelled(self) -> bool:
+        return self.task.cancelled()
+        
+    def exception(self) -> Optional[BaseException]:
+        return self.error
+        
+    async def iterate(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await asyncio.shield(self._changed.wait())
+
+
 class AIService:
+    # Ожидаемый размер ответа в токенах (для лимита токенов в минуту)
+    TOKENS_PER_QUESTION = 250
+    CHECKLIST_TOKENS = 1500
+    
     def __init__(self):
         self.api_key = config.ai_api_key
         self.api_url = config.ai_api_url
         self.model = config.ai_model
+        
+        # Общая HTTP-сессия с пулом соединений, создается лениво при первом запросе
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        
+        # Кэш персонализированных чек-листов по сигнатуре тегов с ошибками
+        self.checklist_cache = ChecklistCache()
+        analytics_service.register_runtime_stats("Кэш чек-листов", self.checklist_cache.get_stats)
+        
+        # Объединение одинаковых одновременных запросов к API
+        self.single_flight = SingleFlight()
+        analytics_service.register_runtime_stats("Объединение AI-запросов", self.single_flight.get_stats)
+        
+        # Ограничение параллельности и частоты запросов к API
+        self.scheduler = AIScheduler()
+        analytics_service.register_runtime_stats("Очередь AI-запросов", self.scheduler.get_stats)
+        
+        # Выключатель: при деградации API запросы сразу уходят на запасной вариант
+        self.circuit_breaker = CircuitBreaker("ai_api")
+        analytics_service.register_runtime_stats("Состояние AI API", self.circuit_breaker.get_stats)
+        
+        # Учет длительности, токенов и стоимости запросов
+        self.call_metrics = AICallMetrics()
+        analytics_service.register_runtime_stats("Метрики AI-запросов", self.call_metrics.get_stats)
+        
+        # Квоты пользователей: запросы и токены в час и в сутки
+        self.quota = AIQuota()
+        analytics_service.register_runtime_stats("Квоты пользователей на ИИ", self.quota.get_stats)
+        
+        # Хеджирование медленных запросов, которых ждет пользователь
+        self.hedge_policy = HedgePolicy()
+        analytics_service.register_runtime_stats("Хеджирование AI-запросов", self.hedge_policy.get_stats)
+        
+        # Объединение запросов генерации от разных сессий в один вызов API
+        self.question_batcher = QuestionBatcher(self)
+        analytics_service.register_runtime_stats("Батчинг генерации вопросов", self.question_batcher.get_stats)
+
+    def _charge_tokens(self, user_id: Optional[int], shares: Optional[List[tuple]], record: Dict[str, Any]) -> None:
+        """Учитывает токены запроса в квоте пользователя или делит их между участниками батча"""
+        tokens = record["prompt_tokens"] + record["completion_tokens"]
+        if shares:
+            self.quota.charge_tokens_shared(shares, tokens)
+        else:
+            self.quota.charge_tokens(user_id, tokens)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Возвращает общую HTTP-сессию, создавая её при первом обращении.
+        Сессия переиспользует соединения (keep-alive), поэтому DNS, TCP и TLS
+        не устанавливаются заново для каждого запроса.
+        """
+        if self._session is not None and not self._session.closed:
+            return self._session
+            
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=config.ai_http_connector_limit,
+                    limit_per_host=config.ai_http_limit_per_host,
+                    keepalive_timeout=config.ai_http_keepalive_timeout,
+                    ttl_dns_cache=300
+                )
+                timeout = aiohttp.ClientTimeout(
+                    total=config.ai_http_total_timeout,
+                    connect=config.ai_http_connect_timeout,
+                    sock_read=config.ai_http_read_timeout
+                )
+                self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+                logger.info(
+                    f"Создана HTTP-сессия для AI API (limit={config.ai_http_connector_limit}, "
+                    f"limit_per_host={config.ai_http_limit_per_host})"
+                )
+        return self._session
+
+    async def close(self) -> None:
+        """Закрывает общую HTTP-сессию (вызывается при остановке бота)"""
+        await self.question_batcher.close()
+        await self.quota.close()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-сессия AI API закрыта")
+        self._session = None
+
+    @staticmethod
+    def _estimate_tokens(payload: Dict[str, Any], completion_tokens: int) -> int:
+        """Грубая оценка токенов запроса (~3 символа на токен) для лимита токенов в минуту"""
+        prompt_chars = sum(len(message.get("content", "")) for message in payload.get("messages", []))
+        return prompt_chars // 3 + completion_tokens
+
+    @asynccontextmanager
+    async def _guarded_call(self, priority: int, tokens: int) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Оборачивает один запрос к API: проверка выключателя, слот планировщика,
+        замер длительности и учет результата в выключателе
+        """
+        self.circuit_breaker.check()
+        started_at = None
+        try:
+            async with self.scheduler.slot(priority, tokens) as usage:
+                started_at = time.monotonic()
+                try:
+                    yield usage
+                except (AIProviderError, aiohttp.ClientError, asyncio.TimeoutError):
+                    self.circuit_breaker.record(False, time.monotonic() - started_at)
+                    raise
+                except BaseException:
+                    # Ошибка не связана с доступностью API (отмена, неверный запрос)
+                    self.circuit_breaker.release_probe()
+                    raise
+                self.circuit_breaker.record(True, time.monotonic() - started_at)
+        finally:
+            if started_at is None:
+                # Запрос не был отправлен (например, отклонен планировщиком)
+                self.circuit_breaker.release_probe()
+
+    @staticmethod
+    async def _raise_for_status(response: aiohttp.ClientResponse) -> None:
+        if response.status == 200:
+            return
+        error_text = await response.text()
+        logger.error(f"API Error: {response.status}, {error_text}")
+        if response.status >= 500 or response.status == 429:
+            raise AIProviderError(f"API Error: {response.status}")
+        raise ValueError(f"API Error: {response.status}")
+
+    async def _post_completion_once(self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                               completion_tokens: int = 1000) -> Dict[str, Any]:
+        """Один запрос к chat-completions API через общую сессию (без хеджирования)"""
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        session = await self._get_session()
+        AICallMetrics.set_priority(priority)
+        async with self._guarded_call(priority, self._estimate_tokens(payload, completion_tokens)) as usage:
+            sent_at = time.monotonic()
+            try:
+                async with session.post(self.api_url, json=payload, headers=headers) as response:
+                    AICallMetrics.mark_first_byte(sent_at)
+                    await self._raise_for_status(response)
+                    response_data = await response.json()
+            except asyncio.TimeoutError:
+                logger.error(f"Таймаут запроса к AI API ({config.ai_http_total_timeout} сек)")
+                raise AIProviderError("API Error: timeout")
+            usage["tokens"] = (response_data.get("usage") or {}).get("total_tokens")
+            AICallMetrics.add_transport_usage(payload.get("model", self.model), response_data.get("usage"))
+            return response_data
+
+    async def _stream_completion_once(self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                                 completion_tokens: int = 1000) -> AsyncIterator[str]:
+        """Один потоковый запрос к chat-completions API (без хеджирования)"""
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        session = await self._get_session()
+        AICallMetrics.set_priority(priority)
+        async with self._guarded_call(priority, self._estimate_tokens(payload, completion_tokens)) as usage:
+            sent_at = time.monotonic()
+            try:
+                async with session.post(self.api_url, json=payload, headers=headers) as response:
+                    await self._raise_for_status(response)
+                    
+                    async for raw_line in response.content:
+                        line = raw_line.decode("utf-8").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            event = json.loads(data)
+                        except json.JSONDecodeError:
+                            logger.warning(f"Пропущено некорректное событие потока: {data[:100]}")
+                            continue
+                        if event.get("usage"):
+                            # Последнее событие потока содержит расход токенов (stream_options.include_usage)
+                            usage["tokens"] = event["usage"].get("total_tokens")
+                            AICallMetrics.add_transport_usage(payload.get("model", self.model), event["usage"])
+                        choices = event.get("choices") or [{}]
+                        delta = choices[0].get("delta", {}).get("content")
+                        if delta:
+                            AICallMetrics.mark_first_byte(sent_at)
+                            yield delta
+            except asyncio.TimeoutError:
+                logger.error(f"Таймаут потокового запроса к AI API ({config.ai_http_total_timeout} сек)")
+                raise AIProviderError("API Error: timeout")
+
+    def _should_hedge(self, priority: int) -> bool:
+        """Хеджируются только запросы, результата которых ждет пользователь"""
+        return self.hedge_policy.enabled and priority == PRIORITY_INTERACTIVE
+
+    def _try_start_hedge(self, payload: Dict[str, Any], completion_tokens: int) -> Optional[Dict[str, Any]]:
+        """
+        Решает, отправлять ли хеджирующий запрос: только при свободном слоте
+        планировщика (второй запрос не должен ждать в очереди) и в пределах
+        лимита доли хеджей. Возвращает тело второго запроса или None.
+        """
+        if not self.scheduler.has_capacity(self._estimate_tokens(payload, completion_tokens)):
+            return None
+        if not self.hedge_policy.try_acquire():
+            return None
+        return self.hedge_policy.hedge_payload(payload)
+
+    async def _post_completion(self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                               completion_tokens: int = 1000) -> Dict[str, Any]:
+        """
+        Отправляет запрос к chat-completions API через общую сессию.
+        Если хеджирование включено и ответа нет дольше задержки (по умолчанию —
+        наблюдаемый p90), отправляет второй запрос и возвращает первый полученный ответ.
+        
+        Args:
+            payload: тело запроса
+            priority: приоритет запроса в очереди планировщика
+            completion_tokens: ожидаемый размер ответа в токенах
+            
+        Returns:
+            Dict: разобранный JSON-ответ API
+        """
+        started_at = time.monotonic()
+        if not self._should_hedge(priority):
+            return await self._post_completion_once(payload, priority, completion_tokens)
+            
+        self.hedge_policy.record_primary()
+        primary = asyncio.ensure_future(self._post_completion_once(payload, priority, completion_tokens))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_policy.delay("completion"))
+            if not done:
+                hedge_payload = self._try_start_hedge(payload, completion_tokens)
+                if hedge_payload is not None:
+                    logger.info(f"Ответ AI API задерживается, отправлен хеджирующий запрос ({hedge_payload['model']})")
+                    tasks.append(asyncio.ensure_future(
+                        self._post_completion_once(hedge_payload, priority, completion_tokens)
+                    ))
+                    
+            # Берем первый успешный ответ; если оба запроса упали — ошибку основного
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_policy.hedge_wins += 1
+                        self.hedge_policy.observe("completion", time.monotonic() - started_at)
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
 
-    async def generate_questions(self, topic: str, num_questions: int = 1) -> List[Dict[str, Any]]:
+    async def _stream_completion(self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                                 completion_tokens: int = 1000) -> AsyncIterator[str]:
         """
-        Генерирует вопросы по заданной теме используя aimlapi.com API
+        Отправляет потоковый запрос к chat-completions API и отдает фрагменты
+        текста ответа из событий SSE (data: {...}) по мере их поступления.
+        При хеджировании второй запрос отправляется, если первый фрагмент не пришел
+        за задержку; дальше читается поток, первым приславший данные.
+        """
+        started_at = time.monotonic()
+        if not self._should_hedge(priority):
+            async for delta in self._stream_completion_once(payload, priority, completion_tokens):
+                yield delta
+            return
+            
+        self.hedge_policy.record_primary()
+        primary = self._stream_completion_once(payload, priority, completion_tokens)
+        # Поток -> задача ожидания его первого фрагмента
+        candidates = {primary: asyncio.ensure_future(primary.__anext__())}
+        winner = None
+        try:
+            done, _ = await asyncio.wait(candidates.values(), timeout=self.hedge_policy.delay("stream"))
+            if not done:
+                hedge_payload = self._try_start_hedge(payload, completion_tokens)
+                if hedge_payload is not None:
+                    logger.info(f"Поток AI API задерживается, отправлен хеджирующий запрос ({hedge_payload['model']})")
+                    hedge = self._stream_completion_once(hedge_payload, priority, completion_tokens)
+                    candidates[hedge] = asyncio.ensure_future(hedge.__anext__())
+                    
+            # Побеждает поток, первым приславший данные (или завершившийся без ошибки)
+            pending = dict(candidates)
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending.values(), return_when=asyncio.FIRST_COMPLETED)
+                for stream, first in list(pending.items()):
+                    if first not in done:
+                        continue
+                    del pending[stream]
+                    if first.exception() is None or isinstance(first.exception(), StopAsyncIteration):
+                        winner = stream
+                        break
+            if winner is None:
+                # Все запросы завершились ошибкой — пробрасываем ошибку основного
+                raise candidates[primary].exception()
+                
+            if winner is not primary:
+                self.hedge_policy.hedge_wins += 1
+            first = candidates[winner]
+            for stream, task in candidates.items():
+                if stream is not winner and not task.done():
+                    task.cancel()
+            if isinstance(first.exception(), StopAsyncIteration):
+                return
+            self.hedge_policy.observe("stream", time.monotonic() - started_at)
+            yield first.result()
+            async for delta in winner:
+                yield delta
+        finally:
+            for stream, task in candidates.items():
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                await stream.aclose()
+
+    @staticmethod
+    def _normalize_prompt_key(text: str) -> str:
+        """Нормализует текст для ключа объединения запросов (регистр и пробелы)"""
+        return " ".join(text.lower().split())
+        
+    async def generate_questions(self, topic: str, num_questions: int = 1,
+                                 priority: int = PRIORITY_INTERACTIVE) -> List[Dict[str, Any]]:
+        """
+        Генерирует вопросы по заданной теме используя aimlapi.com API.
+        Одинаковые одновременные запросы объединяются в один вызов API,
+        а при включенном батчинге — и разные запросы из короткого окна.
         
         Args:
             topic: тема для генерации вопросов
             num_questions: количество вопросов для генерации
+            priority: приоритет запроса в очереди планировщика
             
         Returns:
             List[Dict]: список вопросов в формате:
@@ -29,114 +566,250 @@ class AIService:
             }
         """
         try:
-            # Извлекаем только название темы без префикса "Тема X."
-            real_topic = topic
-            if "." in topic:
-                real_topic = topic.split(".", 1)[1].strip()
-            
-            # Формируем промпт для модели
-            prompt = f"""
-            Сгенерируй {num_questions} вопрос(ов) по теме "{real_topic}" для тестирования знаний.
-            
-            Формат каждого вопроса:
-            1. Сам вопрос
-            2. 4 варианта ответа, один из которых правильный
-            3. Номер правильного ответа (0-3)
-            4. 2-3 тега, описывающих подтемы вопроса
-            
-            Ответ должен быть в формате Python-списка словарей:
-            [
+            return await self.request_questions(topic, num_questions, priority)
+        except Exception as e:
+            logger.error(f"Error generating questions: {str(e)}")
+            # В случае ошибки возвращаем пустой список
+            return []
+            
+    async def request_questions(self, topic: str, num_questions: int = 1,
+                                priority: int = PRIORITY_INTERACTIVE) -> List[Dict[str, Any]]:
+        """
+        То же, что generate_questions, но ошибки пробрасываются, чтобы вызывающий мог
+        отличить отказ до отправки запроса (CircuitOpenError, AdmissionRejected,
+        QuotaExceeded) и отсутствие ответа (AIProviderError, ошибки соединения и
+        таймауты) от непригодного ответа API (ValueError)
+        """
+        key = ("questions", self._normalize_prompt_key(topic), num_questions)
+        # Квота расходуется только тем, кто отправляет запрос к API (см. services/ai_quota.py):
+        # присоединившийся к уже выполняющемуся запросу ничего не стоит. Между проверкой
+        # и single_flight.do нет await, поэтому запрос не может завершиться в промежутке
+        if not self.single_flight.in_flight(key):
+            self.quota.acquire(current_user.get())
+        questions = await self.single_flight.do(
+            key, lambda: self.question_batcher.submit(topic, num_questions, priority)
+        )
+        # Каждый ожидающий получает собственную копию, т.к. обработчики изменяют вопросы
+        return copy.deepcopy(questions)
+            
+    @staticmethod
+    def _real_topic(topic: str) -> str:
+        """Извлекает только название темы без префикса «Тема X.»"""
+        if "." in topic:
+            return topic.split(".", 1)[1].strip()
+        return topic
+        
+    def _build_questions_payload(self, topic: str, num_questions: int) -> Dict[str, Any]:
+        """Формирует тело запроса на генерацию вопросов"""
+        real_topic = self._real_topic(topic)
+        
+        # Формируем промпт для модели
+        prompt = f"""
+        Сгенерируй {num_questions} вопрос(ов) по теме "{real_topic}" для тестирования знаний.
+        
+        Формат каждого вопроса:
+        1. Сам вопрос
+        2. 4 варианта ответа, один из которых правильный
+        3. Номер правильного ответа (0-3)
+        4. 2-3 тега, описывающих подтемы вопроса
+        
+        Ответ должен быть JSON-объектом со списком вопросов (correct_answer — номер правильного ответа 0-3):
+        {{
+            "questions": [
                 {{
-                    'question': 'текст вопроса',
-                    'options': ['вариант 1', 'вариант 2', 'вариант 3', 'вариант 4'],
-                    'correct_answer': 0,  # номер правильного ответа (0-3)
-                    'tags': ['тег1', 'тег2']
+                    "question": "текст вопроса",
+                    "options": ["вариант 1", "вариант 2", "вариант 3", "вариант 4"],
+                    "correct_answer": 0,
+                    "tags": ["тег1", "тег2"]
                 }}
             ]
+        }}
+        
+        Важно:
+        - Вопросы должны быть практическими и профессиональными
+        - Варианты ответов должны быть реалистичными
+        - Теги должны точно отражать подтемы вопроса
+        """
+        
+        # Формируем данные для запроса к API
+        # Для Claude модели добавляем инструкцию в начало промпта вместо system сообщения
+        enhanced_prompt = "Ты - эксперт по UX/UI дизайну, создающий вопросы для тестирования.\n\n" + prompt
+        
+        return self._completion_payload(enhanced_prompt)
+        
+    def _completion_payload(self, prompt: str) -> Dict[str, Any]:
+        """Формирует тело запроса со структурированным ответом (JSON-режим, если включен)"""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7
+        }
+        if config.ai_json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+        
+    @_tracked("questions")
+    async def _request_questions(self, topic: str, num_questions: int, priority: int) -> List[Dict[str, Any]]:
+        """Выполняет запрос генерации вопросов к API; при ошибке выбрасывает исключение"""
+        payload = self._build_questions_payload(topic, num_questions)
+        
+        # Отправляем запрос к API
+        logger.info(f"Отправляем запрос к aimlapi.com для генерации вопросов по теме: {topic}")
+        response_data = await self._post_completion(payload, priority, self.TOKENS_PER_QUESTION * num_questions)
+        
+        # Извлекаем текст ответа
+        response_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        logger.info(f"Получен ответ от aimlapi.com, длина ответа: {len(response_text)}")
+        
+        try:
+            questions = parse_questions(response_text)
+        except ValueError as e:
+            mark_parse(False)
+            logger.error(f"Ошибка при парсинге ответа API: {str(e)}, текст ответа: {response_text[:100]}...")
+            raise ValueError(f"Ошибка парсинга ответа API: {str(e)}")
+        mark_parse(True)
+        
+        self.question_batcher.record_usage("single", (response_data.get("usage") or {}).get("total_tokens"), len(questions))
+        logger.info(f"Успешно сгенерировано {len(questions)} вопросов")
+        return questions
+        
+    def _build_batch_questions_payload(self, requests: List[tuple]) -> Dict[str, Any]:
+        """Формирует тело одного запроса на генерацию вопросов для нескольких групп тем"""
+        groups_text = "\n".join(
+            f"        {index}. Тема \"{self._real_topic(topic)}\" — {num_questions} вопрос(ов)"
+            for index, (topic, num_questions) in enumerate(requests, 1)
+        )
+        
+        prompt = f"""
+        Сгенерируй вопросы для тестирования знаний для каждой из групп:
+{groups_text}
+        
+        Формат каждого вопроса:
+        1. Сам вопрос
+        2. 4 варианта ответа, один из которых правильный
+        3. Номер правильного ответа (0-3)
+        4. 2-3 тега, описывающих подтемы вопроса
+        
+        Ответ должен быть JSON-объектом со списком групп, по одному объекту на группу, в том же порядке:
+        {{
+            "groups": [
+                {{
+                    "group": 1,
+                    "questions": [
+                        {{
+                            "question": "текст вопроса",
+                            "options": ["вариант 1", "вариант 2", "вариант 3", "вариант 4"],
+                            "correct_answer": 0,
+                            "tags": ["тег1", "тег2"]
+                        }}
+                    ]
+                }}
+            ]
+        }}
+        
+        Важно:
+        - Вопросы должны быть практическими и профессиональными
+        - Варианты ответов должны быть реалистичными
+        - Теги должны точно отражать подтемы вопроса
+        - Количество вопросов в группе должно совпадать с запрошенным
+        """
+        
+        enhanced_prompt = "Ты - эксперт по UX/UI дизайну, создающий вопросы для тестирования.\n\n" + prompt
+        return self._completion_payload(enhanced_prompt)
+        
+    @_tracked("questions_batch")
+    async def _request_questions_batch(self, requests: List[tuple], priority: int) -> List[Optional[List[Dict[str, Any]]]]:
+        """
+        Выполняет один запрос генерации вопросов для нескольких групп
+        
+        Args:
+            requests: список кортежей (тема, количество вопросов)
+            priority: приоритет запроса в очереди планировщика
             
-            Важно:
-            - Вопросы должны быть практическими и профессиональными
-            - Варианты ответов должны быть реалистичными
-            - Теги должны точно отражать подтемы вопроса
-            """
-            
-            # Формируем данные для запроса к API
-            # Для Claude модели добавляем инструкцию в начало промпта вместо system сообщения
-            enhanced_prompt = "Ты - эксперт по UX/UI дизайну, создающий вопросы для тестирования.\n\n" + prompt
-            
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "user", "content": enhanced_prompt}
-                ],
-                "temperature": 0.7
-            }
-            
-            # Формируем заголовки
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
+        Returns:
+            List: вопросы для каждой группы в порядке requests; None для групп,
+            которые не удалось разобрать (их вызывающий генерирует отдельно)
+        """
+        payload = self._build_batch_questions_payload(requests)
+        total_questions = sum(num_questions for _, num_questions in requests)
+        
+        logger.info(f"Отправляем батч-запрос к aimlapi.com: {len(requests)} групп, {total_questions} вопросов")
+        response_data = await self._post_completion(payload, priority, self.TOKENS_PER_QUESTION * total_questions)
+        response_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        logger.info(f"Получен ответ на батч-запрос, длина ответа: {len(response_text)}")
+        
+        try:
+            results = parse_question_groups(response_text, len(requests))
+        except ValueError as e:
+            mark_parse(False)
+            raise ValueError(f"Ошибка парсинга ответа API: {str(e)}")
             
-            # Отправляем запрос к API
-            logger.info(f"Отправляем запрос к aimlapi.com для генерации вопросов по теме: {real_topic}")
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, json=payload, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"API Error: {response.status}, {error_text}")
-                        raise ValueError(f"API Error: {response.status}")
-                        
-                    response_data = await response.json()
+        parsed = sum(len(group) for group in results if group)
+        mark_parse(parsed > 0)
+        self.question_batcher.record_usage("batched", (response_data.get("usage") or {}).get("total_tokens"), parsed)
+        logger.info(f"Батч-запрос: разобрано {parsed} вопросов в {sum(1 for g in results if g)} из {len(requests)} групп")
+        return results
+        
+    # Проверка схемы вопроса (используется и вне сервиса)
+    _validate_question = staticmethod(validate_question)
             
-            # Извлекаем текст ответа
-            response_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            logger.info(f"Получен ответ от aimlapi.com, длина ответа: {len(response_text)}")
+    async def generate_questions_stream(self, topic: str, num_questions: int = 1,
+                                        priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Генерирует вопросы в потоковом режиме (stream: true) и отдает каждый
+        вопрос сразу, как только его объект полностью получен и прошел валидацию.
+        Одинаковые одновременные потоки объединяются в один вызов API.
+        Если потоковый режим выключен в конфигурации, отдает результат generate_questions.
+        
+        Args:
+            topic: тема для генерации вопросов
+            num_questions: количество вопросов для генерации
+            priority: приоритет запроса в очереди планировщика
             
-            # Безопасное выполнение ответа от API как Python кода
-            # В реальном приложении здесь нужна дополнительная валидация
-            try:
-                # Извлекаем Python объект из текста ответа, заключенного в тройные кавычки, markdown блок, и пр.
-                import re
-                code_pattern = r'```(?:python)?(.*?)```'
-                code_match = re.search(code_pattern, response_text, re.DOTALL)
-                
-                if code_match:
-                    # Найден блок кода в markdown формате
-                    code_text = code_match.group(1).strip()
-                    logger.info(f"Извлечен кодовый блок из ответа: {len(code_text)} символов")
-                    questions = eval(code_text)
-                else:
-                    # Пробуем выполнить весь текст
-                    questions = eval(response_text)
-                    
-                # Если questions не список, преобразуем в список
-                if not isinstance(questions, list):
-                    logger.warning("API вернул не список. Преобразуем ответ.")
-                    if isinstance(questions, dict):
-                        questions = [questions]
-                    else:
-                        raise ValueError(f"API вернул неожиданный тип данных: {type(questions)}")
-            except Exception as e:
-                logger.error(f"Ошибка при парсинге ответа API: {str(e)}, текст ответа: {response_text[:100]}...")
-                raise ValueError(f"Ошибка парсинга ответа API: {str(e)}")
-            
-            # Валидация структуры ответа
-            for q in questions:
-                if not all(key in q for key in ['question', 'options', 'correct_answer', 'tags']):
-                    raise ValueError("Invalid question format in API response")
-                if len(q['options']) != 4:
-                    raise ValueError("Each question must have exactly 4 options")
-                if not 0 <= q['correct_answer'] <= 3:
-                    raise ValueError("Correct answer index must be between 0 and 3")
-            
-            logger.info(f"Успешно сгенерировано {len(questions)} вопросов")
-            return questions
+        Yields:
+            Dict: вопрос в том же формате, что и generate_questions
+        """
+        if not config.ai_streaming_enabled:
+            for question in await self.generate_questions(topic, num_questions, priority):
+                yield question
+            return
             
+        key = ("questions_stream", self._normalize_prompt_key(topic), num_questions)
+        try:
+            # Как в request_questions: квоту расходует только тот, кто открывает поток к API
+            if not self.single_flight.in_flight(key):
+                self.quota.acquire(current_user.get())
+            async for question in self.single_flight.stream(key, lambda: self._stream_questions(topic, num_questions, priority)):
+                yield question
         except Exception as e:
-            logger.error(f"Error generating questions: {str(e)}")
-            # В случае ошибки возвращаем пустой список
-            return []
+            logger.error(f"Error streaming questions: {str(e)}")
+            
+    @_tracked("questions_stream")
+    async def _stream_questions(self, topic: str, num_questions: int, priority: int) -> AsyncIterator[Dict[str, Any]]:
+        """Выполняет потоковый запрос генерации вопросов; при ошибке выбрасывает исключение"""
+        payload = self._build_questions_payload(topic, num_questions)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        
+        logger.info(f"Отправляем потоковый запрос к aimlapi.com для генерации вопросов по теме: {topic}")
+        parser = IncrementalQuestionParser()
+        count = 0
+        async for delta in self._stream_completion(payload, priority, self.TOKENS_PER_QUESTION * num_questions):
+            for obj in parser.feed(delta):
+                try:
+                    self._validate_question(obj)
+                except ValueError as e:
+                    logger.error(f"Пропущен некорректный вопрос из потока: {str(e)}")
+                    continue
+                count += 1
+                yield obj
+                
+        logger.info(f"Потоковая генерация завершена: {count} вопросов")
+        mark_parse(count > 0)
+        if count == 0:
+            raise ValueError("Ошибка парсинга ответа API: в потоке не найдено ни одного вопроса")
             
     async def generate_personalized_checklist(self, failed_tags: List[tuple], topic: str) -> Dict[str, Any]:
         """
@@ -151,100 +824,81 @@ class AIService:
             - resources: список рекомендованных ресурсов
             - explanation: объяснение рекомендаций
         """
-        try:
-            # Извлекаем только название темы без префикса "Тема X."
-            real_topic = topic
-            if "." in topic:
-                real_topic = topic.split(".", 1)[1].strip()
-            
-            # Формируем текст с результатами
-            tags_text = ", ".join([f"{tag} ({count} ошибок)" for tag, count in failed_tags])
-            
-            prompt = f"""
-            На основе результатов тестирования по теме "{real_topic}" пользователь допустил ошибки в следующих областях:
-            {tags_text}
-            
-            Сгенерируй персонализированные рекомендации, включающие:
-            1. РОВНО 8 конкретных ресурсов для изучения (книги, статьи, курсы, видео)
-            2. Подробное объяснение, почему эти ресурсы помогут и как они связаны с ошибками
-            3. Ресурсы должны быть разнообразными: статьи, книги, видеокурсы, практические задания
-            
-            Формат ответа (Python dict):
-            {
-                'resources': [
-                    {
-                        'title': 'название ресурса',
-                        'url': 'ссылка',
-                        'description': 'подробное описание и польза'
-                    },
-                    ... всего 8 ресурсов
-                ],
-                'explanation': 'текст расширенного объяснения с анализом ошибок и рекомендациями'
-            }
-            """
-            
-            # Формируем данные для запроса к API
-            # Для Claude модели добавляем инструкцию в начало промпта вместо system сообщения
-            enhanced_prompt = "Ты - опытный UX/UI наставник, помогающий в обучении.\n\n" + prompt
-            
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "user", "content": enhanced_prompt}
-                ],
-                "temperature": 0.7
-            }
-            
-            # Формируем заголовки
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            # Отправляем запрос к API
-            logger.info(f"Отправляем запрос к aimlapi.com для генерации чек-листа по темам: {tags_text}")
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, json=payload, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"API Error: {response.status}, {error_text}")
-                        raise ValueError(f"API Error: {response.status}")
-                        
-                    response_data = await response.json()
-                    
-            # Извлекаем текст ответа
-            response_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            logger.info(f"Получен ответ от aimlapi.com, длина ответа: {len(response_text)}")
-            
-            # Безопасное выполнение ответа от API как Python кода
-            try:
-                # Извлекаем Python объект из текста ответа, заключенного в тройные кавычки, markdown блок, и пр.
-                import re
-                code_pattern = r'```(?:python)?(.*?)```'
-                code_match = re.search(code_pattern, response_text, re.DOTALL)
-                
-                if code_match:
-                    # Найден блок кода в markdown формате
-                    code_text = code_match.group(1).strip()
-                    logger.info(f"Извлечен кодовый блок из ответа: {len(code_text)} символов")
-                    recommendations = eval(code_text)
-                else:
-                    # Пробуем выполнить весь текст
-                    recommendations = eval(response_text)
-            except Exception as e:
-                logger.error(f"Ошибка при парсинге ответа API для чек-листа: {str(e)}, текст ответа: {response_text[:100]}...")
-                raise ValueError(f"Ошибка парсинга ответа API: {str(e)}")
-            
-            # Валидация структуры ответа
-            if not all(key in recommendations for key in ['resources', 'explanation']):
-                raise ValueError("Invalid recommendations format in API response")
-            
-            logger.info(f"Успешно сгенерирован персонализированный чек-лист с {len(recommendations['resources'])} ресурсами")
-            return recommendations
+        # Чек-лист для такой же сигнатуры ошибок уже генерировался — отдаем его без запроса к API
+        cached_checklist = self.checklist_cache.get(topic, failed_tags)
+        if cached_checklist is not None:
+            return cached_checklist
             
+        key = ("checklist", ChecklistCache.make_signature(topic, failed_tags))
+        try:
+            # Квоту расходует только вызов, отправляющий запрос; присоединение к нему бесплатно
+            if not self.single_flight.in_flight(key):
+                self.quota.acquire(current_user.get())
+            recommendations = await self.single_flight.do(
+                key, lambda: self._request_checklist(failed_tags, topic)
+            )
+            self.checklist_cache.put(topic, failed_tags, recommendations)
+            return copy.deepcopy(recommendations)
         except Exception as e:
             logger.error(f"Error generating personalized checklist: {str(e)}")
             return {
                 'resources': [],
                 'explanation': "Извините, произошла ошибка при генерации рекомендаций."
-            }
\ No newline at end of file
+            }
+            
+    @_tracked("checklist")
+    async def _request_checklist(self, failed_tags: List[tuple], topic: str) -> Dict[str, Any]:
+        """Выполняет запрос генерации чек-листа к API; при ошибке выбрасывает исключение"""
+        # Извлекаем только название темы без префикса "Тема X."
+        real_topic = topic
+        if "." in topic:
+            real_topic = topic.split(".", 1)[1].strip()
+        
+        # Формируем текст с результатами
+        tags_text = ", ".join([f"{tag} ({count} ошибок)" for tag, count in failed_tags])
+        
+        prompt = f"""
+        На основе результатов тестирования по теме "{real_topic}" пользователь допустил ошибки в следующих областях:
+        {tags_text}
+        
+        Сгенерируй персонализированные рекомендации, включающие:
+        1. РОВНО 8 конкретных ресурсов для изучения (книги, статьи, курсы, видео)
+        2. Подробное объяснение, почему эти ресурсы помогут и как они связаны с ошибками
+        3. Ресурсы должны быть разнообразными: статьи, книги, видеокурсы, практические задания
+        
+        Формат ответа (JSON-объект, всего 8 ресурсов):
+        {{
+            "resources": [
+                {{
+                    "title": "название ресурса",
+                    "url": "ссылка",
+                    "description": "подробное описание и польза"
+                }}
+            ],
+            "explanation": "текст расширенного объяснения с анализом ошибок и рекомендациями"
+        }}
+        """
+        
+        # Формируем данные для запроса к API
+        # Для Claude модели добавляем инструкцию в начало промпта вместо system сообщения
+        enhanced_prompt = "Ты - опытный UX/UI наставник, помогающий в обучении.\n\n" + prompt
+        payload = self._completion_payload(enhanced_prompt)
+        
+        # Отправляем запрос к API
+        logger.info(f"Отправляем запрос к aimlapi.com для генерации чек-листа по темам: {tags_text}")
+        response_data = await self._post_completion(payload, PRIORITY_CHECKLIST, self.CHECKLIST_TOKENS)
+        
+        # Извлекаем текст ответа
+        response_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        logger.info(f"Получен ответ от aimlapi.com, длина ответа: {len(response_text)}")
+        
+        try:
+            recommendations = parse_checklist(response_text)
+        except ValueError as e:
+            mark_parse(False)
+            logger.error(f"Ошибка при парсинге ответа API для чек-листа: {str(e)}, текст ответа: {response_text[:100]}...")
+            raise ValueError(f"Ошибка парсинга ответа API: {str(e)}")
+        mark_parse(True)
+        
+        logger.info(f"Успешно сгенерирован персонализированный чек-лист с {len(recommendations['resources'])} ресурсами")
+        return recommendations
\ No newline at end of file
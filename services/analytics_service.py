@@ -1,10 +1,12 @@
 """
 Модуль для сбора и анализа статистики использования бота
 """
+import asyncio
 import os
 import sqlite3
+from collections import deque
 from datetime import datetime, date, timedelta
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Tuple, Any, Callable
 import json
 from config import config
 from utils.logger import logger
@@ -24,6 +26,13 @@ class AnalyticsService:
         self.db_path = "analytics_data/bot_analytics.db"
         self._init_database()
         
+        # Источники оперативных метрик процесса (кэши, очереди и т.д.) для команды /stats
+        self._runtime_stats_providers: List[Tuple[str, Callable[[], Dict[str, Any]]]] = []
+        
+        # Записи о запросах к AI API, ожидающие пакетной записи (см. write_ai_calls)
+        self._pending_ai_calls: deque = deque(maxlen=config.ai_calls_buffer_max)
+        self.ai_calls_dropped = 0
+        
     def _init_database(self):
         """
         Инициализация структуры базы данных
@@ -79,6 +88,24 @@ class AnalyticsService:
         )
         ''')
         
+        # Создаем таблицу для учета запросов к AI API
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME NOT NULL,
+            kind TEXT NOT NULL,
+            model TEXT,
+            priority INTEGER,
+            status TEXT NOT NULL,
+            parse_ok BOOLEAN,
+            latency REAL NOT NULL,
+            ttfb REAL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cost REAL NOT NULL
+        )
+        ''')
+        
         conn.commit()
         conn.close()
         
@@ -224,6 +251,97 @@ class AnalyticsService:
         except Exception as e:
             logger.error(f"Error logging checklist request: {str(e)}")
     
+    def log_ai_call(self, record: Dict[str, Any]):
+        """
+        Ставит завершенный запрос к AI API в очередь записи (вызывается на цикле событий,
+        в базу записи попадают пакетом из фонового потока — см. write_ai_calls)
+        
+        Args:
+            record: запись запроса (см. services/ai_metrics.py)
+        """
+        if len(self._pending_ai_calls) == self._pending_ai_calls.maxlen:
+            self.ai_calls_dropped += 1
+        self._pending_ai_calls.append(
+            (datetime.now(), record["kind"], record["model"], record["priority"], record["status"],
+             record["parse_ok"], record["latency"], record["ttfb"], record["prompt_tokens"],
+             record["completion_tokens"], record["cost"])
+        )
+    
+    def _take_ai_calls(self) -> List[tuple]:
+        rows = list(self._pending_ai_calls)
+        self._pending_ai_calls.clear()
+        return rows
+    
+    def _insert_ai_calls(self, rows: List[tuple]):
+        """Записывает пакет запросов к AI API одной транзакцией"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            with conn:
+                conn.executemany(
+                    """INSERT INTO ai_calls (timestamp, kind, model, priority, status, parse_ok, latency, ttfb,
+                                              prompt_tokens, completion_tokens, cost)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    rows
+                )
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error logging AI calls: {str(e)}")
+    
+    def flush_ai_calls(self):
+        """Записывает ожидающие запросы к AI API синхронно (при остановке бота)"""
+        rows = self._take_ai_calls()
+        if rows:
+            self._insert_ai_calls(rows)
+    
+    async def write_ai_calls(self, interval: float):
+        """Периодически записывает накопленные запросы к AI API в отдельном потоке (фоновая задача)"""
+        interval = interval or 1.0
+        while True:
+            await asyncio.sleep(interval)
+            rows = self._take_ai_calls()
+            if rows:
+                await asyncio.to_thread(self._insert_ai_calls, rows)
+    
+    def get_ai_call_statistics(self, days: int = 7) -> List[Dict[str, Any]]:
+        """
+        Возвращает статистику запросов к AI API по дням
+        
+        Args:
+            days: Количество дней для выборки (по умолчанию 7)
+            
+        Returns:
+            Список словарей по дням (сначала последние)
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute("""
+                SELECT date(timestamp) as day,
+                       COUNT(*) as calls,
+                       SUM(status != 'ok') as errors,
+                       SUM(parse_ok = 0) as parse_failures,
+                       AVG(latency) as avg_latency,
+                       MAX(latency) as max_latency,
+                       AVG(ttfb) as avg_ttfb,
+                       SUM(prompt_tokens) as prompt_tokens,
+                       SUM(completion_tokens) as completion_tokens,
+                       SUM(cost) as cost
+                FROM ai_calls
+                WHERE timestamp > ?
+                GROUP BY day
+                ORDER BY day DESC
+            """, (start_date,))
+            rows = [dict(row) for row in cursor.fetchall()]
+            
+            conn.close()
+            return rows
+        except Exception as e:
+            logger.error(f"Error getting AI call statistics: {str(e)}")
+            return []
+    
     def get_statistics(self, days: int = 30) -> Dict[str, Any]:
         """
         Возвращает статистику использования бота
@@ -281,7 +399,8 @@ class AnalyticsService:
                 "demo_initiation_rate": demo_initiations,
                 "demo_completion_rate": demo_completions,
                 "checklist_request_rate": checklist_requests,
-                "knowledge_retention_score": round(knowledge_retention, 2)
+                "knowledge_retention_score": round(knowledge_retention, 2),
+                "ai_calls_by_day": self.get_ai_call_statistics()
             }
         except Exception as e:
             logger.error(f"Error getting statistics: {str(e)}")
@@ -291,9 +410,39 @@ class AnalyticsService:
                 "demo_initiation_rate": 0,
                 "demo_completion_rate": 0,
                 "checklist_request_rate": 0,
-                "knowledge_retention_score": 0
+                "knowledge_retention_score": 0,
+                "ai_calls_by_day": []
             }
     
+    def register_runtime_stats(self, title: str, provider: Callable[[], Dict[str, Any]]):
+        """
+        Регистрирует источник оперативных метрик, которые выводятся в /stats
+        
+        Args:
+            title: Заголовок раздела
+            provider: Функция, возвращающая словарь метрик
+        """
+        self._runtime_stats_providers.append((title, provider))
+    
+    def format_runtime_statistics(self) -> str:
+        """
+        Форматирует оперативные метрики всех зарегистрированных источников
+        
+        Returns:
+            Строка с отформатированными метриками (пустая, если источников нет)
+        """
+        sections = []
+        for title, provider in self._runtime_stats_providers:
+            try:
+                metrics = provider()
+            except Exception as e:
+                logger.error(f"Error collecting runtime stats '{title}': {str(e)}")
+                continue
+            lines = [f"<b>{title}:</b>"]
+            lines.extend(f"• {name}: {value}" for name, value in metrics.items())
+            sections.append("\n".join(lines))
+        return "\n\n".join(sections)
+    
     def format_statistics(self, stats: Dict[str, Any]) -> str:
         """
         Форматирует статистику в человекочитаемый вид
@@ -304,7 +453,7 @@ class AnalyticsService:
         Returns:
             Строка с отформатированной статистикой
         """
-        return (
+        text = (
             f"📊 <b>Статистика бота за последние 30 дней</b>\n\n"
             f"🔘 <b>Activation:</b> {stats['activation']}\n"
             f"👥 <b>Channel Subscription Rate:</b> {stats['channel_subscription_rate']}\n"
@@ -313,6 +462,25 @@ class AnalyticsService:
             f"📝 <b>Checklist Request Rate:</b> {stats['checklist_request_rate']}\n"
             f"📈 <b>Knowledge Retention Score:</b> {stats['knowledge_retention_score']}%\n"
         )
+        
+        ai_days = stats.get("ai_calls_by_day") or []
+        if ai_days:
+            text += "\n🤖 <b>Запросы к ИИ по дням</b>\n"
+            for day in ai_days:
+                avg_ttfb = f"{day['avg_ttfb']:.1f}" if day["avg_ttfb"] is not None else "—"
+                text += (
+                    f"• {day['day']}: {day['calls']} запр., ошибок {day['errors'] or 0}, "
+                    f"не разобрано {day['parse_failures'] or 0}; "
+                    f"время ср. {day['avg_latency']:.1f} / макс. {day['max_latency']:.1f} сек, "
+                    f"TTFB ср. {avg_ttfb} сек; "
+                    f"токены {day['prompt_tokens'] or 0} + {day['completion_tokens'] or 0}, "
+                    f"${day['cost'] or 0:.4f}\n"
+                )
+        
+        runtime_text = self.format_runtime_statistics()
+        if runtime_text:
+            text += f"\n⚙️ <b>Оперативные метрики</b>\n\n{runtime_text}\n"
+        return text
 
 
 # Создаем экземпляр сервиса
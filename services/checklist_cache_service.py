@@ -0,0 +1,114 @@
+"""
+Кэш персонализированных чек-листов.
+
+Чек-лист зависит только от темы и набора тегов с ошибками, поэтому результаты
+ИИ-генерации переиспользуются для всех пользователей с одинаковой сигнатурой.
+Количество ошибок по тегу округляется до корзины (1, 2, 3+), чтобы число
+различных сигнатур оставалось небольшим.
+"""
+import copy
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+from config import config
+from utils.logger import logger
+
+
+class ChecklistCache:
+    """
+    LRU-кэш чек-листов с необязательным сохранением на диск
+    """
+
+    def __init__(self, max_size: Optional[int] = None, cache_file: Optional[str] = None):
+        self.max_size = max_size if max_size is not None else config.checklist_cache_max_size
+        self.cache_file = cache_file if cache_file is not None else config.checklist_cache_file
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        # Счетчики для статистики
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_file:
+            self._load()
+
+    @staticmethod
+    def _bucket(count: int) -> str:
+        """Округляет количество ошибок до корзины"""
+        return "3+" if count >= 3 else str(max(count, 1))
+
+    @classmethod
+    def make_signature(cls, topic: str, failed_tags: List[tuple]) -> str:
+        """
+        Возвращает каноническую сигнатуру: тема + отсортированные теги с корзинами ошибок
+
+        Args:
+            topic: тема тестирования
+            failed_tags: список кортежей (тег, количество_ошибок)
+        """
+        counts: Dict[str, int] = {}
+        for tag, count in failed_tags:
+            key = tag.strip().lower()
+            counts[key] = counts.get(key, 0) + count
+        parts = [f"{tag}:{cls._bucket(count)}" for tag, count in sorted(counts.items())]
+        return f"{topic.strip().lower()}|{','.join(parts)}"
+
+    def get(self, topic: str, failed_tags: List[tuple]) -> Optional[Dict[str, Any]]:
+        """Возвращает копию закэшированного чек-листа или None"""
+        signature = self.make_signature(topic, failed_tags)
+        checklist = self._entries.get(signature)
+        if checklist is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(signature)
+        self.hits += 1
+        logger.info(f"Checklist cache hit: {signature}")
+        return copy.deepcopy(checklist)
+
+    def put(self, topic: str, failed_tags: List[tuple], checklist: Dict[str, Any]) -> None:
+        """Сохраняет чек-лист в кэш, вытесняя самые давно использованные записи"""
+        signature = self.make_signature(topic, failed_tags)
+        self._entries[signature] = copy.deepcopy(checklist)
+        self._entries.move_to_end(signature)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._save()
+
+    def _load(self) -> None:
+        """Загружает кэш с диска"""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            for signature, checklist in entries[-self.max_size:]:
+                self._entries[signature] = checklist
+            logger.info(f"Loaded {len(self._entries)} cached checklists")
+        except Exception as e:
+            logger.error(f"Error loading checklist cache from {self.cache_file}: {str(e)}")
+
+    def _save(self) -> None:
+        """Сохраняет кэш на диск (запись через временный файл, чтобы не повредить кэш)"""
+        if not self.cache_file:
+            return
+        try:
+            directory = os.path.dirname(self.cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(list(self._entries.items()), f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logger.error(f"Error saving checklist cache to {self.cache_file}: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": f"{(self.hits / total) * 100:.1f}%" if total else "0%"
+        }
@@ -1,7 +1,6 @@
 from typing import Dict, List, Any
-import json
-import os
 from config import config
+from services.content_repository import content_repository, ContentSnapshot
 from utils.logger import logger
 
 class ChecklistService:
@@ -13,77 +12,79 @@ class ChecklistService:
         
     def _load_resources(self) -> Dict[str, List[Dict[str, str]]]:
         """
-        Загружает ресурсы из файла контента
+        Загружает ресурсы из файла контента (через общий репозиторий контента)
         """
-        try:
-            with open(self.content_file, 'r', encoding='utf-8') as f:
-                content_data = json.load(f)
-                
-                # Преобразуем структуру ресурсов в формат resources_by_tag
-                resources_by_tag = {}
-                
-                # Проверяем формат с ресурсами по тегам (новый формат демо)
-                if "resources" in content_data and isinstance(content_data["resources"], dict):
-                    # Формат: {"resources": {"tag1": [resource1, resource2], "tag2": [resource3]}}
-                    for tag, resources_list in content_data["resources"].items():
-                        resources_by_tag[tag] = resources_list
-                    
-                    mode = "demo" if self.is_demo_mode else "full version"
-                    logger.info(f"Loaded resources in new format for {mode}")
-                    return resources_by_tag
-                
-                # Проверяем новый формат с секцией resources на верхнем уровне (список ресурсов)
-                elif "resources" in content_data and isinstance(content_data["resources"], list):
-                    # Новый формат данных с ресурсами на верхнем уровне в виде списка
-                    for resource in content_data.get("resources", []):
-                        tag = resource.get("tag")
-                        if tag:
-                            if tag not in resources_by_tag:
-                                resources_by_tag[tag] = []
-                            resources_by_tag[tag].append(resource)
-                    
-                    mode = "demo" if self.is_demo_mode else "full version"
-                    logger.info(f"Loaded resources in list format for {mode}")
-                    return resources_by_tag
-                    
-                # Старый формат - обрабатываем все темы в файле контента
-                for theme in content_data.get("themes", []):
-                    # Получаем все ресурсы для темы
-                    resources = theme.get("resources", [])
-                    
-                    # Для каждого ресурса добавляем его в ресурсы по тегам
-                    for resource in resources:
-                        # Получаем теги ресурса
-                        tags = resource.get("tags", [])
-                        
-                        # Добавляем ресурс в словарь для каждого тега
-                        for tag in tags:
-                            if tag not in resources_by_tag:
-                                resources_by_tag[tag] = []
-                            
-                            # Добавляем ресурс без поля tags, чтобы не дублировать информацию
-                            resource_copy = resource.copy()
-                            resource_copy.pop("tags", None)
-                            resources_by_tag[tag].append(resource_copy)
-                
-                # Пишем в лог информацию о загруженных ресурсах
-                mode = "demo" if self.is_demo_mode else "full version"
-                logger.info(f"Loaded resources in old format for {mode}")
-                return resources_by_tag
-                
-        except FileNotFoundError:
-            logger.error(f"Content file not found: {self.content_file}")
+        snapshot = content_repository.get(self.content_file)
+        if snapshot is None:
+            logger.error(f"Content file not found or invalid: {self.content_file}")
             # Пробуем загрузить альтернативный файл, если это демо и он не найден
-            if self.is_demo_mode and os.path.exists(config.content_file):
+            if self.is_demo_mode:
                 logger.warning(f"Falling back to full version content file for resources")
-                with open(config.content_file, 'r', encoding='utf-8') as f:
-                    content_data = json.load(f)
-                    # Аналогичный код обработки как выше
-                    # ...
-            return {}
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON in content file: {self.content_file}")
-            return {}
+                snapshot = content_repository.get(config.content_file)
+            if snapshot is None:
+                return {}
+        content_repository.subscribe(snapshot.path, self._on_content_reloaded)
+        return self._parse_resources(snapshot.data)
+        
+    def _on_content_reloaded(self, snapshot: ContentSnapshot) -> None:
+        """Применяет новый снимок файла контента"""
+        self.resources_by_tag = self._parse_resources(snapshot.data)
+        
+    def _parse_resources(self, content_data: Dict[str, Any]) -> Dict[str, List[Dict[str, str]]]:
+        """
+        Преобразует ресурсы файла контента в словарь ресурсов по тегам
+        """
+        # Преобразуем структуру ресурсов в формат resources_by_tag
+        resources_by_tag = {}
+        
+        # Проверяем формат с ресурсами по тегам (новый формат демо)
+        if "resources" in content_data and isinstance(content_data["resources"], dict):
+            # Формат: {"resources": {"tag1": [resource1, resource2], "tag2": [resource3]}}
+            for tag, resources_list in content_data["resources"].items():
+                resources_by_tag[tag] = resources_list
+            
+            mode = "demo" if self.is_demo_mode else "full version"
+            logger.info(f"Loaded resources in new format for {mode}")
+            return resources_by_tag
+        
+        # Проверяем новый формат с секцией resources на верхнем уровне (список ресурсов)
+        elif "resources" in content_data and isinstance(content_data["resources"], list):
+            # Новый формат данных с ресурсами на верхнем уровне в виде списка
+            for resource in content_data.get("resources", []):
+                tag = resource.get("tag")
+                if tag:
+                    if tag not in resources_by_tag:
+                        resources_by_tag[tag] = []
+                    resources_by_tag[tag].append(resource)
+            
+            mode = "demo" if self.is_demo_mode else "full version"
+            logger.info(f"Loaded resources in list format for {mode}")
+            return resources_by_tag
+            
+        # Старый формат - обрабатываем все темы в файле контента
+        for theme in content_data.get("themes", []):
+            # Получаем все ресурсы для темы
+            resources = theme.get("resources", [])
+            
+            # Для каждого ресурса добавляем его в ресурсы по тегам
+            for resource in resources:
+                # Получаем теги ресурса
+                tags = resource.get("tags", [])
+                
+                # Добавляем ресурс в словарь для каждого тега
+                for tag in tags:
+                    if tag not in resources_by_tag:
+                        resources_by_tag[tag] = []
+                    
+                    # Добавляем ресурс без поля tags, чтобы не дублировать информацию
+                    resource_copy = resource.copy()
+                    resource_copy.pop("tags", None)
+                    resources_by_tag[tag].append(resource_copy)
+        
+        # Пишем в лог информацию о загруженных ресурсах
+        mode = "demo" if self.is_demo_mode else "full version"
+        logger.info(f"Loaded resources in old format for {mode}")
+        return resources_by_tag
     
     def generate_checklist(self, failed_tags: List[tuple]) -> Dict[str, Any]:
         """
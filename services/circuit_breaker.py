@@ -0,0 +1,168 @@
+"""
+Автоматический выключатель (circuit breaker) для внешнего API.
+
+Следит за долей ошибок и 95-м перцентилем длительности запросов в скользящем
+окне. При превышении порогов размыкается: запросы сразу отклоняются, и
+вызывающий использует запасной вариант. Через заданное время пропускает
+несколько пробных запросов (полуоткрытое состояние) и по их результату
+замыкается обратно или снова размыкается.
+"""
+import time
+from collections import deque
+from typing import Dict, Any, Optional, Deque, Tuple
+from config import config
+from utils.logger import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Запрос не выполнен, потому что выключатель разомкнут"""
+
+
+class CircuitBreaker:
+    """
+    Выключатель с порогами по доле ошибок и p95 длительности
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.window_seconds = config.ai_breaker_window_seconds
+        self.min_calls = config.ai_breaker_min_calls
+        self.error_rate_threshold = config.ai_breaker_error_rate
+        self.latency_threshold = config.ai_breaker_p95_latency
+        self.open_seconds = config.ai_breaker_open_seconds
+        self.half_open_probes = config.ai_breaker_half_open_probes
+
+        self.state = CLOSED
+        # Результаты запросов в окне: (время завершения, успех, длительность)
+        self._calls: Deque[Tuple[float, bool, float]] = deque()
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        # Счетчики для статистики
+        self.times_opened = 0
+        self.short_circuited = 0
+        self.total_open_seconds = 0.0
+
+    def _trim(self, now: float) -> None:
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _transition(self, new_state: str) -> None:
+        now = time.monotonic()
+        if self.state == OPEN and new_state != OPEN:
+            open_for = now - self._opened_at
+            self.total_open_seconds += open_for
+            logger.warning(f"Circuit {self.name}: {self.state} -> {new_state} (был разомкнут {open_for:.1f} сек)")
+        else:
+            logger.warning(f"Circuit {self.name}: {self.state} -> {new_state}")
+
+        if new_state == OPEN:
+            self._opened_at = now
+            self.times_opened += 1
+        if new_state == HALF_OPEN:
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        if new_state == CLOSED:
+            self._calls.clear()
+        self.state = new_state
+
+    def allow_request(self) -> bool:
+        """Проверяет, можно ли выполнить запрос; в полуоткрытом состоянии резервирует пробный запрос"""
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.short_circuited += 1
+                return False
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_probes:
+                self.short_circuited += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+
+    def retry_after(self) -> float:
+        """Через сколько секунд разомкнутый выключатель пропустит пробный запрос (0 — уже пропускает)"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def check(self) -> None:
+        """Как allow_request, но выбрасывает CircuitOpenError, если запрос не разрешен"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"circuit {self.name} is {self.state}")
+
+    def record(self, success: bool, latency: float) -> None:
+        """
+        Записывает результат запроса
+
+        Args:
+            success: запрос завершился успешно
+            latency: длительность запроса, сек
+        """
+        now = time.monotonic()
+
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if not success or latency > self.latency_threshold:
+                self._transition(OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self._transition(CLOSED)
+            return
+
+        self._calls.append((now, success, latency))
+        self._trim(now)
+        if self.state != CLOSED or len(self._calls) < self.min_calls:
+            return
+
+        error_rate = self.error_rate()
+        p95 = self.latency_percentile(0.95)
+        if error_rate >= self.error_rate_threshold:
+            logger.error(f"Circuit {self.name}: доля ошибок {error_rate:.0%} превысила порог")
+            self._transition(OPEN)
+        elif p95 is not None and p95 > self.latency_threshold:
+            logger.error(f"Circuit {self.name}: p95 {p95:.1f} сек превысил порог {self.latency_threshold} сек")
+            self._transition(OPEN)
+
+    def release_probe(self) -> None:
+        """Освобождает зарезервированный пробный запрос, если он не был выполнен"""
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def error_rate(self) -> float:
+        """Доля ошибок в окне"""
+        self._trim(time.monotonic())
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, ok, _ in self._calls if not ok) / len(self._calls)
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        """Перцентиль длительности запросов в окне (None, если данных нет)"""
+        self._trim(time.monotonic())
+        if not self._calls:
+            return None
+        latencies = sorted(latency for _, _, latency in self._calls)
+        index = min(len(latencies) - 1, int(q * len(latencies)))
+        return latencies[index]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику выключателя"""
+        open_seconds = self.total_open_seconds
+        if self.state == OPEN:
+            open_seconds += time.monotonic() - self._opened_at
+        p95 = self.latency_percentile(0.95)
+        return {
+            "state": self.state,
+            "error_rate": f"{self.error_rate():.0%}",
+            "p95": f"{p95:.1f} сек" if p95 is not None else "—",
+            "times_opened": self.times_opened,
+            "short_circuited": self.short_circuited,
+            "time_open": f"{open_seconds:.0f} сек"
+        }
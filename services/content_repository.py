@@ -0,0 +1,153 @@
+"""
+Общий для процесса репозиторий файлов контента.
+
+Каждый JSON-файл контента разбирается один раз, результат хранится в
+снимке (ContentSnapshot), который после загрузки не изменяется. Сервисы
+(QuestionService, ChecklistService) берут данные из снимка и подписываются
+на его замену. Фоновая задача watch() периодически проверяет время
+изменения файлов; если изменилось и содержимое (хэш), файл разбирается
+заново и новый снимок атомарно заменяет старый. Сессии, начатые до
+замены, продолжают работать с вопросами старого снимка.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Any, Callable, Optional
+from config import config
+from utils.logger import logger
+
+
+class ContentSnapshot:
+    """Разобранный файл контента; после создания не изменяется"""
+    __slots__ = ("path", "data", "mtime", "digest", "version", "loaded_at")
+
+    def __init__(self, path: str, data: Dict[str, Any], mtime: float, digest: str, version: int):
+        self.path = path
+        self.data = data
+        self.mtime = mtime
+        self.digest = digest
+        self.version = version
+        self.loaded_at = time.time()
+
+
+class ContentRepository:
+    """
+    Снимки файлов контента с перезагрузкой при изменении файла
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, ContentSnapshot] = {}
+        self._subscribers: Dict[str, List[Callable[[ContentSnapshot], None]]] = {}
+
+        # Счетчики для статистики
+        self.loads = 0
+        self.reloads = 0
+        self.reload_errors = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    @staticmethod
+    def _read(path: str) -> tuple:
+        """Читает файл и возвращает (данные, время изменения, хэш содержимого)"""
+        mtime = os.path.getmtime(path)
+        with open(path, "rb") as file:
+            raw = file.read()
+        return json.loads(raw), mtime, hashlib.sha1(raw).hexdigest()
+
+    def get(self, path: str) -> Optional[ContentSnapshot]:
+        """
+        Возвращает текущий снимок файла, при первом обращении загружает его
+
+        Returns:
+            ContentSnapshot или None, если файла нет или он не разбирается
+        """
+        key = self._key(path)
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            return snapshot
+
+        if not os.path.exists(path):
+            return None
+        try:
+            data, mtime, digest = self._read(path)
+        except Exception as e:
+            logger.error(f"Error loading content from {path}: {str(e)}")
+            return None
+        snapshot = ContentSnapshot(path, data, mtime, digest, version=1)
+        self._snapshots[key] = snapshot
+        self.loads += 1
+        logger.info(f"Content file {path} loaded")
+        return snapshot
+
+    def subscribe(self, path: str, callback: Callable[[ContentSnapshot], None]) -> None:
+        """Регистрирует обработчик, вызываемый с новым снимком после перезагрузки файла"""
+        self._subscribers.setdefault(self._key(path), []).append(callback)
+
+    def check_reload(self) -> List[str]:
+        """
+        Перезагружает файлы, содержимое которых изменилось с момента загрузки
+
+        Returns:
+            List[str]: пути перезагруженных файлов
+        """
+        reloaded = []
+        for key, snapshot in list(self._snapshots.items()):
+            try:
+                mtime = os.path.getmtime(snapshot.path)
+            except OSError:
+                # Файл временно отсутствует (например, заменяется) — оставляем старый снимок
+                continue
+            if mtime == snapshot.mtime:
+                continue
+            try:
+                data, mtime, digest = self._read(snapshot.path)
+            except Exception as e:
+                # Недописанный или некорректный файл: продолжаем работать со старым снимком
+                self.reload_errors += 1
+                logger.error(f"Error reloading content from {snapshot.path}: {str(e)}")
+                continue
+            if digest == snapshot.digest:
+                # Изменилось только время (touch, повторное сохранение без правок)
+                self._snapshots[key] = ContentSnapshot(snapshot.path, snapshot.data, mtime, digest, snapshot.version)
+                continue
+
+            new_snapshot = ContentSnapshot(snapshot.path, data, mtime, digest, snapshot.version + 1)
+            self._snapshots[key] = new_snapshot
+            self.reloads += 1
+            reloaded.append(snapshot.path)
+            logger.info(f"Content file {snapshot.path} reloaded (version {new_snapshot.version})")
+            for callback in self._subscribers.get(key, []):
+                try:
+                    callback(new_snapshot)
+                except Exception as e:
+                    logger.error(f"Error applying reloaded content {snapshot.path}: {str(e)}")
+        return reloaded
+
+    async def watch(self, interval: Optional[float] = None) -> None:
+        """Периодически проверяет файлы контента (запускается задачей при старте бота)"""
+        interval = interval if interval is not None else config.content_reload_interval
+        if not interval:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            self.check_reload()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику репозитория контента"""
+        return {
+            "files": len(self._snapshots),
+            "versions": ", ".join(
+                f"{os.path.basename(s.path)} v{s.version}" for s in self._snapshots.values()
+            ) or "—",
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors
+        }
+
+
+# Создаем глобальный экземпляр репозитория
+content_repository = ContentRepository()
@@ -0,0 +1,312 @@
+"""
+Скомпилированное хранилище вопросов в SQLite для больших банков.
+
+Файл контента и пакеты вопросов компилируются (build_content_store.py) в
+базу SQLite: темы, вопросы (JSON одной строкой) и индекс тегов. Хранилище
+не загружает банк целиком: по теме в памяти держится только список ID,
+а сами вопросы разбираются по запросу в компактные записи QuestionRecord
+(uid записи — rowid вопроса в базе) и кэшируются в LRU ограниченного
+размера.
+
+При компиляции для каждого вопроса сохраняется MinHash-сигнатура его
+текста (services/question_signatures.py) и тип источника: индекс
+дубликатов строится по готовым сигнатурам, не разбирая вопросы базы.
+"""
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Set, Tuple
+from services.question_model import QuestionRecord
+from services.question_signatures import SignatureCache
+from utils.logger import logger
+from utils.text_similarity import MinHasher
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE themes (id TEXT PRIMARY KEY, name TEXT, position INTEGER);
+CREATE TABLE questions (id PRIMARY KEY, theme TEXT NOT NULL, data TEXT NOT NULL);
+CREATE INDEX idx_questions_theme ON questions (theme);
+CREATE TABLE question_tags (tag TEXT NOT NULL, question_id NOT NULL, PRIMARY KEY (tag, question_id)) WITHOUT ROWID;
+CREATE TABLE question_signatures (question_id PRIMARY KEY, theme TEXT NOT NULL, source TEXT, signature BLOB NOT NULL);
+CREATE INDEX idx_question_signatures_source ON question_signatures (source);
+"""
+
+
+def _content_themes(content_data: Dict[str, Any]) -> List[Tuple[str, str, List[Dict[str, Any]]]]:
+    """Темы файла контента в обоих форматах: (ID, название, вопросы)"""
+    themes_data = content_data.get("themes", [])
+    if isinstance(themes_data, dict):
+        return [(theme_id, theme.get("name", theme_id), theme.get("questions", []))
+                for theme_id, theme in themes_data.items()]
+    return [(theme.get("id", ""), theme.get("name", theme.get("id", "")), theme.get("questions", []))
+            for theme in themes_data if theme.get("id")]
+
+
+def _pack_questions(packs_dir: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Вопросы из пакетов *.jsonl каталога"""
+    if not packs_dir or not os.path.isdir(packs_dir):
+        return
+    for file_name in sorted(os.listdir(packs_dir)):
+        if not file_name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(packs_dir, file_name), 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def compile_content_store(content_file: str, packs_dir: Optional[str], output_file: str,
+                          signature_cache: Optional[SignatureCache] = None) -> Dict[str, int]:
+    """
+    Компилирует файл контента и пакеты вопросов в базу SQLite.
+    База собирается во временном файле и атомарно заменяет старую.
+
+    Args:
+        signature_cache: кэш сигнатур (сигнатуры неизмененных вопросов не пересчитываются);
+            None — кэш только на время компиляции
+
+    Returns:
+        Dict: количество тем, вопросов, тегов и пропущенных дубликатов ID
+    """
+    if signature_cache is None:
+        signature_cache = SignatureCache(None, MinHasher())
+    with open(content_file, 'r', encoding='utf-8') as file:
+        content_data = json.load(file)
+
+    tmp_file = output_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    stats = {"themes": 0, "questions": 0, "tags": 0, "duplicates": 0}
+    conn = sqlite3.connect(tmp_file)
+    try:
+        conn.executescript(SCHEMA)
+        seen_ids: Set[Any] = set()
+        theme_ids: List[str] = []
+
+        def add_question(theme_id: str, question: Dict[str, Any]) -> None:
+            question_id = question.get("id")
+            if question_id is None or question_id in seen_ids:
+                stats["duplicates"] += 1
+                return
+            seen_ids.add(question_id)
+            conn.execute("INSERT INTO questions (id, theme, data) VALUES (?, ?, ?)",
+                         (question_id, theme_id, json.dumps(question, ensure_ascii=False)))
+            tags = set(question.get("tags", []))
+            conn.executemany("INSERT INTO question_tags (tag, question_id) VALUES (?, ?)",
+                             [(tag, question_id) for tag in tags])
+            signature = signature_cache.signatures([question])[0]
+            conn.execute("INSERT INTO question_signatures (question_id, theme, source, signature) VALUES (?, ?, ?, ?)",
+                         (question_id, theme_id, (question.get("source") or {}).get("type"),
+                          MinHasher.to_bytes(signature)))
+            stats["questions"] += 1
+            stats["tags"] += len(tags)
+
+        for position, (theme_id, name, questions) in enumerate(_content_themes(content_data)):
+            conn.execute("INSERT INTO themes (id, name, position) VALUES (?, ?, ?)", (theme_id, name, position))
+            theme_ids.append(theme_id)
+            for question in questions:
+                add_question(theme_id, question)
+
+        default_theme = theme_ids[0] if theme_ids else ""
+        for question in _pack_questions(packs_dir):
+            theme_id = question.get("theme") or default_theme
+            if not theme_id:
+                continue
+            if theme_id not in theme_ids:
+                conn.execute("INSERT INTO themes (id, name, position) VALUES (?, ?, ?)",
+                             (theme_id, theme_id, len(theme_ids)))
+                theme_ids.append(theme_id)
+            add_question(theme_id, question)
+
+        stats["themes"] = len(theme_ids)
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+            ("built_at", time.strftime("%Y-%m-%dT%H:%M:%S")),
+            ("content_file", content_file),
+            ("packs_dir", packs_dir or ""),
+            ("signature_params", signature_cache.hasher.params)
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_file, output_file)
+    return stats
+
+
+class SqliteQuestionStore:
+    """
+    Вопросы из скомпилированной базы SQLite с LRU-кэшем разобранных вопросов
+    """
+
+    def __init__(self, path: str, cache_size: int = 5000):
+        self.path = path
+        self.cache_size = cache_size
+        # База только читается, поэтому одно соединение безопасно для всего процесса
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+        self.themes: List[Tuple[str, str]] = self._conn.execute(
+            "SELECT id, name FROM themes ORDER BY position"
+        ).fetchall()
+        # Тема -> ID ее вопросов (загружается при первом обращении к теме)
+        self._theme_ids: Dict[str, List[Any]] = {}
+        # ID -> запись разобранного вопроса (последние использованные)
+        self._cache: "OrderedDict[Any, QuestionRecord]" = OrderedDict()
+
+        # Счетчики для статистики
+        self.hits = 0
+        self.misses = 0
+
+        # Параметры сохраненных сигнатур (None — база собрана без сигнатур)
+        row = None
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'question_signatures'").fetchone():
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'signature_params'").fetchone()
+        self.signature_params: Optional[str] = row[0] if row else None
+
+        total, max_rowid = self._conn.execute("SELECT COUNT(*), MAX(rowid) FROM questions").fetchone()
+        # Наибольший uid записей базы; записи в памяти получают uid после него
+        self.max_uid = max_rowid or 0
+        logger.info(f"Content store {path} opened: {len(self.themes)} themes, {total} questions")
+
+    def theme_ids(self, theme_id: str) -> List[Any]:
+        """ID вопросов темы"""
+        ids = self._theme_ids.get(theme_id)
+        if ids is None:
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM questions WHERE theme = ? ORDER BY rowid", (theme_id,)
+            )]
+            self._theme_ids[theme_id] = ids
+        return ids
+
+    def contains(self, question_id: Any) -> bool:
+        """Есть ли вопрос с таким ID в базе (без разбора вопроса)"""
+        return self._conn.execute("SELECT 1 FROM questions WHERE id = ?", (question_id,)).fetchone() is not None
+
+    def get(self, question_id: Any) -> Optional[QuestionRecord]:
+        """Вопрос по ID или None"""
+        questions = self.get_many([question_id])
+        return questions[0] if questions else None
+
+    def get_many(self, question_ids: List[Any]) -> List[QuestionRecord]:
+        """Вопросы по списку ID в том же порядке (отсутствующие ID пропускаются)"""
+        missing = []
+        for question_id in question_ids:
+            if question_id in self._cache:
+                self._cache.move_to_end(question_id)
+                self.hits += 1
+            else:
+                missing.append(question_id)
+
+        loaded: Dict[Any, QuestionRecord] = {}
+        # SQLite ограничивает число параметров запроса, поэтому ID запрашиваются частями
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for rowid, question_id, data in self._conn.execute(
+                f"SELECT rowid, id, data FROM questions WHERE id IN ({placeholders})", chunk
+            ):
+                loaded[question_id] = QuestionRecord.from_dict(rowid, json.loads(data))
+        self.misses += len(missing)
+
+        result = []
+        for question_id in question_ids:
+            question = self._cache.get(question_id) or loaded.get(question_id)
+            if question is None:
+                continue
+            self._put(question_id, question)
+            result.append(question)
+        return result
+
+    def _put(self, question_id: Any, question: QuestionRecord) -> None:
+        self._cache[question_id] = question
+        self._cache.move_to_end(question_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def theme_tags(self, theme_id: str) -> Iterator[Tuple[str, Any]]:
+        """Пары (тег, ID вопроса) темы"""
+        return iter(self._conn.execute(
+            "SELECT t.tag, t.question_id FROM question_tags t JOIN questions q ON q.id = t.question_id "
+            "WHERE q.theme = ?", (theme_id,)
+        ))
+
+    def ids_by_tags(self, tags: Iterable[str], match_all: bool = False,
+                    theme_id: Optional[str] = None) -> Set[Any]:
+        """ID вопросов с любым (или со всеми) из тегов, при необходимости — только темы"""
+        tags = list(set(tags))
+        if not tags:
+            return set()
+        placeholders = ",".join("?" * len(tags))
+        query = "SELECT t.question_id FROM question_tags t"
+        params: List[Any] = list(tags)
+        if theme_id is not None:
+            query += " JOIN questions q ON q.id = t.question_id"
+        query += f" WHERE t.tag IN ({placeholders})"
+        if theme_id is not None:
+            query += " AND q.theme = ?"
+            params.append(theme_id)
+        query += " GROUP BY t.question_id"
+        if match_all:
+            query += " HAVING COUNT(*) = ?"
+            params.append(len(tags))
+        return {row[0] for row in self._conn.execute(query, params)}
+
+    def _reader(self) -> sqlite3.Connection:
+        """Отдельное соединение для долгого обхода (например, из потока построения индекса)"""
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def iter_questions(self, source_type: Optional[str] = None) -> Iterator[Tuple[str, QuestionRecord]]:
+        """
+        Все вопросы базы (тема, вопрос) без кэширования — для индексации и выгрузки
+
+        Args:
+            source_type: только вопросы с таким source.type (например, "ai")
+        """
+        conn = self._reader()
+        try:
+            if source_type is not None and self.signature_params is not None:
+                rows = conn.execute(
+                    "SELECT q.rowid, q.theme, q.data FROM question_signatures s JOIN questions q "
+                    "ON q.id = s.question_id WHERE s.source = ? ORDER BY q.rowid", (source_type,)
+                )
+            else:
+                rows = conn.execute("SELECT rowid, theme, data FROM questions ORDER BY rowid")
+            for rowid, theme_id, data in rows:
+                question = json.loads(data)
+                if source_type is not None and (question.get("source") or {}).get("type") != source_type:
+                    continue
+                yield theme_id, QuestionRecord.from_dict(rowid, question)
+        finally:
+            conn.close()
+
+    def iter_signatures(self) -> Iterator[Tuple[str, Any, List[int]]]:
+        """Сохраненные при компиляции сигнатуры вопросов: (тема, ID вопроса, сигнатура)"""
+        conn = self._reader()
+        try:
+            for theme_id, question_id, data in conn.execute(
+                "SELECT theme, question_id, signature FROM question_signatures"
+            ):
+                yield theme_id, question_id, MinHasher.from_bytes(data)
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику хранилища"""
+        requests = self.hits + self.misses
+        return {
+            "cached": f"{len(self._cache)} / {self.cache_size}",
+            "hit_rate": f"{self.hits / requests * 100:.0f}%" if requests else "—",
+            "themes_loaded": len(self._theme_ids)
+        }
+
+    def close(self) -> None:
+        self._conn.close()
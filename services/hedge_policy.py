@@ -0,0 +1,93 @@
+"""
+Политика хеджирования запросов к AI API.
+
+Если ответ на запрос не пришел за заданную задержку (по умолчанию — наблюдаемый
+p90), отправляется второй такой же запрос, и используется тот, что ответит первым.
+Доля хеджирующих запросов ограничена, чтобы расходы оставались предсказуемыми.
+"""
+import time
+from collections import deque
+from typing import Dict, Any, Deque
+from config import config
+
+
+class HedgePolicy:
+    """
+    Задержка перед хеджирующим запросом и ограничение их доли
+    """
+
+    # Минимум наблюдений, после которого задержка берется из p90
+    MIN_SAMPLES = 20
+
+    def __init__(self):
+        self.enabled = config.ai_hedge_enabled
+        self.fixed_delay = config.ai_hedge_delay
+        self.default_delay = config.ai_hedge_default_delay
+        self.min_delay = config.ai_hedge_min_delay
+        self.max_ratio = config.ai_hedge_max_ratio
+        self.model = config.ai_hedge_model
+        self.window_seconds = 600
+
+        # Наблюдаемые задержки по видам запросов ("completion" — весь ответ, "stream" — первый фрагмент)
+        self._samples: Dict[str, Deque[float]] = {}
+        # Время отправки основных и хеджирующих запросов в окне
+        self._primaries: Deque[float] = deque()
+        self._hedges: Deque[float] = deque()
+
+        # Счетчики для статистики
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+
+    def observe(self, kind: str, seconds: float) -> None:
+        """Записывает время ответа успешного запроса"""
+        samples = self._samples.setdefault(kind, deque(maxlen=500))
+        samples.append(seconds)
+
+    def delay(self, kind: str) -> float:
+        """Возвращает задержку перед хеджирующим запросом"""
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        samples = self._samples.get(kind)
+        if not samples or len(samples) < self.MIN_SAMPLES:
+            return self.default_delay
+        ordered = sorted(samples)
+        p90 = ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))]
+        return max(self.min_delay, p90)
+
+    def _trim(self, now: float) -> None:
+        for times in (self._primaries, self._hedges):
+            while times and times[0] < now - self.window_seconds:
+                times.popleft()
+
+    def record_primary(self) -> None:
+        """Учитывает основной запрос"""
+        self._primaries.append(time.monotonic())
+
+    def try_acquire(self) -> bool:
+        """Разрешает хеджирующий запрос, если их доля в окне не превышает лимит"""
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._hedges) + 1 > self.max_ratio * max(len(self._primaries), 1):
+            return False
+        self._hedges.append(now)
+        self.hedges_sent += 1
+        return True
+
+    def hedge_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Тело хеджирующего запроса (с запасной моделью, если она задана)"""
+        hedged = dict(payload)
+        if self.model:
+            hedged["model"] = self.model
+        return hedged
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику хеджирования"""
+        self._trim(time.monotonic())
+        return {
+            "enabled": self.enabled,
+            "delay_completion": f"{self.delay('completion'):.1f} сек",
+            "delay_stream": f"{self.delay('stream'):.1f} сек",
+            "hedges_sent": self.hedges_sent,
+            "hedge_wins": self.hedge_wins,
+            "hedge_ratio_window": f"{len(self._hedges)}/{len(self._primaries)}"
+        }
@@ -0,0 +1,170 @@
+"""
+Сбор проверенных ИИ-вопросов в банк вопросов.
+
+Каждый новый ИИ-вопрос, прошедший валидацию, сохраняется в пакет
+config.harvested_questions_file (JSONL) с темой, тегами и источником и
+добавляется в QuestionService. Перефразированные дубликаты уже известных
+вопросов (из контента или ранее собранных) отсеиваются по MinHash/LSH.
+Когда по теме собрано достаточно вопросов с тегами из запрошенного набора,
+пул вопросов берет их из банка вместо нового запроса к API.
+
+Индекс дубликатов строится фоновой задачей build_index (запускается при
+старте бота): сигнатуры вопросов скомпилированной базы берутся из нее
+самой, остальные — из кэша (services/question_signatures.py), а недостающие
+считаются в отдельном потоке, не блокируя обработку
+обновлений. Пока индекс не готов, вопросы не собираются — без индекса
+нельзя проверить, что вопрос не дубликат.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Any, Optional, Tuple
+from config import config
+from services.question_signatures import SignatureCache, iter_question_signatures, question_text, text_digest
+from utils.logger import logger
+from utils.text_similarity import LSHIndex, normalize_text
+
+
+class QuestionHarvester:
+    """
+    Сохраняет ИИ-вопросы в банк с отсевом почти одинаковых
+    """
+
+    def __init__(self, question_service, pack_file: Optional[str] = None):
+        self.question_service = question_service
+        self.pack_file = pack_file if pack_file is not None else config.harvested_questions_file
+        self.min_bank_size = config.harvest_min_bank_size
+        self.index = LSHIndex(threshold=config.harvest_similarity_threshold)
+        self.signature_cache = SignatureCache(config.harvest_signature_cache_file, self.index.hasher)
+        # Индекс построен (до этого вопросы не собираются)
+        self.ready = False
+
+        # Тема -> собранные вопросы
+        self._banks: Dict[str, List[Dict[str, Any]]] = {}
+
+        # Счетчики для статистики
+        self.harvested = 0
+        self.duplicates = 0
+        self.skipped_not_ready = 0
+
+    @staticmethod
+    def _normalize_tags(tags: List[str]) -> set:
+        return {tag.strip().lower() for tag in tags if tag and tag.strip()}
+
+    def _collect(self) -> Tuple[List[Tuple[str, List[int]]], Dict[str, List[Dict[str, Any]]]]:
+        """Сигнатуры всех вопросов банка и собранные ранее вопросы по темам (выполняется в потоке)"""
+        entries = [
+            (f"{theme_id}:{question_id}", sig)
+            for theme_id, question_id, sig in iter_question_signatures(self.question_service, self.signature_cache)
+        ]
+        # Разбираются только ИИ-вопросы (в базе они отбираются по сохраненному типу источника)
+        banks: Dict[str, List[Dict[str, Any]]] = {}
+        for theme_id, question in self.question_service.iter_questions(source_type="ai"):
+            banks.setdefault(theme_id, []).append(question)
+        return entries, banks
+
+    async def build_index(self) -> None:
+        """Индексирует все вопросы банка, включая ранее собранные из пакета (фоновая задача)"""
+        started_at = time.monotonic()
+        try:
+            entries, banks = await asyncio.to_thread(self._collect)
+        except Exception as e:
+            logger.error(f"Error building question harvester index: {str(e)}")
+            return
+        for start in range(0, len(entries), 5000):
+            for key, sig in entries[start:start + 5000]:
+                self.index.add_signature(key, sig)
+            # Вставка в LSH-индекс — на цикле событий, частями
+            await asyncio.sleep(0)
+        self._banks = banks
+        self.ready = True
+        harvested_total = sum(len(bank) for bank in banks.values())
+        logger.info(f"Question harvester indexed {len(self.index)} questions, {harvested_total} harvested "
+                    f"({self.signature_cache.computed} signatures computed, {self.signature_cache.reused} cached) "
+                    f"in {time.monotonic() - started_at:.1f} sec")
+
+    def harvest(self, question: Dict[str, Any], topic_key: str, request_tags: List[str],
+                model: Optional[str] = None) -> bool:
+        """
+        Сохраняет валидированный ИИ-вопрос в банк, если похожего там еще нет
+
+        Args:
+            question: вопрос в формате generate_questions
+            topic_key: ключ темы
+            request_tags: теги, по которым запрашивалась генерация
+            model: модель, сгенерировавшая вопрос
+
+        Returns:
+            True, если вопрос добавлен в банк
+        """
+        if not self.pack_file:
+            return False
+        if not self.ready:
+            self.skipped_not_ready += 1
+            return False
+
+        text = question_text(question)
+        if self.index.query(text):
+            self.duplicates += 1
+            return False
+
+        digest = hashlib.sha1(normalize_text(question["question"]).encode("utf-8")).hexdigest()[:16]
+        record = {
+            "id": f"h_{digest}",
+            "question": question["question"],
+            "options": list(question["options"]),
+            "correct_answer": question["correct_answer"],
+            "tags": list(question.get("tags", [])),
+            "theme": topic_key,
+            "request_tags": sorted(request_tags),
+            "source": {
+                "type": "ai",
+                "model": model,
+                "harvested_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+            }
+        }
+
+        try:
+            directory = os.path.dirname(self.pack_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.pack_file, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Error saving harvested question: {str(e)}")
+            return False
+
+        sig = self.index.add(f"{topic_key}:{record['id']}", text)
+        self.signature_cache.put_many([(text_digest(text), sig)])
+        # В банк попадает компактная запись из QuestionService, а не копия словаря
+        self._banks.setdefault(topic_key, []).extend(self.question_service.add_questions(topic_key, [record]))
+        self.harvested += 1
+        return True
+
+    def get_bank(self, topic_key: str, tags: List[str]) -> List[Dict[str, Any]]:
+        """
+        Возвращает собранные вопросы темы, у которых есть хотя бы один тег
+        из набора, если их достаточно (не меньше config.harvest_min_bank_size),
+        иначе пустой список
+        """
+        wanted = self._normalize_tags(tags)
+        bank = [
+            question for question in self._banks.get(topic_key, [])
+            if wanted & self._normalize_tags(question.get("tags", []) + question.get("request_tags", []))
+        ]
+        return bank if len(bank) >= self.min_bank_size else []
+
+    def close(self) -> None:
+        self.signature_cache.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику сбора вопросов"""
+        return {
+            "indexed": len(self.index) if self.ready else f"{len(self.index)} (строится)",
+            "harvested": self.harvested,
+            "duplicates": self.duplicates,
+            "skipped_not_ready": self.skipped_not_ready,
+            "bank_size": sum(len(bank) for bank in self._banks.values())
+        }
@@ -0,0 +1,187 @@
+"""
+Компактное представление вопросов банка.
+
+Вопрос из JSON — словарь с повторяющимися строковыми ключами и своими
+копиями строк тегов. QuestionService хранит вопросы как неизменяемые
+записи QuestionRecord со __slots__: у записи есть внутренний
+целочисленный ID (uid), варианты ответа — кортеж, а теги — кортеж
+целочисленных ID из общего словаря тегов (TagVocabulary). Индексы,
+позиции тегов и счетчики ошибок работают с этими числами, а названия
+тегов нужны только при выводе пользователю.
+
+Теги контента добавляются в словарь без ограничений (их набор конечен).
+Теги из свободного текста — сгенерированных ИИ и собранных вопросов,
+восстановленных сессий — добавляются, только пока таких тегов меньше
+config.tag_vocabulary_max_free_tags; остальные новые теги получают общий
+ID тега OTHER_TAG, поэтому словарь не растет все время работы процесса.
+
+Запись поддерживает чтение как словарь (question["options"],
+question.get("tags", [])), поэтому обработчики и сервисы, которые
+работают с вопросами-словарями (в том числе сгенерированными ИИ),
+не требуют изменений.
+"""
+import sys
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
+from config import config
+
+# Общий тег для новых тегов свободного текста сверх лимита словаря
+OTHER_TAG = "другое"
+
+
+class TagVocabulary:
+    """Словарь тегов: название <-> небольшой целочисленный ID"""
+
+    def __init__(self, max_free_tags: Optional[int] = None):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        # Сколько тегов свободного текста можно добавить (None — без ограничения)
+        self.max_free_tags = max_free_tags
+        self.free_tags = 0
+        # Счетчик тегов, замененных на OTHER_TAG (для статистики)
+        self.overflowed = 0
+
+    def intern(self, tag: str) -> int:
+        """ID тега; новый тег добавляется в словарь"""
+        tag_id = self._ids.get(tag)
+        if tag_id is None:
+            # Названия тегов тоже интернируются: одна строка на тег во всем процессе
+            tag = sys.intern(str(tag))
+            tag_id = len(self._names)
+            self._ids[tag] = tag_id
+            self._names.append(tag)
+        return tag_id
+
+    def intern_all(self, tags: Iterable[str]) -> Tuple[int, ...]:
+        """ID тегов без повторов, в порядке первого появления"""
+        return tuple(dict.fromkeys(self.intern(tag) for tag in tags if tag))
+
+    def intern_free(self, tag: str) -> int:
+        """ID тега из свободного текста: сверх лимита новые теги получают ID OTHER_TAG"""
+        tag_id = self._ids.get(tag)
+        if tag_id is not None:
+            return tag_id
+        if self.max_free_tags is not None and self.free_tags >= self.max_free_tags:
+            self.overflowed += 1
+            return self.intern(OTHER_TAG)
+        self.free_tags += 1
+        return self.intern(tag)
+
+    def intern_free_all(self, tags: Iterable[str]) -> Tuple[int, ...]:
+        """ID тегов свободного текста без повторов, в порядке первого появления"""
+        return tuple(dict.fromkeys(self.intern_free(tag) for tag in tags if tag))
+
+    def lookup(self, tag: str) -> Optional[int]:
+        """ID известного тега или None (словарь не пополняется)"""
+        return self._ids.get(tag)
+
+    def name(self, tag_id: int) -> str:
+        return self._names[tag_id]
+
+    def names(self, tag_ids: Iterable[int]) -> List[str]:
+        return [self._names[tag_id] for tag_id in tag_ids]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"tags": len(self._names), "free_tags": self.free_tags, "overflowed": self.overflowed}
+
+
+class QuestionRecord:
+    """
+    Неизменяемый вопрос банка с доступом на чтение как к словарю
+    """
+    __slots__ = ("uid", "id", "question", "options", "correct_answer", "tag_ids", "extra")
+
+    # Поля, которые хранятся в слотах; остальные поля вопроса — в extra
+    FIELDS = ("id", "question", "options", "correct_answer", "tags")
+
+    def __init__(self, uid: int, question_id: Any, question: str, options: Tuple[str, ...],
+                 correct_answer: int, tag_ids: Tuple[int, ...], extra: Optional[Dict[str, Any]] = None):
+        setattr_ = object.__setattr__
+        setattr_(self, "uid", uid)
+        setattr_(self, "id", question_id)
+        setattr_(self, "question", question)
+        setattr_(self, "options", options)
+        setattr_(self, "correct_answer", correct_answer)
+        setattr_(self, "tag_ids", tag_ids)
+        setattr_(self, "extra", extra)
+
+    @classmethod
+    def from_dict(cls, uid: int, data: Dict[str, Any], free_tags: bool = False) -> "QuestionRecord":
+        """
+        Создает запись из вопроса в формате JSON; теги добавляются в tag_vocabulary
+
+        Args:
+            free_tags: теги из свободного текста (например, собранного ИИ-вопроса) — с лимитом словаря
+        """
+        extra = {key: value for key, value in data.items() if key not in cls.FIELDS}
+        tags = data.get("tags", ())
+        return cls(
+            uid,
+            data.get("id"),
+            data.get("question", ""),
+            tuple(data.get("options", ())),
+            data.get("correct_answer", 0),
+            tag_vocabulary.intern_free_all(tags) if free_tags else tag_vocabulary.intern_all(tags),
+            extra or None
+        )
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("QuestionRecord is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("QuestionRecord is immutable")
+
+    @property
+    def tags(self) -> List[str]:
+        return tag_vocabulary.names(self.tag_ids)
+
+    # Доступ как к словарю вопроса
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "tags":
+            return self.tags
+        if key in ("id", "question", "options", "correct_answer"):
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.FIELDS or (self.extra is not None and key in self.extra)
+
+    def keys(self) -> List[str]:
+        return list(self.FIELDS) + (list(self.extra) if self.extra is not None else [])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Вопрос в формате JSON (варианты и теги — списки)"""
+        data = dict(self.items())
+        data["options"] = list(self.options)
+        return data
+
+    def __repr__(self) -> str:
+        return f"QuestionRecord(uid={self.uid}, id={self.id!r}, tags={self.tags!r})"
+
+
+def question_tag_ids(question: Dict[str, Any]) -> Tuple[int, ...]:
+    """ID тегов вопроса — записи или словаря (например, сгенерированного ИИ)"""
+    if isinstance(question, QuestionRecord):
+        return question.tag_ids
+    return tag_vocabulary.intern_free_all(question.get("tags", ()))
+
+
+# Общий словарь тегов: ID тегов совпадают в демо-версии, полной версии и у счетчиков ошибок
+tag_vocabulary = TagVocabulary(config.tag_vocabulary_max_free_tags or None)
@@ -0,0 +1,438 @@
+"""
+Пул заранее сгенерированных ИИ-вопросов.
+
+Вопросы хранятся по ключу (тема, отдельный нормализованный тег) и
+переиспользуются между пользователями: каждый пользователь получает только
+те вопросы, которых еще не видел. Набор тегов сессии берется из случайных
+вопросов банка и почти не повторяется, поэтому ключом служит не набор, а
+каждый тег: запрос по тегам a, b, c набирает вопросы поровну из ключей
+a, b и c. Сгенерированный вопрос попадает в ключи тех запрошенных тегов,
+которые у него есть, а вопрос без них — в общий ключ темы.
+
+Когда в ключе остается мало вопросов, он пополняется в фоне, но только если
+его запрашивали хотя бы config.question_pool_refill_min_requests раз:
+впервые встреченный тег не стоит отдельной генерации. За один запрос
+пополняется не больше одного ключа. Пул вытесняет ключи по LRU, а вопросы —
+по TTL, и сохраняется в SQLite, чтобы после перезапуска бот не начинал с
+пустого пула. Изменения копятся в памяти и записываются через одно
+соединение пакетом (flush раз в config.question_pool_flush_interval), а
+не отдельной транзакцией на каждый вопрос.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator
+from config import config
+from services.ai_quota import current_user
+from services.ai_scheduler import PRIORITY_BACKGROUND
+from utils.logger import logger
+
+
+class QuestionPool:
+    """
+    Пул валидированных ИИ-вопросов перед AIService.generate_questions
+    """
+
+    def __init__(self, ai_service, db_path: Optional[str] = None, harvester=None):
+        self.ai_service = ai_service
+        # Сбор ИИ-вопросов в банк (QuestionHarvester); None — не собирать
+        self.harvester = harvester
+        self.db_path = db_path if db_path is not None else config.question_pool_file
+        self.ttl = config.question_pool_ttl
+        self.max_keys = config.question_pool_max_keys
+        self.max_per_key = config.question_pool_max_per_key
+        self.low_water = config.question_pool_low_water
+        self.refill_batch = config.question_pool_refill_batch
+        self.refill_min_requests = config.question_pool_refill_min_requests
+        self.max_seen_per_user = config.question_pool_max_seen_per_user
+
+        # Ключ пула -> (отпечаток вопроса -> (вопрос, время создания)); порядок ключей — LRU
+        self._entries: "OrderedDict[str, OrderedDict[str, Tuple[Dict[str, Any], float]]]" = OrderedDict()
+        # Ключ пула -> сколько раз его запрашивали (ключи из сохраненного пула уже запрашивались)
+        self._requests: Dict[str, int] = {}
+        # ID пользователя -> отпечатки уже показанных ему вопросов
+        self._seen: "OrderedDict[int, OrderedDict[str, None]]" = OrderedDict()
+        # Активные фоновые пополнения по ключам
+        self._refill_tasks: Dict[str, asyncio.Task] = {}
+        # Соединение с базой пула и еще не записанные изменения (запрос, параметры) по порядку
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: List[Tuple[str, List[tuple]]] = []
+
+        # Счетчики для статистики
+        self.hits = 0
+        self.misses = 0
+        self.bank_hits = 0
+        self.refills = 0
+
+        if self.db_path:
+            try:
+                self._init_database()
+                self._load()
+            except Exception as e:
+                logger.error(f"Error opening question pool database {self.db_path}: {str(e)}")
+                self._conn = None
+
+    @staticmethod
+    def normalize_tags(tags: List[str]) -> List[str]:
+        """Нормализованные теги без повторов, в порядке первого появления"""
+        return list(dict.fromkeys(tag.strip().lower() for tag in tags if tag and tag.strip()))
+
+    @staticmethod
+    def make_key(topic_key: str, tag: Optional[str] = None) -> str:
+        """Возвращает ключ пула: тема + нормализованный тег (без тега — общий ключ темы)"""
+        return f"{topic_key}|{tag.strip().lower() if tag else '*'}"
+
+    @staticmethod
+    def fingerprint(question: Dict[str, Any]) -> str:
+        """Возвращает отпечаток вопроса по нормализованному тексту"""
+        text = " ".join(str(question.get("question", "")).lower().split())
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+    def _init_database(self) -> None:
+        """Создает таблицу пула в SQLite"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS pool_questions (
+            pool_key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (pool_key, fingerprint)
+        )
+        ''')
+        self._conn.commit()
+
+    def _load(self) -> None:
+        """Загружает сохраненный пул, отбрасывая устаревшие вопросы"""
+        try:
+            with self._conn:
+                self._conn.execute("DELETE FROM pool_questions WHERE created_at < ?", (time.time() - self.ttl,))
+            rows = self._conn.execute(
+                "SELECT pool_key, fingerprint, payload, created_at FROM pool_questions ORDER BY created_at"
+            ).fetchall()
+        except Exception as e:
+            logger.error(f"Error loading question pool: {str(e)}")
+            return
+
+        legacy_keys = set()
+        for pool_key, fp, payload, created_at in rows:
+            if "," in pool_key.split("|", 1)[-1]:
+                # Ключ по набору тегов из прежней версии пула
+                legacy_keys.add(pool_key)
+                continue
+            bucket = self._entries.setdefault(pool_key, OrderedDict())
+            bucket[fp] = (json.loads(payload), created_at)
+            self._requests[pool_key] = 1
+        for pool_key in legacy_keys:
+            self._persist_delete(pool_key)
+        self.flush()
+
+        logger.info(f"Question pool loaded: {len(rows)} questions in {len(self._entries)} keys")
+
+    def _persist_add(self, pool_key: str, items: List[Tuple[str, Dict[str, Any], float]]) -> None:
+        if self._conn is None or not items:
+            return
+        self._pending.append((
+            "INSERT OR REPLACE INTO pool_questions (pool_key, fingerprint, payload, created_at) VALUES (?, ?, ?, ?)",
+            [(pool_key, fp, json.dumps(q, ensure_ascii=False), created_at) for fp, q, created_at in items]
+        ))
+
+    def _persist_delete(self, pool_key: str, fingerprints: Optional[List[str]] = None) -> None:
+        if self._conn is None:
+            return
+        if fingerprints is None:
+            self._pending.append(("DELETE FROM pool_questions WHERE pool_key = ?", [(pool_key,)]))
+        else:
+            self._pending.append(("DELETE FROM pool_questions WHERE pool_key = ? AND fingerprint = ?",
+                                  [(pool_key, fp) for fp in fingerprints]))
+
+    def flush(self) -> int:
+        """
+        Записывает накопленные изменения пула одной транзакцией
+        (периодически из flush_stores и при остановке бота)
+
+        Returns:
+            int: количество записанных изменений
+        """
+        if self._conn is None or not self._pending:
+            return 0
+        pending, self._pending = self._pending, []
+        try:
+            with self._conn:
+                for query, params in pending:
+                    self._conn.executemany(query, params)
+        except Exception as e:
+            logger.error(f"Error saving question pool: {str(e)}")
+            return 0
+        return len(pending)
+
+    def _fresh_bucket(self, pool_key: str) -> "OrderedDict[str, Tuple[Dict[str, Any], float]]":
+        """Возвращает вопросы ключа, удалив устаревшие по TTL, и отмечает ключ как недавно использованный"""
+        bucket = self._entries.get(pool_key)
+        if bucket is None:
+            bucket = OrderedDict()
+            self._entries[pool_key] = bucket
+        self._entries.move_to_end(pool_key)
+
+        expire_before = time.time() - self.ttl
+        expired = [fp for fp, (_, created_at) in bucket.items() if created_at < expire_before]
+        for fp in expired:
+            del bucket[fp]
+        if expired:
+            self._persist_delete(pool_key, expired)
+
+        self._evict_keys()
+        return bucket
+
+    def _evict_keys(self) -> None:
+        """Вытесняет наименее давно использованные ключи сверх лимита"""
+        while len(self._entries) > self.max_keys:
+            pool_key, _ = self._entries.popitem(last=False)
+            self._requests.pop(pool_key, None)
+            self._persist_delete(pool_key)
+            logger.info(f"Question pool evicted key {pool_key}")
+
+    def _add(self, pool_key: str, questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Добавляет вопросы в пул и возвращает их версии из пула (с присвоенными ID)"""
+        bucket = self._fresh_bucket(pool_key)
+        now = time.time()
+        added = []
+        result = []
+        for question in questions:
+            fp = self.fingerprint(question)
+            if fp in bucket:
+                # Такой вопрос уже есть в пуле — используем существующую версию
+                result.append(bucket[fp][0])
+                continue
+            stored = dict(question)
+            stored["id"] = f"ai_{fp}"
+            added.append((fp, stored, now))
+            bucket[fp] = (stored, now)
+            result.append(stored)
+
+        # Ограничиваем размер ключа, удаляя самые старые вопросы
+        dropped = []
+        while len(bucket) > self.max_per_key:
+            fp, _ = bucket.popitem(last=False)
+            dropped.append(fp)
+        if dropped:
+            self._persist_delete(pool_key, dropped)
+
+        self._persist_add(pool_key, [item for item in added if item[0] in bucket])
+        return result
+
+    def _user_seen(self, user_id: int) -> "OrderedDict[str, None]":
+        seen = self._seen.get(user_id)
+        if seen is None:
+            seen = OrderedDict()
+            self._seen[user_id] = seen
+        self._seen.move_to_end(user_id)
+        # Ограничиваем количество отслеживаемых пользователей
+        while len(self._seen) > self.max_keys * 10:
+            self._seen.popitem(last=False)
+        return seen
+
+    def _mark_seen(self, user_id: int, fingerprints: List[str]) -> None:
+        seen = self._user_seen(user_id)
+        for fp in fingerprints:
+            seen[fp] = None
+            seen.move_to_end(fp)
+        while len(seen) > self.max_seen_per_user:
+            seen.popitem(last=False)
+
+    def _harvest(self, topic_key: str, tags: List[str], questions: List[Dict[str, Any]]) -> None:
+        """Передает новые ИИ-вопросы в банк вопросов"""
+        if self.harvester is None:
+            return
+        for question in questions:
+            self.harvester.harvest(question, topic_key, tags, self.ai_service.model)
+
+    @staticmethod
+    def _topic_with_tags(topic_name: str, tags: List[str]) -> str:
+        tags_text = ", ".join(sorted(tags))
+        return f"{topic_name} по следующим тегам: {tags_text}"
+
+    def _route(self, topic_key: str, tags: List[str], question: Dict[str, Any]) -> List[str]:
+        """
+        Ключи пула для сгенерированного вопроса: запрошенные теги, которые есть у вопроса.
+        Вопрос без них относится к единственному запрошенному тегу или к общему ключу темы
+        """
+        requested = self.normalize_tags(tags)
+        own = set(self.normalize_tags(question.get("tags", [])))
+        matched = [tag for tag in requested if tag in own]
+        if not matched and len(requested) == 1:
+            matched = requested
+        return [self.make_key(topic_key, tag) for tag in matched] or [self.make_key(topic_key)]
+
+    def _store(self, topic_key: str, tags: List[str], questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Добавляет сгенерированные вопросы в ключи их тегов и возвращает их версии из пула"""
+        result = []
+        for question in questions:
+            stored = [self._add(pool_key, [question])[0] for pool_key in self._route(topic_key, tags, question)]
+            result.append(stored[0])
+        return result
+
+    @staticmethod
+    def _unseen(bucket: "OrderedDict[str, Tuple[Dict[str, Any], float]]",
+                seen: "OrderedDict[str, None]") -> List[Tuple[str, Dict[str, Any]]]:
+        return [(fp, question) for fp, (question, _) in bucket.items() if fp not in seen]
+
+    async def get_questions(self, user_id: int, topic_key: str, topic_name: str,
+                            tags: List[str], count: int) -> List[Dict[str, Any]]:
+        """
+        Возвращает до count вопросов, которых пользователь еще не видел.
+        Сначала берет вопросы из пула, недостающие генерирует через ИИ.
+
+        Args:
+            user_id: ID пользователя
+            topic_key: ключ темы
+            topic_name: название темы для промпта
+            tags: теги, по которым нужны вопросы
+            count: количество вопросов
+
+        Returns:
+            List[Dict]: копии вопросов из пула
+        """
+        return [question async for question in self.stream_questions(user_id, topic_key, topic_name, tags, count)]
+
+    async def stream_questions(self, user_id: int, topic_key: str, topic_name: str,
+                               tags: List[str], count: int) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый вариант get_questions: сразу отдает вопросы из пула и банка
+        собранных вопросов, а недостающие — по одному, по мере потоковой генерации ИИ
+        """
+        normalized = self.normalize_tags(tags)
+        tag_keys = [self.make_key(topic_key, tag) for tag in normalized]
+        for pool_key in tag_keys:
+            self._requests[pool_key] = self._requests.get(pool_key, 0) + 1
+        buckets = [self._fresh_bucket(pool_key) for pool_key in tag_keys]
+        topic_bucket = self._fresh_bucket(self.make_key(topic_key))
+        seen = self._user_seen(user_id)
+
+        # Поровну из ключей запрошенных тегов, затем из общего ключа темы
+        selected: Dict[str, Dict[str, Any]] = {}
+        for row in itertools.zip_longest(*[self._unseen(bucket, seen) for bucket in buckets]):
+            for item in row:
+                if item is not None and len(selected) < count:
+                    selected.setdefault(item[0], item[1])
+        for fp, question in self._unseen(topic_bucket, seen):
+            if len(selected) >= count:
+                break
+            selected.setdefault(fp, question)
+        self.hits += len(selected)
+        self._mark_seen(user_id, list(selected))
+        for question in selected.values():
+            yield dict(question)
+
+        served = len(selected)
+        
+        # Банк собранных вопросов по этому набору тегов достаточно велик — берем из него
+        bank = self.harvester.get_bank(topic_key, tags) if self.harvester is not None else []
+        if bank and served < count:
+            candidates = [question for question in bank if self.fingerprint(question) not in seen]
+            from_bank = random.sample(candidates, min(count - served, len(candidates)))
+            self.bank_hits += len(from_bank)
+            self._mark_seen(user_id, [self.fingerprint(q) for q in from_bank])
+            for question in from_bank:
+                yield dict(question)
+            served += len(from_bank)
+            
+        missing = count - served
+        if missing > 0:
+            self.misses += missing
+            logger.info(f"Question pool miss for {topic_key} ({', '.join(normalized)}): generating {missing} questions")
+            async for generated in self.ai_service.generate_questions_stream(
+                topic=self._topic_with_tags(topic_name, tags),
+                num_questions=missing
+            ):
+                stored = self._store(topic_key, tags, [generated])
+                self._harvest(topic_key, tags, stored)
+                if served >= count:
+                    # Лишние вопросы остаются в пуле для других пользователей
+                    continue
+                for question in stored:
+                    fp = self.fingerprint(question)
+                    if fp in seen:
+                        continue
+                    self._mark_seen(user_id, [fp])
+                    served += 1
+                    yield dict(question)
+        else:
+            logger.info(f"Question pool hit for {topic_key} ({', '.join(normalized)}): {served} questions")
+
+        # Пополняем в фоне один ключ, в котором осталось мало вопросов для этого пользователя или в целом:
+        # самый востребованный из запрошенных повторно (если по набору тегов уже собран банк, пополнение не нужно)
+        if not bank:
+            low_keys = [
+                (self._requests.get(pool_key, 0), pool_key, tag)
+                for pool_key, tag, bucket in zip(tag_keys, normalized, buckets)
+                if self._requests.get(pool_key, 0) >= self.refill_min_requests
+                and (len(self._unseen(bucket, seen)) < self.low_water or len(bucket) < self.low_water)
+            ]
+            if low_keys:
+                _, pool_key, tag = max(low_keys)
+                self._schedule_refill(pool_key, topic_key, topic_name, tag)
+
+    def _schedule_refill(self, pool_key: str, topic_key: str, topic_name: str, tag: str) -> None:
+        """Запускает фоновое пополнение ключа, если оно еще не идет"""
+        task = self._refill_tasks.get(pool_key)
+        if task is not None and not task.done():
+            return
+        self._refill_tasks[pool_key] = asyncio.create_task(self._refill(pool_key, topic_key, topic_name, tag))
+
+    async def _refill(self, pool_key: str, topic_key: str, topic_name: str, tag: str) -> None:
+        # Пополнение общее для всех пользователей и не расходует квоту того, кто его вызвал
+        current_user.set(None)
+        try:
+            self.refills += 1
+            generated = await self.ai_service.generate_questions(
+                topic=self._topic_with_tags(topic_name, [tag]),
+                num_questions=self.refill_batch,
+                priority=PRIORITY_BACKGROUND
+            )
+            added = self._store(topic_key, [tag], generated)
+            self._harvest(topic_key, [tag], added)
+            logger.info(f"Question pool refilled {pool_key}: +{len(added)} questions")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error refilling question pool: {str(e)}")
+        finally:
+            self._refill_tasks.pop(pool_key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику пула"""
+        return {
+            "keys": len(self._entries),
+            "questions": sum(len(bucket) for bucket in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bank_hits": self.bank_hits,
+            "refills": self.refills,
+            "refills_in_flight": len(self._refill_tasks),
+            "pending_writes": len(self._pending)
+        }
+
+    async def close(self) -> None:
+        """Отменяет фоновые пополнения и записывает изменения пула (вызывается при остановке бота)"""
+        tasks = [task for task in self._refill_tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._refill_tasks.clear()
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
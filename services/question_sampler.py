@@ -0,0 +1,211 @@
+"""
+Выбор вопросов без повторов для пользователя.
+
+Вопросы темы выбираются по позициям в списке темы: выборка k позиций из
+n не копирует и не перемешивает весь банк. Для каждого пользователя и
+набора вопросов хранится битовая маска уже показанных позиций (n/8 байт),
+поэтому при новом тесте пользователь получает вопросы, которых еще не
+видел. Когда непоказанных вопросов не хватает, маска сбрасывается и
+выборка продолжается по всему набору, не повторяя только что выданные.
+
+Маска верна, пока позиции набора указывают на те же вопросы: добавление
+вопросов в конец набора (собранные ИИ-вопросы) ее не портит, а после
+перезагрузки контента набор строится заново, и QuestionService удаляет
+маски его наборов (drop_pools).
+"""
+import random
+import sys
+from typing import Dict, List, Any, Callable, Optional, Tuple
+from config import config
+from utils.bounded_store import BoundedStore
+
+
+class _SeenSet:
+    """Битовая маска показанных позиций набора вопросов"""
+    __slots__ = ("bits", "size", "count")
+
+    def __init__(self, size: int):
+        self.bits = bytearray((size + 7) // 8)
+        self.size = size
+        self.count = 0
+
+    def grow(self, size: int) -> None:
+        """Расширяет маску, если в набор добавились вопросы (новые позиции не показаны)"""
+        if size > self.size:
+            self.bits.extend(bytes((size + 7) // 8 - len(self.bits)))
+            self.size = size
+
+    def __contains__(self, index: int) -> bool:
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index: int) -> None:
+        if index not in self:
+            self.bits[index >> 3] |= 1 << (index & 7)
+            self.count += 1
+
+    def clear(self) -> None:
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+    def draw(self, k: int) -> List[int]:
+        """Выбирает до k непоказанных позиций и отмечает их показанными"""
+        unseen = self.size - self.count
+        if unseen <= 0 or k <= 0:
+            return []
+        if k >= unseen or unseen * 4 < self.size:
+            # Непоказанных мало: перебор маски дешевле, чем многократные промахи
+            candidates = [i for i in range(self.size) if i not in self]
+            picked = random.sample(candidates, min(k, len(candidates)))
+            for index in picked:
+                self.add(index)
+            return picked
+
+        # Непоказанных не меньше четверти: в среднем не более 4 попыток на позицию
+        picked = []
+        while len(picked) < k:
+            index = random.randrange(self.size)
+            if index not in self:
+                self.add(index)
+                picked.append(index)
+        return picked
+
+
+class QuestionSampler:
+    """
+    Выборка позиций вопросов без повторов с учетом уже показанных пользователю
+    """
+    name = "Показанные вопросы"
+
+    def __init__(self):
+        # (ID пользователя, ключ набора) -> показанные позиции; маски неактивных
+        # пользователей удаляются по TTL, общее число масок ограничено
+        self._seen: Dict[Tuple[int, str], _SeenSet] = BoundedStore(
+            self.name, ttl=config.user_state_ttl, max_entries=config.user_state_max_entries,
+            sizer=lambda seen: sys.getsizeof(seen) + sys.getsizeof(seen.bits)
+        )
+
+        # Счетчики для статистики
+        self.draws = 0
+        self.resets = 0
+        self.dropped = 0
+
+    def sample(self, user_id: Optional[int], pool_key: str, size: int, k: int) -> List[int]:
+        """
+        Выбирает k различных позиций из набора размера size
+
+        Args:
+            user_id: ID пользователя (None — без учета показанных)
+            pool_key: ключ набора вопросов (например, режим и тема)
+            size: количество вопросов в наборе
+            k: сколько позиций выбрать
+
+        Returns:
+            List[int]: позиции в случайном порядке (не больше size)
+        """
+        k = min(k, size)
+        if k <= 0:
+            return []
+        self.draws += 1
+        if user_id is None:
+            return random.sample(range(size), k)
+
+        key = (user_id, pool_key)
+        seen = self._seen.get(key)
+        if seen is None:
+            seen = _SeenSet(size)
+            self._seen[key] = seen
+        seen.grow(size)
+
+        picked = seen.draw(k)
+        if len(picked) < k:
+            # Пользователь видел весь набор — начинаем заново, без только что выданных вопросов
+            self.resets += 1
+            seen.clear()
+            for index in picked:
+                seen.add(index)
+            picked.extend(seen.draw(k - len(picked)))
+        return picked
+
+    def sample_weighted(self, user_id: Optional[int], pool_key: str, size: int, k: int,
+                        draw: Callable[[], int]) -> List[int]:
+        """
+        Выбирает до k различных позиций функцией draw (взвешенный выбор одной позиции),
+        пропуская уже показанные пользователю; если взвешенный выбор долго попадает
+        в показанные или повторные позиции, остаток добирается равновероятно
+        """
+        k = min(k, size)
+        if k <= 0:
+            return []
+        self.draws += 1
+        seen = None
+        if user_id is not None:
+            seen = self._seen.get((user_id, pool_key))
+            if seen is not None:
+                seen.grow(size)
+
+        picked: List[int] = []
+        chosen = set()
+        attempts = k * 20
+        while len(picked) < k and attempts > 0:
+            attempts -= 1
+            index = draw()
+            if index in chosen or (seen is not None and index in seen):
+                continue
+            chosen.add(index)
+            picked.append(index)
+
+        if user_id is None:
+            if len(picked) < k:
+                picked.extend(i for i in random.sample(range(size), min(size, k + len(picked)))
+                              if i not in chosen)
+            return picked[:k]
+
+        key = (user_id, pool_key)
+        if seen is None:
+            seen = _SeenSet(size)
+            self._seen[key] = seen
+        for index in picked:
+            seen.add(index)
+        if len(picked) < k:
+            self.draws -= 1
+            picked.extend(i for i in self.sample(user_id, pool_key, size, k - len(picked)) if i not in chosen)
+        return picked
+
+    def reset(self, user_id: int, pool_key: Optional[str] = None) -> None:
+        """Забывает показанные пользователю вопросы (набора или всех наборов)"""
+        for key in [key for key in self._seen if key[0] == user_id and pool_key in (None, key[1])]:
+            del self._seen[key]
+
+    def drop_pools(self, prefix: str) -> int:
+        """
+        Удаляет маски всех пользователей для наборов, ключ которых начинается с prefix
+        (позиции набора изменились, например после перезагрузки контента)
+
+        Returns:
+            int: количество удаленных масок
+        """
+        stale = [key for key in self._seen if key[1].startswith(prefix)]
+        for key in stale:
+            del self._seen[key]
+        self.dropped += len(stale)
+        return len(stale)
+
+    def sweep(self) -> int:
+        """Удаляет маски пользователей, не проходивших тесты дольше config.user_state_ttl"""
+        return self._seen.sweep()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику выборок"""
+        return {
+            "tracked": len(self._seen),
+            "memory": f"{self._seen.total_bytes / 1024:.1f} КБ",
+            "expired": self._seen.expired,
+            "evicted": self._seen.evicted,
+            "draws": self.draws,
+            "resets": self.resets,
+            "dropped": self.dropped
+        }
+
+
+# Создаем глобальный экземпляр выборки, общий для демо-версии и полной версии
+question_sampler = QuestionSampler()
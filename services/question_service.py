@@ -1,8 +1,13 @@
 import json
 import os
 import random
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
 from config import config
+from services.content_repository import content_repository, ContentSnapshot
+from services.content_store import SqliteQuestionStore
+from services.question_model import QuestionRecord, tag_vocabulary
+from services.question_sampler import question_sampler
+from services.weighted_sampler import WeaknessSampler, WeightingStrategy
 from utils.logger import logger
 
 class QuestionService:
@@ -11,18 +16,40 @@ class QuestionService:
         self.content_file = config.demo_content_file if use_demo_mode else config.content_file
         self.is_demo_mode = use_demo_mode
         
-        # Загружаем данные из единого файла контента
-        self.content_data = self._load_content()
+        # Выбор вопросов по слабым тегам пользователя; политику весов можно заменить (set_weighting_strategy)
+        self.weakness_sampler = WeaknessSampler()
+        
+        # Большой банк полной версии может храниться в скомпилированной базе (config.content_backend)
+        self.store: Optional[SqliteQuestionStore] = None
+        if not use_demo_mode and config.content_backend == "sqlite":
+            self.store = self._open_store()
+        if self.store is not None:
+            self._apply_store()
+            return
+        
+        # Данные берутся из общего репозитория контента и обновляются при изменении файла
+        snapshot = self._load_content()
+        self._apply_content(snapshot.data if snapshot is not None else {"themes": []})
+        if snapshot is not None:
+            content_repository.subscribe(snapshot.path, self._on_content_reloaded)
+    
+    def _apply_content(self, content_data: Dict[str, Any]) -> None:
+        """
+        Строит вопросы по темам и индексы из данных файла контента.
+        Все структуры создаются заново, поэтому вопросы, уже выданные
+        сессиям, не меняются при перезагрузке контента.
+        """
+        self.content_data = content_data
         
         # Проверяем формат данных и инициализируем соответственно
         # Новый формат: {"themes": {"theme_id": {"name": "Theme Name", "questions": []}}}
         # Старый формат: {"themes": [{"id": "theme_id", "name": "Theme Name", "questions": []}]}
         
-        # Инициализируем словарь вопросов по темам
-        self.questions_by_theme = {}
-        self.themes_info = {}  # Для хранения информации о темах (имя и т.д.)
+        self._reset_indexes()
         
         # Проверяем, есть ли 'themes' в данных
+        # Вопросы снимка материализуются в компактные записи (см. services/question_model.py);
+        # сам снимок контента общий для сервисов и не изменяется
         if "themes" in self.content_data:
             themes_data = self.content_data["themes"]
             
@@ -30,7 +57,7 @@ class QuestionService:
             if isinstance(themes_data, dict):
                 # Новый формат (словарь тем)
                 for theme_id, theme_data in themes_data.items():
-                    self.questions_by_theme[theme_id] = theme_data.get("questions", [])
+                    self.questions_by_theme[theme_id] = self._make_records(theme_data.get("questions", []))
                     self.themes_info[theme_id] = {
                         "name": theme_data.get("name", theme_id)
                     }
@@ -39,67 +66,386 @@ class QuestionService:
                 for theme in themes_data:
                     theme_id = theme.get("id", "")
                     if theme_id:
-                        self.questions_by_theme[theme_id] = theme.get("questions", [])
+                        self.questions_by_theme[theme_id] = self._make_records(theme.get("questions", []))
                         self.themes_info[theme_id] = {
                             "name": theme.get("name", theme_id)
                         }
         
+        for theme_id, questions in self.questions_by_theme.items():
+            for question in questions:
+                self._index_question(theme_id, question)
+        
+        # Дополнительные пакеты вопросов (собранные ИИ-вопросы, офлайн-генерация) — только для полной версии
+        if not self.is_demo_mode:
+            self._load_packs()
+        
         # Определяем тему по умолчанию и вопросы
         self.default_theme_id = next(iter(self.questions_by_theme.keys())) if self.questions_by_theme else ""
         self.questions = self.questions_by_theme.get(self.default_theme_id, [])
         
         # Логируем информацию о загруженных вопросах
-        mode_str = "demo" if use_demo_mode else "full version"
+        mode_str = "demo" if self.is_demo_mode else "full version"
         logger.info(f"Loaded {len(self.questions)} general questions for {mode_str}")
         for theme_id, questions in self.questions_by_theme.items():
             logger.info(f"Loaded {len(questions)} questions for theme '{theme_id}' ({mode_str})")
+            
+    @staticmethod
+    def _open_store() -> Optional[SqliteQuestionStore]:
+        """Открывает скомпилированную базу вопросов; если ее нет, используется JSON"""
+        if not os.path.exists(config.content_store_file):
+            logger.warning(f"Content store {config.content_store_file} not found, run build_content_store.py; "
+                           f"falling back to JSON content")
+            return None
+        try:
+            return SqliteQuestionStore(config.content_store_file, config.content_store_cache_size)
+        except Exception as e:
+            logger.error(f"Error opening content store {config.content_store_file}: {str(e)}")
+            return None
+            
+    def _reset_indexes(self) -> None:
+        # Инициализируем словарь вопросов по темам
+        self.questions_by_theme = {}
+        self.themes_info = {}  # Для хранения информации о темах (имя и т.д.)
+        
+        # Записи вопросов в памяти; uid записи = self._uid_base + позиция в списке
+        # (при работе с базой uid вопросов базы — их rowid, поэтому записи в памяти идут после них)
+        self.records: List[QuestionRecord] = []
+        self._uid_base = 0
+        
+        # Индексы, которые строятся при загрузке и дополняются в add_questions:
+        # ID вопроса -> uid, ID тега -> uid вопросов, тема -> uid вопросов (в порядке добавления)
+        self.question_index: Dict[Any, int] = {}
+        self.tag_index: Dict[int, Set[int]] = {}
+        self.theme_index: Dict[str, List[int]] = {}
+        # Тема -> ID тега -> позиции вопросов темы (строится при первой взвешенной выборке)
+        self._theme_tag_positions: Dict[str, Dict[int, List[int]]] = {}
+        
+    def _make_records(self, questions: Iterable[Dict[str, Any]], free_tags: bool = False) -> List[QuestionRecord]:
+        """Материализует вопросы в записи с очередными uid (free_tags — теги не из контента, см. TagVocabulary)"""
+        records = []
+        for question in questions:
+            if not isinstance(question, QuestionRecord):
+                question = QuestionRecord.from_dict(self._uid_base + len(self.records), question, free_tags)
+            self.records.append(question)
+            records.append(question)
+        return records
+        
+    def _record(self, uid: int) -> QuestionRecord:
+        return self.records[uid - self._uid_base]
+        
+    def _apply_store(self) -> None:
+        """
+        Инициализирует сервис поверх скомпилированной базы. В памяти (questions_by_theme
+        и индексы) остаются только вопросы, собранные после компиляции базы
+        """
+        self.content_data = {}
+        self._reset_indexes()
+        self._uid_base = self.store.max_uid + 1
+        for theme_id, name in self.store.themes:
+            self.themes_info[theme_id] = {"name": name}
+        self.default_theme_id = self.store.themes[0][0] if self.store.themes else ""
+        self.questions = []
+        
+        # Собранные ИИ-вопросы дописываются в пакет во время работы — берем те, которых еще нет в базе
+        harvested_file = config.harvested_questions_file
+        if harvested_file and os.path.exists(harvested_file):
+            self._load_pack_file(harvested_file, skip_stored=True)
+        logger.info(f"Using content store for full version: {len(self.themes_info)} themes, "
+                    f"{len(self.question_index)} questions harvested after build")
+        
+    def _on_content_reloaded(self, snapshot: ContentSnapshot) -> None:
+        """Применяет новый снимок файла контента"""
+        self._apply_content(snapshot.data)
+        # Позиции вопросов в темах построены заново: показанные пользователям позиции
+        # указывали бы на другие вопросы
+        dropped = question_sampler.drop_pools(self._pool_key(""))
+        if dropped:
+            logger.info(f"Dropped {dropped} seen-question sets after content reload")
     
-    def _load_content(self) -> Dict[str, Any]:
+    def _load_content(self) -> Optional[ContentSnapshot]:
         """
-        Загружает данные из файла контента (демо или полная версия)
+        Возвращает снимок файла контента (демо или полная версия)
         """
-        try:
-            if os.path.exists(self.content_file):
-                with open(self.content_file, 'r', encoding='utf-8') as file:
-                    data = json.load(file)
-                return data
-            else:
-                mode_str = "demo" if self.is_demo_mode else "full version"
-                logger.warning(f"{mode_str.capitalize()} content file not found: {self.content_file}")
-                
-                # Если демо-файл не найден, попробуем использовать полную версию как запасной вариант
-                if self.is_demo_mode and os.path.exists(config.content_file):
-                    logger.warning(f"Falling back to full version content file: {config.content_file}")
-                    with open(config.content_file, 'r', encoding='utf-8') as file:
-                        data = json.load(file)
-                    return data
+        snapshot = content_repository.get(self.content_file)
+        if snapshot is not None:
+            return snapshot
+            
+        mode_str = "demo" if self.is_demo_mode else "full version"
+        logger.warning(f"{mode_str.capitalize()} content file not found or invalid: {self.content_file}")
+        
+        # Если демо-файл не найден, попробуем использовать полную версию как запасной вариант
+        if self.is_demo_mode:
+            logger.warning(f"Falling back to full version content file: {config.content_file}")
+            return content_repository.get(config.content_file)
+        return None
+
+    def _load_packs(self) -> None:
+        """
+        Загружает пакеты вопросов из config.question_packs_dir (файлы *.jsonl,
+        по одному вопросу в строке с полем "theme") и добавляет их к темам
+        """
+        packs_dir = config.question_packs_dir
+        if not packs_dir or not os.path.isdir(packs_dir):
+            return
+            
+        for file_name in sorted(os.listdir(packs_dir)):
+            if file_name.endswith(".jsonl"):
+                self._load_pack_file(os.path.join(packs_dir, file_name))
                 
-                return {"themes": []}
+    def _load_pack_file(self, path: str, skip_stored: bool = False) -> None:
+        """
+        Загружает один пакет вопросов
+        
+        Args:
+            path: путь к файлу *.jsonl
+            skip_stored: пропускать вопросы, уже скомпилированные в базу
+        """
+        loaded = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                for line_number, line in enumerate(file, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        question = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping malformed line {line_number} in pack {path}")
+                        continue
+                    if skip_stored and self.store is not None and self.store.contains(question.get("id")):
+                        continue
+                    theme_id = question.get("theme") or self.default_pack_theme()
+                    if theme_id:
+                        self.add_questions(theme_id, [question])
+                        loaded += 1
         except Exception as e:
-            logger.error(f"Error loading content from {self.content_file}: {str(e)}")
-            return {"themes": []}
+            logger.error(f"Error loading question pack {path}: {str(e)}")
+            return
+        logger.info(f"Loaded {loaded} questions from pack {path}")
+            
+    def default_pack_theme(self) -> str:
+        """Тема для вопросов пакета без поля theme — первая тема контента"""
+        return next(iter(self.themes_info.keys()), "")
+        
+    def add_questions(self, theme_id: str, questions: List[Dict[str, Any]]) -> List[QuestionRecord]:
+        """
+        Добавляет вопросы к теме (например, собранные из ответов ИИ)
+        
+        Returns:
+            List[QuestionRecord]: записи добавленных вопросов
+        """
+        if theme_id not in self.questions_by_theme:
+            self.questions_by_theme[theme_id] = []
+            self.themes_info[theme_id] = {"name": theme_id}
+        theme_questions = self.questions_by_theme[theme_id]
+        start = len(theme_questions)
+        questions = self._make_records(questions, free_tags=True)
+        theme_questions.extend(questions)
+        for question in questions:
+            self._index_question(theme_id, question)
+            
+        # Позиции тегов темы дополняются, а не строятся заново
+        tag_positions = self._theme_tag_positions.get(theme_id)
+        if tag_positions is not None:
+            offset = len(self.store.theme_ids(theme_id)) if self.store is not None else 0
+            for position, question in enumerate(questions, offset + start):
+                for tag_id in question.tag_ids:
+                    tag_positions.setdefault(tag_id, []).append(position)
+        return questions
+            
+    def _index_question(self, theme_id: str, question: QuestionRecord) -> None:
+        """Добавляет вопрос в индексы по ID, тегам и теме"""
+        question_id = question.id
+        if question_id is None:
+            return
+        if question_id in self.question_index:
+            # ID должны быть уникальны во всем банке; первый вопрос с таким ID остается в индексе
+            logger.warning(f"Duplicate question id {question_id} in theme '{theme_id}', skipping in index")
+            return
+        self.question_index[question_id] = question.uid
+        self.theme_index.setdefault(theme_id, []).append(question.uid)
+        for tag_id in question.tag_ids:
+            self.tag_index.setdefault(tag_id, set()).add(question.uid)
+
+    def iter_questions(self, source_type: Optional[str] = None,
+                       include_store: bool = True) -> Iterator[Tuple[str, QuestionRecord]]:
+        """
+        Все вопросы банка (тема, вопрос), включая скомпилированную базу
+
+        Args:
+            source_type: только вопросы с таким source.type (например, "ai")
+            include_store: False — только вопросы в памяти (добавленные после компиляции базы)
+        """
+        if self.store is not None and include_store:
+            yield from self.store.iter_questions(source_type)
+        # Снимок списков: вопросы могут добавляться, пока обход идет в другом потоке
+        for theme_id, questions in list(self.questions_by_theme.items()):
+            for question in list(questions):
+                if source_type is None or (question.get("source") or {}).get("type") == source_type:
+                    yield theme_id, question
 
     def get_all_questions(self) -> List[Dict[str, Any]]:
+        if self.store is not None:
+            return self.store.get_many(self.store.theme_ids(self.default_theme_id))
         return self.questions
         
-    def get_questions_by_theme(self, theme_key: str, count: int = 5) -> List[Dict[str, Any]]:
+    def get_questions_by_theme(self, theme_key: str, count: int = 5,
+                               user_id: Optional[int] = None) -> List[Dict[str, Any]]:
         """
-        Возвращает указанное количество случайных вопросов по заданной теме
+        Возвращает указанное количество случайных вопросов по заданной теме.
+        Если передан user_id, вопросы, которые пользователь уже видел, не повторяются,
+        пока в теме есть непоказанные (см. services/question_sampler.py)
         """
-        if theme_key in self.questions_by_theme and self.questions_by_theme[theme_key]:
-            questions = self.questions_by_theme[theme_key].copy()
-            random.shuffle(questions)
-            return questions[:count]
-        else:
+        # Выбираются позиции среди вопросов темы (в базе — ID базы и вопросы,
+        # собранные после компиляции); копировать и перемешивать тему не нужно
+        total = self._theme_size(theme_key)
+        if not total:
             # Если вопросов по теме нет, возвращаем общие вопросы
             logger.warning(f"No questions found for theme {theme_key}, using general questions")
             return self.get_all_questions()[:count]
+            
+        positions = question_sampler.sample(user_id, self._pool_key(theme_key), total, count)
+        return self._questions_at(theme_key, positions)
+        
+    def _pool_key(self, theme_key: str) -> str:
+        return f"{'demo' if self.is_demo_mode else 'full'}:{theme_key}"
+        
+    def _theme_size(self, theme_key: str) -> int:
+        stored = len(self.store.theme_ids(theme_key)) if self.store is not None else 0
+        return stored + len(self.questions_by_theme.get(theme_key, []))
+        
+    def _questions_at(self, theme_key: str, positions: List[int]) -> List[Dict[str, Any]]:
+        """Вопросы темы по позициям (сначала ID базы, затем вопросы в памяти)"""
+        stored_ids = self.store.theme_ids(theme_key) if self.store is not None else []
+        extra = self.questions_by_theme.get(theme_key, [])
+        stored = {}
+        if stored_ids:
+            stored = {q.get("id"): q for q in self.store.get_many(
+                [stored_ids[i] for i in positions if i < len(stored_ids)]
+            )}
+        questions = []
+        for i in positions:
+            if i < len(stored_ids):
+                question = stored.get(stored_ids[i])
+                if question is not None:
+                    questions.append(question)
+            else:
+                questions.append(extra[i - len(stored_ids)])
+        return questions
+        
+    def _tag_positions(self, theme_key: str) -> Dict[int, List[int]]:
+        """ID тега -> позиции вопросов темы с этим тегом (строится один раз на тему)"""
+        tag_positions = self._theme_tag_positions.get(theme_key)
+        if tag_positions is not None:
+            return tag_positions
+            
+        tag_positions = {}
+        offset = 0
+        if self.store is not None:
+            stored_ids = self.store.theme_ids(theme_key)
+            position_by_id = {question_id: i for i, question_id in enumerate(stored_ids)}
+            for tag, question_id in self.store.theme_tags(theme_key):
+                tag_positions.setdefault(tag_vocabulary.intern(tag), []).append(position_by_id[question_id])
+            offset = len(stored_ids)
+        for position, question in enumerate(self.questions_by_theme.get(theme_key, []), offset):
+            for tag_id in question.tag_ids:
+                tag_positions.setdefault(tag_id, []).append(position)
+        self._theme_tag_positions[theme_key] = tag_positions
+        return tag_positions
+        
+    def set_weighting_strategy(self, strategy: WeightingStrategy) -> None:
+        """Заменяет политику весов выбора вопросов по слабым тегам"""
+        self.weakness_sampler = WeaknessSampler(strategy)
+        
+    def get_weighted_questions(self, theme_key: str, count: int, tag_errors: Dict[int, int],
+                               user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает count вопросов темы, выбранных с вероятностью, растущей с количеством
+        ошибок пользователя в тегах вопроса (см. services/weighted_sampler.py).
+        Без ошибок в тегах темы выбор равновероятный, как в get_questions_by_theme
+        
+        Args:
+            theme_key: ключ темы
+            count: количество вопросов
+            tag_errors: ID тега (tag_vocabulary) -> количество ошибок пользователя
+            user_id: ID пользователя (показанные вопросы не повторяются)
+        """
+        size = self._theme_size(theme_key)
+        draw = None
+        if tag_errors and size:
+            draw = self.weakness_sampler.drawer(
+                user_id, self._pool_key(theme_key), size, self._tag_positions(theme_key), tag_errors
+            )
+        if draw is None:
+            return self.get_questions_by_theme(theme_key, count, user_id=user_id)
+        positions = question_sampler.sample_weighted(user_id, self._pool_key(theme_key), size, count, draw)
+        return self._questions_at(theme_key, positions)
 
-    def get_question_by_id(self, question_id: int) -> Dict[str, Any]:
-        for question in self.questions:
-            if question['id'] == question_id:
-                return question
-        return {}
+    def get_question_by_id(self, question_id: Any) -> Dict[str, Any]:
+        uid = self.question_index.get(question_id)
+        if uid is not None:
+            return self._record(uid)
+        question = self.store.get(question_id) if self.store is not None else None
+        return question or {}
+        
+    def _uids_by_tags(self, tag_ids: Set[int], match_all: bool, theme_key: Optional[str]) -> Set[int]:
+        """uid вопросов в памяти с любым (или со всеми) из тегов"""
+        uid_sets = [self.tag_index.get(tag_id, set()) for tag_id in tag_ids]
+        if not uid_sets:
+            return set()
+        if match_all:
+            # Пересекаем, начиная с самого редкого тега
+            uid_sets.sort(key=len)
+            uids = set(uid_sets[0])
+            for uid_set in uid_sets[1:]:
+                uids &= uid_set
+                if not uids:
+                    break
+        else:
+            uids = set().union(*uid_sets)
+        if theme_key is not None:
+            uids &= set(self.theme_index.get(theme_key, []))
+        return uids
+        
+    def get_question_ids_by_tags(self, tags: Iterable[str], match_all: bool = False,
+                                 theme_key: Optional[str] = None) -> Set[Any]:
+        """
+        Возвращает ID вопросов с заданными тегами
+        
+        Args:
+            tags: теги для поиска
+            match_all: True — у вопроса должны быть все теги, False — хотя бы один
+            theme_key: ограничить поиск темой (None — все темы)
+        """
+        tags = set(tags)
+        tag_ids = {tag_vocabulary.lookup(tag) for tag in tags}
+        if None in tag_ids:
+            # Тега нет ни у одного вопроса в памяти
+            if match_all:
+                tag_ids = set()
+            tag_ids.discard(None)
+        ids = {self._record(uid).id for uid in self._uids_by_tags(tag_ids, match_all, theme_key)}
+        if self.store is not None:
+            ids |= self.store.ids_by_tags(tags, match_all, theme_key)
+        return ids
+        
+    def get_questions_by_tags(self, tags: Iterable[str], count: int = 5, match_all: bool = False,
+                              theme_key: Optional[str] = None,
+                              exclude_ids: Optional[Set[Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает до count случайных вопросов с заданными тегами
+        (например, вопросы по слабым темам пользователя)
+        """
+        ids = self.get_question_ids_by_tags(tags, match_all, theme_key)
+        if exclude_ids:
+            ids -= exclude_ids
+        selected = random.sample(list(ids), min(count, len(ids)))
+        questions = [self._record(self.question_index[question_id]) for question_id in selected
+                     if question_id in self.question_index]
+        if self.store is not None:
+            questions.extend(self.store.get_many([question_id for question_id in selected
+                                                  if question_id not in self.question_index]))
+        return questions
 
     def get_tags_from_questions(self, question_ids: List[int]) -> List[str]:
         tags = set()
@@ -0,0 +1,156 @@
+"""
+MinHash-сигнатуры вопросов банка для отсева дубликатов.
+
+Сигнатура вопроса (utils/text_similarity.py) считается на чистом Python
+несколько миллисекунд, поэтому для большого банка ее нельзя пересчитывать
+при каждом запуске. SignatureCache хранит сигнатуры в SQLite по хешу
+текста вопроса (вопрос вместе с вариантами ответа): при запуске
+считаются только сигнатуры новых и измененных вопросов.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from utils.logger import logger
+from utils.text_similarity import MinHasher, shingles
+
+
+def question_text(question: Dict[str, Any]) -> str:
+    """Текст для сравнения: вопрос вместе с вариантами ответа"""
+    return " ".join([str(question.get("question", ""))] + [str(o) for o in question.get("options", [])])
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class SignatureCache:
+    """
+    Сигнатуры по хешу текста в SQLite (None вместо пути — только в памяти).
+    Используется и из потока построения индекса, и из цикла событий
+    """
+
+    def __init__(self, path: Optional[str], hasher: MinHasher):
+        self.path = path
+        self.hasher = hasher
+        self._lock = threading.Lock()
+        self._memory: Dict[str, List[int]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+
+        # Счетчики для статистики
+        self.computed = 0
+        self.reused = 0
+
+        if path:
+            try:
+                self._open(path)
+            except Exception as e:
+                logger.error(f"Error opening signature cache {path}: {str(e)}")
+                self._conn = None
+
+    def _open(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS signatures (digest TEXT PRIMARY KEY, signature BLOB NOT NULL)")
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is None or row[0] != self.hasher.params:
+            # Сигнатуры с другими параметрами MinHash несравнимы с новыми
+            with self._conn:
+                self._conn.execute("DELETE FROM signatures")
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)",
+                                   (self.hasher.params,))
+        self._conn.commit()
+
+    def get_many(self, digests: List[str]) -> Dict[str, List[int]]:
+        """Сохраненные сигнатуры для переданных хешей текста"""
+        if self._conn is None:
+            return {digest: self._memory[digest] for digest in digests if digest in self._memory}
+        found = {}
+        with self._lock:
+            for start in range(0, len(digests), 500):
+                chunk = digests[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for digest, data in self._conn.execute(
+                    f"SELECT digest, signature FROM signatures WHERE digest IN ({placeholders})", chunk
+                ):
+                    found[digest] = MinHasher.from_bytes(data)
+        return found
+
+    def put_many(self, items: List[Tuple[str, List[int]]]) -> None:
+        if not items:
+            return
+        if self._conn is None:
+            self._memory.update(items)
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO signatures (digest, signature) VALUES (?, ?)",
+                    [(digest, MinHasher.to_bytes(sig)) for digest, sig in items]
+                )
+        except Exception as e:
+            logger.error(f"Error saving question signatures: {str(e)}")
+
+    def signatures(self, questions: List[Dict[str, Any]]) -> List[List[int]]:
+        """Сигнатуры вопросов: сохраненные берутся из кэша, недостающие считаются и сохраняются"""
+        digests = [text_digest(question_text(question)) for question in questions]
+        found = self.get_many(list(set(digests)))
+        computed = []
+        result = []
+        for question, digest in zip(questions, digests):
+            sig = found.get(digest)
+            if sig is None:
+                sig = self.hasher.signature(shingles(question_text(question)))
+                found[digest] = sig
+                computed.append((digest, sig))
+            result.append(sig)
+        self.put_many(computed)
+        self.computed += len(computed)
+        self.reused += len(questions) - len(computed)
+        return result
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def iter_question_signatures(question_service, cache: SignatureCache,
+                             chunk_size: int = 1000) -> Iterator[Tuple[str, Any, List[int]]]:
+    """
+    Все вопросы банка с сигнатурами: (тема, ID вопроса, сигнатура).
+
+    Если скомпилированная база хранит сигнатуры с теми же параметрами MinHash,
+    вопросы базы не разбираются — берутся ее готовые сигнатуры; для остальных
+    вопросов сигнатуры берутся из кэша (недостающие считаются)
+    """
+    store = getattr(question_service, "store", None)
+    if store is not None and store.signature_params == cache.hasher.params:
+        yield from store.iter_signatures()
+        questions = question_service.iter_questions(include_store=False)
+    else:
+        if store is not None:
+            logger.warning("Content store has no compatible question signatures, "
+                           "rebuild it with build_content_store.py")
+        questions = question_service.iter_questions()
+
+    chunk: List[Tuple[str, Dict[str, Any]]] = []
+    for item in questions:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield from _with_signatures(chunk, cache)
+            chunk = []
+    if chunk:
+        yield from _with_signatures(chunk, cache)
+
+
+def _with_signatures(chunk: List[Tuple[str, Dict[str, Any]]],
+                     cache: SignatureCache) -> Iterator[Tuple[str, Any, List[int]]]:
+    sigs = cache.signatures([question for _, question in chunk])
+    for (theme_id, question), sig in zip(chunk, sigs):
+        yield theme_id, question.get("id"), sig
@@ -0,0 +1,122 @@
+"""
+Общий движок сессии теста для демо-версии и полной версии.
+
+Сессия — небольшой объект со __slots__: список вопросов (ссылки на общие
+неизменяемые записи банка или сгенерированные ИИ вопросы, без копий),
+номер текущего вопроса и ответы, упакованные по одному байту на ответ:
+    (номер выбранного варианта << 1) | правильно
+Счетчики ошибок по ID тегов обновляются при каждом ответе, поэтому
+результаты теста собираются за O(тегов), без повторного просмотра ответов.
+
+Для хранения вне процесса (services/session_store.py) сессия разделяется
+на вопросы (encode_questions, меняются редко) и небольшое состояние
+(to_state: позиция, ответы, ошибки по названиям тегов — ID тегов у
+каждого процесса свои).
+"""
+import json
+import sys
+from typing import Dict, List, Any, Optional, Tuple
+from services.question_model import QuestionRecord, question_tag_ids, tag_vocabulary
+
+# Номер варианта должен помещаться в 7 бит упакованного ответа
+MAX_OPTION_INDEX = 127
+
+
+class QuizSession:
+    """Сессия теста: вопросы, текущая позиция, упакованные ответы и ошибки по тегам"""
+    __slots__ = ("questions", "current", "answers", "correct_count", "tag_errors")
+
+    def __init__(self, questions: Optional[List[Dict[str, Any]]] = None):
+        self.questions: List[Dict[str, Any]] = questions if questions is not None else []
+        self.current = 0
+        self.answers = bytearray()
+        self.correct_count = 0
+        # ID тега (tag_vocabulary) -> количество ошибок в сессии
+        self.tag_errors: Dict[int, int] = {}
+
+    def current_question(self) -> Optional[Dict[str, Any]]:
+        """Текущий вопрос или None, если вопросы закончились"""
+        if self.current >= len(self.questions):
+            return None
+        return self.questions[self.current]
+
+    def answer(self, user_answer: int, totals: Optional[Dict[int, int]] = None) -> bool:
+        """
+        Записывает ответ на текущий вопрос и переходит к следующему
+
+        Args:
+            user_answer: номер выбранного варианта
+            totals: накопленные ошибки пользователя по ID тегов, которые нужно
+                увеличить вместе с ошибками сессии (например, за все тесты)
+
+        Returns:
+            True, если ответ правильный
+        """
+        question = self.questions[self.current]
+        is_correct = question["correct_answer"] == user_answer
+        self.answers.append((min(max(user_answer, 0), MAX_OPTION_INDEX) << 1) | is_correct)
+        if is_correct:
+            self.correct_count += 1
+        else:
+            for tag_id in question_tag_ids(question):
+                self.tag_errors[tag_id] = self.tag_errors.get(tag_id, 0) + 1
+                if totals is not None:
+                    totals[tag_id] = totals.get(tag_id, 0) + 1
+        self.current += 1
+        return is_correct
+
+    def answer_at(self, index: int) -> Tuple[int, bool]:
+        """Ответ номер index: (выбранный вариант, правильно ли)"""
+        packed = self.answers[index]
+        return packed >> 1, bool(packed & 1)
+
+    @property
+    def answered(self) -> int:
+        return len(self.answers)
+
+    def memory_size(self) -> int:
+        """Примерный размер сессии в байтах (без общих записей вопросов)"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.questions)
+                + sys.getsizeof(self.answers) + sys.getsizeof(self.tag_errors))
+
+    def to_state(self) -> Dict[str, Any]:
+        """Состояние сессии без вопросов (для services/session_store.py)"""
+        return {
+            "current": self.current,
+            "answers": self.answers.hex(),
+            "correct_count": self.correct_count,
+            "tag_errors": {tag_vocabulary.name(tag_id): count for tag_id, count in self.tag_errors.items()}
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        """Восстанавливает состояние, сохраненное to_state"""
+        self.current = state.get("current", 0)
+        self.answers = bytearray.fromhex(state.get("answers", ""))
+        self.correct_count = state.get("correct_count", 0)
+        self.tag_errors = {}
+        for tag, count in state.get("tag_errors", {}).items():
+            tag_id = tag_vocabulary.intern_free(tag)
+            self.tag_errors[tag_id] = self.tag_errors.get(tag_id, 0) + count
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], questions: List[Dict[str, Any]]) -> "QuizSession":
+        """Создает сессию из сохраненных вопросов и состояния"""
+        session = cls.__new__(cls)
+        QuizSession.__init__(session, questions)
+        session.restore_state(state)
+        return session
+
+    def failed_tags(self) -> List[Tuple[str, int]]:
+        """Теги с ошибками по убыванию количества ошибок: [(название, количество)]"""
+        return [(tag_vocabulary.name(tag_id), count) for tag_id, count in
+                sorted(self.tag_errors.items(), key=lambda x: x[1], reverse=True)]
+
+
+def encode_questions(questions: List[Dict[str, Any]]) -> str:
+    """Вопросы сессии в JSON (записи банка сохраняются целиком, а не по ID: банк может измениться)"""
+    return json.dumps([q.to_dict() if isinstance(q, QuestionRecord) else dict(q) for q in questions],
+                      ensure_ascii=False)
+
+
+def decode_questions(data: str) -> List[Dict[str, Any]]:
+    return json.loads(data) if data else []
@@ -0,0 +1,444 @@
+"""
+Хранилище сессий тестов, переживающее перезапуск бота.
+
+SessionStore — словарь ID пользователя -> сессия (QuizSession или ее
+подкласс), которым пользуются TestService и FullVersionHandler. Активные
+сессии держатся в памяти (BoundedStore с TTL и LRU), а их копия — во
+внешнем хранилище (SessionBackend):
+- MemorySessionBackend — без сохранения: сессии живут только в памяти
+  SessionStore и теряются при перезапуске и вытеснении;
+- SqliteSessionBackend — SQLite в режиме WAL;
+- RedisSessionBackend — Redis-подобный сервер (hset/hgetall/expire/delete);
+  FakeRedis выполняет этот контракт в памяти для тестов и локального запуска.
+
+Сессия хранится двумя полями: вопросы (записываются при их изменении) и
+небольшое состояние (позиция, ответы, ошибки по тегам). Записи
+объединяются: обращение к сессии только помечает ее, а flush() раз в
+config.session_flush_interval записывает пакетом состояние помеченных
+сессий, если оно изменилось. Поэтому ответ на вопрос стоит не больше
+одной небольшой записи.
+
+Несколько процессов бота могут работать с одним хранилищем, если
+обновления одного пользователя попадают в один процесс: сессия,
+загруженная в память, повторно из хранилища не читается.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections.abc import MutableMapping
+from typing import Dict, List, Any, Callable, Hashable, Iterator, Optional, Set, Tuple, Type
+from config import config
+from services.quiz_session import QuizSession, encode_questions, decode_questions
+from utils.bounded_store import BoundedStore
+from utils.logger import logger
+
+# Поля сохраненной сессии
+SESSION_FIELDS = ("questions", "state")
+
+
+class SessionBackend:
+    """
+    Контракт внешнего хранилища: по ключу хранится набор строковых полей
+    """
+    name = "memory"
+    # False — хранилище ничего не сохраняет, SessionStore не тратит время на запись
+    durable = True
+
+    def load(self, key: str) -> Optional[Dict[str, str]]:
+        """Поля сессии или None"""
+        raise NotImplementedError
+
+    def save_many(self, items: List[Tuple[str, Dict[str, str]]]) -> None:
+        """Записывает пакет изменений; передаются только изменившиеся поля"""
+        raise NotImplementedError
+
+    def delete_many(self, keys: List[str]) -> None:
+        raise NotImplementedError
+
+    def purge(self, older_than: float) -> int:
+        """Удаляет сессии, не обновлявшиеся с момента older_than (time.time()); возвращает их количество"""
+        return 0
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    Хранилище без сохранения: сессии есть только в памяти SessionStore.
+    Копии сессий не держатся, иначе вытесненные сессии копились бы в обход
+    ограничений SessionStore по количеству и памяти
+    """
+    name = "memory"
+    durable = False
+
+    def load(self, key: str) -> Optional[Dict[str, str]]:
+        return None
+
+    def save_many(self, items: List[Tuple[str, Dict[str, str]]]) -> None:
+        pass
+
+    def delete_many(self, keys: List[str]) -> None:
+        pass
+
+
+class SqliteSessionBackend(SessionBackend):
+    """Сессии в SQLite (WAL: чтение не блокируется записью, запись — одна транзакция на пакет)"""
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, questions TEXT, state TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at)")
+        self._conn.commit()
+
+    def load(self, key: str) -> Optional[Dict[str, str]]:
+        row = self._conn.execute("SELECT questions, state FROM sessions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {name: value for name, value in zip(SESSION_FIELDS, row) if value is not None}
+
+    def save_many(self, items: List[Tuple[str, Dict[str, str]]]) -> None:
+        now = time.time()
+        with self._conn:
+            for key, fields in items:
+                # Обновляются только переданные поля: ответ на вопрос не перезаписывает вопросы
+                names = [name for name in SESSION_FIELDS if name in fields]
+                values = [fields[name] for name in names]
+                updates = "".join(f", {name} = excluded.{name}" for name in names)
+                self._conn.execute(
+                    f"INSERT INTO sessions (key, {', '.join(names + ['updated_at'])}) "
+                    f"VALUES (?, {', '.join('?' * (len(names) + 1))}) "
+                    f"ON CONFLICT(key) DO UPDATE SET updated_at = excluded.updated_at{updates}",
+                    [key] + values + [now]
+                )
+
+    def delete_many(self, keys: List[str]) -> None:
+        with self._conn:
+            self._conn.executemany("DELETE FROM sessions WHERE key = ?", [(key,) for key in keys])
+
+    def purge(self, older_than: float) -> int:
+        with self._conn:
+            return self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (older_than,)).rowcount
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class RedisSessionBackend(SessionBackend):
+    """
+    Сессии в Redis-подобном хранилище: сессия — хэш с полями, устаревание — через expire.
+    Клиенту достаточно методов hgetall, hset(name, mapping=...), expire и delete
+    (как у redis.Redis или FakeRedis)
+    """
+    name = "redis"
+
+    def __init__(self, client: Any, prefix: str = "quizbot:session:", ttl: Optional[float] = None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = int(ttl) if ttl else None
+
+    def load(self, key: str) -> Optional[Dict[str, str]]:
+        fields = self.client.hgetall(self.prefix + key)
+        if not fields:
+            return None
+        return {(name.decode() if isinstance(name, bytes) else name):
+                (value.decode() if isinstance(value, bytes) else value) for name, value in fields.items()}
+
+    def save_many(self, items: List[Tuple[str, Dict[str, str]]]) -> None:
+        for key, fields in items:
+            self.client.hset(self.prefix + key, mapping=fields)
+            if self.ttl:
+                self.client.expire(self.prefix + key, self.ttl)
+
+    def delete_many(self, keys: List[str]) -> None:
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+
+class FakeRedis:
+    """Минимальная замена клиента Redis в памяти (hset, hgetall, expire, delete)"""
+
+    def __init__(self):
+        self._hashes: Dict[str, Dict[str, str]] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _alive(self, name: str) -> bool:
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.time():
+            self._hashes.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._hashes
+
+    def hset(self, name: str, key: Optional[str] = None, value: Optional[str] = None,
+             mapping: Optional[Dict[str, str]] = None) -> int:
+        self._alive(name)
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        target = self._hashes.setdefault(name, {})
+        added = len(set(fields) - set(target))
+        target.update(fields)
+        return added
+
+    def hgetall(self, name: str) -> Dict[str, str]:
+        return dict(self._hashes[name]) if self._alive(name) else {}
+
+    def expire(self, name: str, seconds: int) -> bool:
+        if not self._alive(name):
+            return False
+        self._expires[name] = time.time() + seconds
+        return True
+
+    def delete(self, *names: str) -> int:
+        removed = 0
+        for name in names:
+            if self._alive(name):
+                removed += 1
+            self._hashes.pop(name, None)
+            self._expires.pop(name, None)
+        return removed
+
+
+def create_session_backend(kind: Optional[str] = None) -> SessionBackend:
+    """Создает внешнее хранилище сессий по config.session_backend"""
+    kind = kind or config.session_backend
+    if kind == "sqlite":
+        try:
+            return SqliteSessionBackend(config.session_db_file)
+        except Exception as e:
+            logger.error(f"Error opening session database {config.session_db_file}: {str(e)}")
+    elif kind == "redis":
+        try:
+            import redis
+            return RedisSessionBackend(redis.Redis.from_url(config.session_redis_url), ttl=config.session_ttl)
+        except Exception as e:
+            logger.error(f"Error connecting to Redis session backend: {str(e)}")
+    elif kind != "memory":
+        logger.error(f"Unknown session backend '{kind}'")
+    if kind != "memory":
+        logger.warning("Falling back to in-memory session backend: sessions will not survive a restart")
+    return MemorySessionBackend()
+
+
+class SessionStore(MutableMapping):
+    """
+    Сессии пользователей: в памяти с TTL и LRU, копия — во внешнем хранилище
+    """
+
+    def __init__(self, name: str, namespace: str, session_class: Type[QuizSession], backend: SessionBackend,
+                 ttl: Optional[float] = None, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 on_evict: Optional[Callable[[Hashable, QuizSession], None]] = None,
+                 on_load: Optional[Callable[[Hashable, QuizSession], None]] = None):
+        """
+        Args:
+            name: название для журнала и статистики
+            namespace: префикс ключей во внешнем хранилище (например, "demo" или "full")
+            session_class: класс сессии (from_state восстанавливает сессию из хранилища)
+            backend: внешнее хранилище
+            ttl, max_entries, max_bytes: ограничения сессий в памяти (см. BoundedStore)
+            on_evict: вызывается для сессии, вытесненной из памяти
+            on_load: вызывается для сессии, восстановленной из внешнего хранилища
+        """
+        self.name = name
+        self.namespace = namespace
+        self.session_class = session_class
+        self.backend = backend
+        self.ttl = ttl or None
+        self.on_evict = on_evict
+        self.on_load = on_load
+        self._cache = BoundedStore(name, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes,
+                                   sizer=session_class.memory_size, on_evict=self._evicted)
+        # Сессии, к которым обращались после последней записи
+        self._dirty: Set[Hashable] = set()
+        self._deleted: Set[Hashable] = set()
+        # Что уже записано: (список вопросов, его длина, состояние в JSON)
+        self._written: Dict[Hashable, Tuple[int, int, str]] = {}
+
+        # Счетчики для статистики
+        self.loads = 0
+        self.writes = 0
+        self.question_writes = 0
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _load(self, key: Hashable) -> Optional[QuizSession]:
+        """Загружает сессию из внешнего хранилища в память"""
+        if key in self._deleted or not self.backend.durable:
+            # Удаление еще не записано во внешнее хранилище
+            return None
+        try:
+            fields = self.backend.load(self._key(key))
+        except Exception as e:
+            logger.error(f"Error loading session {self._key(key)}: {str(e)}")
+            return None
+        if not fields or "state" not in fields:
+            return None
+        try:
+            session = self.session_class.from_state(json.loads(fields["state"]),
+                                                    decode_questions(fields.get("questions", "")))
+        except Exception as e:
+            logger.error(f"Error restoring session {self._key(key)}: {str(e)}")
+            return None
+        self.loads += 1
+        self._written[key] = (id(session.questions), len(session.questions), fields["state"])
+        self._cache[key] = session
+        if self.on_load is not None:
+            self.on_load(key, session)
+        return session
+
+    def __getitem__(self, key: Hashable) -> QuizSession:
+        if key in self._cache:
+            session = self._cache[key]
+        else:
+            session = self._load(key)
+            if session is None:
+                raise KeyError(key)
+        # Сессию могут изменить после обращения — ее состояние проверяется при записи
+        self._dirty.add(key)
+        return session
+
+    def __setitem__(self, key: Hashable, session: QuizSession) -> None:
+        self._written.pop(key, None)
+        self._deleted.discard(key)
+        self._cache[key] = session
+        self._dirty.add(key)
+
+    def __delitem__(self, key: Hashable) -> None:
+        if key in self._cache:
+            del self._cache[key]
+        self._dirty.discard(key)
+        self._written.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._cache or self._load(key) is not None
+
+    def __iter__(self) -> Iterator[Hashable]:
+        # Только сессии, загруженные в память этого процесса
+        return iter(self._cache)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _changes(self, key: Hashable, session: QuizSession) -> Dict[str, str]:
+        """Поля сессии, изменившиеся с последней записи"""
+        written = self._written.get(key)
+        state = json.dumps(session.to_state(), ensure_ascii=False)
+        fields = {}
+        # Список вопросов заменяется при новом круге и дополняется фоновой генерацией
+        if written is None or written[0] != id(session.questions) or written[1] != len(session.questions):
+            fields["questions"] = encode_questions(session.questions)
+        if written is None or written[2] != state:
+            fields["state"] = state
+        if fields:
+            self._written[key] = (id(session.questions), len(session.questions), state)
+        return fields
+
+    def flush(self, keys: Optional[List[Hashable]] = None) -> int:
+        """
+        Записывает изменения сессий пакетом
+
+        Args:
+            keys: только эти сессии (None — все, к которым обращались)
+
+        Returns:
+            int: количество записанных сессий
+        """
+        keys = list(self._dirty) if keys is None else [key for key in keys if key in self._dirty]
+        if not self.backend.durable:
+            self._dirty.difference_update(keys)
+            self._deleted.clear()
+            return 0
+        items = []
+        for key in keys:
+            self._dirty.discard(key)
+            session = self._cache.peek(key)
+            if session is None:
+                continue
+            fields = self._changes(key, session)
+            if fields:
+                items.append((self._key(key), fields))
+                if "questions" in fields:
+                    self.question_writes += 1
+        deleted = [self._key(key) for key in self._deleted]
+        try:
+            if items:
+                self.backend.save_many(items)
+            if deleted:
+                self.backend.delete_many(deleted)
+                self._deleted.clear()
+        except Exception as e:
+            logger.error(f"Error saving sessions of store '{self.name}': {str(e)}")
+            # Повторим при следующей записи
+            self._dirty.update(keys)
+            for key in keys:
+                self._written.pop(key, None)
+            return 0
+        self.writes += len(items)
+        return len(items)
+
+    def _evicted(self, key: Hashable, session: QuizSession) -> None:
+        """Сессия вытеснена из памяти: записываем несохраненные изменения"""
+        if key in self._dirty and self.backend.durable:
+            fields = self._changes(key, session)
+            if fields:
+                try:
+                    self.backend.save_many([(self._key(key), fields)])
+                    self.writes += 1
+                except Exception as e:
+                    logger.error(f"Error saving evicted session {self._key(key)}: {str(e)}")
+        self._dirty.discard(key)
+        self._written.pop(key, None)
+        if self.on_evict is not None:
+            self.on_evict(key, session)
+
+    def sweep(self) -> int:
+        """Удаляет брошенные сессии из памяти и из внешнего хранилища"""
+        removed = self._cache.sweep()
+        if self.ttl is not None:
+            try:
+                self.backend.purge(time.time() - self.ttl)
+            except Exception as e:
+                logger.error(f"Error purging sessions of store '{self.name}': {str(e)}")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику сессий"""
+        stats = self._cache.get_stats()
+        stats.update({
+            "backend": self.backend.name,
+            "pending": len(self._dirty),
+            "writes": self.writes,
+            "question_writes": self.question_writes,
+            "restored": self.loads
+        })
+        return stats
+
+
+async def flush_stores(stores: List[Any], interval: float) -> None:
+    """
+    Периодически записывает изменения сессий (запускается задачей при старте бота).
+    Кроме SessionStore подходят любые объекты с методом flush() (например, SqliteStorage)
+    """
+    interval = interval or 1.0
+    while True:
+        await asyncio.sleep(interval)
+        for store in stores:
+            store.flush()
+
+
+# Общее внешнее хранилище сессий демо-версии и полной версии
+session_backend = create_session_backend()
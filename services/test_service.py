@@ -1,43 +1,41 @@
 from typing import Dict, List, Any
 from services.question_service import QuestionService
+from services.quiz_session import QuizSession
+from config import config
+from services.session_store import SessionStore, session_backend
+from utils.bounded_store import BoundedStore
 from utils.logger import logger
 
 class TestService:
     def __init__(self):
         # Для демо-теста используем сервис вопросов с демо-контентом
         self.question_service = QuestionService(use_demo_mode=True)
-        self.user_sessions: Dict[int, Dict[str, Any]] = {}
-        self.user_results: Dict[int, Dict[str, Any]] = {}
+        # Сессии сохраняются во внешнее хранилище (config.session_backend); брошенные сессии
+        # и давние результаты удаляются, число записей и память ограничены
+        self.user_sessions: Dict[int, QuizSession] = SessionStore(
+            "Сессии демо-теста", "demo", QuizSession, session_backend,
+            ttl=config.session_ttl, max_entries=config.session_max_entries,
+            max_bytes=int(config.session_max_memory_mb * 1024 * 1024)
+        )
+        self.user_results: Dict[int, Dict[str, Any]] = BoundedStore(
+            "Результаты демо-теста", ttl=config.results_ttl, max_entries=config.results_max_entries
+        )
 
     def start_test(self, user_id: int) -> Dict[str, Any]:
-        # Получаем 10 случайных вопросов для демо-теста
-        import random
-        all_questions = self.question_service.get_all_questions()
-        
-        # Если количество вопросов меньше 10, берем все что есть
-        if len(all_questions) <= 10:
-            questions = all_questions
-        else:
-            # Иначе выбираем случайные 10 вопросов
-            questions = random.sample(all_questions, 10)
+        # Получаем 10 случайных вопросов для демо-теста (если их меньше, берем все что есть),
+        # в первую очередь те, которые пользователь еще не видел
+        questions = self.question_service.get_questions_by_theme(
+            self.question_service.default_theme_id, 10, user_id=user_id
+        )
         
-        self.user_sessions[user_id] = {
-            'current_question': 0,
-            'questions': questions,
-            'answers': [],
-            'score': 0
-        }
+        self.user_sessions[user_id] = QuizSession(questions)
         return self.get_current_question(user_id)
 
     def get_current_question(self, user_id: int) -> Dict[str, Any]:
         if user_id not in self.user_sessions:
             return {}
         
-        session = self.user_sessions[user_id]
-        if session['current_question'] >= len(session['questions']):
-            return {}
-        
-        return session['questions'][session['current_question']]
+        return self.user_sessions[user_id].current_question() or {}
 
     def answer_question(self, user_id: int, answer: int) -> Dict[str, Any]:
         if user_id not in self.user_sessions:
@@ -46,30 +44,20 @@ class TestService:
         session = self.user_sessions[user_id]
         
         # Проверка индекса текущего вопроса
-        if session['current_question'] >= len(session['questions']):
+        current_question = session.current_question()
+        if current_question is None:
             return {
                 'error': 'No more questions',
                 'next_question': None
             }
-            
-        current_question = session['questions'][session['current_question']]
         
         # Проверяем, что ответ находится в допустимом диапазоне
         if not 0 <= answer < len(current_question.get('options', [])):
             logger.warning(f"Invalid answer index {answer} for question {current_question['id']}")
             answer = 0  # Устанавливаем значение по умолчанию
             
-        is_correct = current_question['correct_answer'] == answer
-        if is_correct:
-            session['score'] += 1
-
-        session['answers'].append({
-            'question_id': current_question['id'],
-            'user_answer': answer,
-            'is_correct': is_correct
-        })
-        
-        session['current_question'] += 1
+        # Ответ упаковывается в сессию, ошибки по тегам учитываются сразу
+        is_correct = session.answer(answer)
         
         # Проверяем, есть ли следующий вопрос
         next_question = self.get_current_question(user_id)
@@ -89,36 +77,13 @@ class TestService:
             return {'error': 'No test results found'}
 
         session = self.user_sessions[user_id]
-        wrong_answers = [
-            ans for ans in session['answers'] 
-            if not ans['is_correct']
-        ]
-        
-        wrong_question_ids = [ans['question_id'] for ans in wrong_answers]
-        
-        # Собираем все теги из неправильных ответов
-        tag_error_counts = {}
-        for q_id in wrong_question_ids:
-            question = self.question_service.get_question_by_id(q_id)
-            if question:
-                for tag in question.get('tags', []):
-                    if tag in tag_error_counts:
-                        tag_error_counts[tag] += 1
-                    else:
-                        tag_error_counts[tag] = 1
-        
-        # Сортируем теги по количеству ошибок (по убыванию)
-        sorted_failed_tags = sorted(
-            tag_error_counts.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )
         
-        # Создаем объект с результатами
+        # Ошибки по тегам накоплены сессией при ответах; теги сортируются
+        # по количеству ошибок (по убыванию)
         results = {
-            'score': session['score'],
-            'total': len(session['questions']),
-            'failed_tags': sorted_failed_tags
+            'score': session.correct_count,
+            'total': len(session.questions),
+            'failed_tags': session.failed_tags()
         }
         
         # Сохраняем результаты для последующего использования
@@ -0,0 +1,153 @@
+"""
+Выбор вопросов с учетом слабых тегов пользователя.
+
+Вес вопроса складывается из базового веса и весов его тегов, которые
+стратегия (WeightingStrategy) вычисляет по ошибкам пользователя:
+    w(q) = base + sum(weight(tag) for tag in tags(q))
+Такое распределение — смесь компонент: «любой вопрос темы» с весом
+base * n и «вопрос с тегом t» с весом weight(t) * |Q_t|. Сначала по
+таблице псевдонимов (alias method) за O(1) выбирается компонента, затем
+за O(1) — равновероятная позиция внутри нее (списки позиций по тегам
+темы строятся заранее). Таблица псевдонимов строится по компонентам
+(их столько, сколько у пользователя слабых тегов) и перестраивается,
+только когда меняются веса пользователя или размер темы.
+"""
+import random
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+
+class AliasTable:
+    """Таблица псевдонимов (метод Vose): построение O(n), выбор O(1)"""
+    __slots__ = ("prob", "alias")
+
+    def __init__(self, weights: Sequence[float]):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("AliasTable requires positive total weight")
+        scaled = [w * n / total for w in weights]
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            # Остатки из-за погрешности округления
+            self.prob[i] = 1.0
+
+    def draw(self) -> int:
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+
+class WeightingStrategy:
+    """
+    Политика весов: базовый вес любого вопроса и веса тегов по ошибкам пользователя
+    """
+    base_weight = 1.0
+
+    def tag_weights(self, tag_errors: Dict[str, int]) -> Dict[str, float]:
+        raise NotImplementedError
+
+
+class UniformWeighting(WeightingStrategy):
+    """Все вопросы равновероятны"""
+
+    def tag_weights(self, tag_errors: Dict[str, int]) -> Dict[str, float]:
+        return {}
+
+
+class ErrorCountWeighting(WeightingStrategy):
+    """Вес тега пропорционален количеству ошибок пользователя в нем"""
+
+    def __init__(self, base_weight: float = 1.0, error_weight: float = 1.0):
+        self.base_weight = base_weight
+        self.error_weight = error_weight
+
+    def tag_weights(self, tag_errors: Dict[str, int]) -> Dict[str, float]:
+        return {tag: count * self.error_weight for tag, count in tag_errors.items() if count > 0}
+
+
+class WeaknessSampler:
+    """
+    Взвешенная выборка позиций вопросов темы с кэшем таблиц псевдонимов
+    """
+
+    def __init__(self, strategy: Optional[WeightingStrategy] = None, cache_size: int = 1000):
+        self.strategy = strategy or ErrorCountWeighting()
+        self.cache_size = cache_size
+        # (ID пользователя, ключ набора) -> (ключ весов, таблица, компоненты)
+        self._tables: "OrderedDict[Tuple[Any, str], tuple]" = OrderedDict()
+
+        # Счетчики для статистики
+        self.builds = 0
+        self.draws = 0
+
+    def _components(self, size: int, tag_positions: Dict[str, List[int]],
+                    tag_errors: Dict[str, int]) -> List[Tuple[Optional[str], float]]:
+        """Компоненты смеси: (тег или None для всей темы, суммарный вес)"""
+        components: List[Tuple[Optional[str], float]] = []
+        if self.strategy.base_weight > 0:
+            components.append((None, self.strategy.base_weight * size))
+        for tag, weight in sorted(self.strategy.tag_weights(tag_errors).items()):
+            positions = tag_positions.get(tag)
+            if weight > 0 and positions:
+                components.append((tag, weight * len(positions)))
+        return components
+
+    def drawer(self, user_id: Any, pool_key: str, size: int, tag_positions: Dict[str, List[int]],
+               tag_errors: Dict[str, int]):
+        """
+        Возвращает функцию, выбирающую одну позицию темы за O(1), или None,
+        если у пользователя нет слабых тегов в этой теме (выбор равновероятный)
+
+        Args:
+            user_id: ID пользователя (ключ кэша таблиц)
+            pool_key: ключ набора вопросов
+            size: количество вопросов темы
+            tag_positions: тег -> позиции вопросов темы с этим тегом
+            tag_errors: тег -> количество ошибок пользователя
+        """
+        if size <= 0:
+            return None
+        components = self._components(size, tag_positions, tag_errors)
+        if not any(tag is not None for tag, _ in components):
+            return None
+
+        key = (user_id, pool_key)
+        weights_key = (size, tuple(components))
+        cached = self._tables.get(key)
+        if cached is not None and cached[0] == weights_key:
+            self._tables.move_to_end(key)
+            table = cached[1]
+        else:
+            table = AliasTable([weight for _, weight in components])
+            self._tables[key] = (weights_key, table)
+            self._tables.move_to_end(key)
+            self.builds += 1
+            while len(self._tables) > self.cache_size:
+                self._tables.popitem(last=False)
+
+        def draw() -> int:
+            self.draws += 1
+            tag = components[table.draw()][0]
+            if tag is None:
+                return random.randrange(size)
+            positions = tag_positions[tag]
+            return positions[random.randrange(len(positions))]
+        return draw
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику взвешенной выборки"""
+        return {
+            "strategy": type(self.strategy).__name__,
+            "tables": len(self._tables),
+            "builds": self.builds,
+            "draws": self.draws
+        }
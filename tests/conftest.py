@@ -0,0 +1,15 @@
+"""
+Общие фикстуры тестов
+"""
+import pytest
+
+from services.analytics_service import analytics_service
+
+
+@pytest.fixture(autouse=True)
+def analytics_db(tmp_path, monkeypatch):
+    """База аналитики во временном каталоге: тесты не пишут в analytics_data/bot_analytics.db"""
+    monkeypatch.setattr(analytics_service, "db_path", str(tmp_path / "bot_analytics.db"))
+    analytics_service._init_database()
+    yield analytics_service.db_path
+    analytics_service._take_ai_calls()
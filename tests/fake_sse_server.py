@@ -0,0 +1,147 @@
+"""
+Локальный поддельный сервер chat-completions с потоковыми ответами (SSE).
+
+Отвечает на POST событиями "data: {...}" так же, как AI API при stream: true:
+текст ответа режется на мелкие фрагменты, после них идет событие с расходом
+токенов и "data: [DONE]". Поведение задается для каждой модели из тела
+запроса (Script): задержка перед первым фрагментом, код ошибки, событие,
+которое держит поток после первого вопроса, некорректные строки потока.
+Сервер записывает полученные запросы и замечает, что клиент закрыл
+соединение, не дочитав поток (отмена или проигравший хедж).
+"""
+import asyncio
+import json
+from typing import Dict, List, Any, Optional
+
+from aiohttp import web
+
+
+def questions_text(questions: List[Dict[str, Any]]) -> str:
+    """Текст ответа модели в JSON-режиме"""
+    return json.dumps({"questions": questions}, ensure_ascii=False)
+
+
+def make_questions(count: int, prefix: str = "Вопрос") -> List[Dict[str, Any]]:
+    return [
+        {
+            "question": f"{prefix} {i}: что такое {{сетка}} и \"модульность\"?",
+            "options": ["a", "b", "c", "d"],
+            "correct_answer": i % 4,
+            "tags": ["сетка", "модульность"]
+        }
+        for i in range(count)
+    ]
+
+
+class Script:
+    """Ответ сервера для одной модели"""
+
+    def __init__(self, text: str = "", chunk_size: int = 7, first_byte_delay: float = 0.0,
+                 status: int = 200, hold_after: Optional[str] = None, garbage: bool = False):
+        """
+        Args:
+            text: текст ответа модели
+            chunk_size: размер фрагмента текста в одном событии
+            first_byte_delay: задержка перед первым событием, сек
+            status: код ответа (не 200 — ответ без потока)
+            hold_after: после фрагмента, завершающего эту подстроку, поток ждет server.release
+            garbage: добавить в поток комментарий, пустую строку и некорректное событие
+        """
+        self.text = text
+        self.chunk_size = chunk_size
+        self.first_byte_delay = first_byte_delay
+        self.status = status
+        self.hold_after = hold_after
+        self.garbage = garbage
+
+
+class FakeSSEServer:
+    """
+    Поддельный AI API на 127.0.0.1 со случайным портом:
+
+        async with FakeSSEServer({"model": Script(text)}) as server:
+            service.api_url = server.url
+    """
+
+    def __init__(self, scripts: Dict[str, Script]):
+        self.scripts = scripts
+        # Тела полученных запросов по порядку
+        self.requests: List[Dict[str, Any]] = []
+        # Модели запросов, соединение которых клиент закрыл до конца потока
+        self.disconnected: List[str] = []
+        # Модели запросов, поток которых отправлен полностью
+        self.completed: List[str] = []
+        self.release = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def __aenter__(self) -> "FakeSSEServer":
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/v1/chat/completions"
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release.set()
+        await self._runner.cleanup()
+
+    @staticmethod
+    def _closed(request: web.Request) -> bool:
+        return request.transport is None or request.transport.is_closing()
+
+    async def _wait(self, request: web.Request, seconds: Optional[float] = None) -> bool:
+        """Ждет seconds (None — до server.release); False, если клиент закрыл соединение"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds if seconds is not None else None
+        while not self._closed(request):
+            if deadline is not None and loop.time() >= deadline:
+                return True
+            if deadline is None and self.release.is_set():
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests.append(payload)
+        model = payload.get("model")
+        script = self.scripts[model]
+
+        if script.first_byte_delay and not await self._wait(request, script.first_byte_delay):
+            self.disconnected.append(model)
+            return web.Response()
+        if script.status != 200:
+            return web.Response(status=script.status, text="fake upstream error")
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            if script.garbage:
+                await response.write(b": keep-alive\n\n")
+                await response.write(b"data: {not json\n\n")
+            sent = ""
+            for start in range(0, len(script.text), script.chunk_size):
+                chunk = script.text[start:start + script.chunk_size]
+                event = {"choices": [{"delta": {"content": chunk}}]}
+                await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                sent += chunk
+                if script.hold_after is not None and script.hold_after in sent:
+                    script.hold_after = None
+                    if not await self._wait(request):
+                        self.disconnected.append(model)
+                        return response
+                await asyncio.sleep(0)
+            usage = {"prompt_tokens": 100, "completion_tokens": len(script.text) // 4,
+                     "total_tokens": 100 + len(script.text) // 4}
+            await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+            await response.write(b"data: [DONE]\n\n")
+            self.completed.append(model)
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.disconnected.append(model)
+            raise
+        return response
@@ -0,0 +1,152 @@
+"""
+Квоты пользователей и объединение запросов: квоту расходует только тот,
+чей вызов отправляет запрос к API, а не присоединившиеся к нему
+"""
+import asyncio
+import json
+
+import pytest
+
+from config import config
+from services.ai_quota import user_context
+from services.ai_metrics import AICallMetrics
+from services.ai_service import AIService
+from tests.fake_sse_server import FakeSSEServer, Script, make_questions, questions_text
+
+TOPIC = "Тема 1. Сетки"
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(config, "ai_quota_file", None)
+    monkeypatch.setattr(config, "checklist_cache_file", None)
+    monkeypatch.setattr(config, "ai_streaming_enabled", True)
+    service = AIService()
+    service.api_key = "test"
+    return service
+
+
+def calls(service, user_id):
+    return service.quota._get_usage(user_id).hour_calls
+
+
+async def as_user(user_id, coro_factory):
+    with user_context(user_id):
+        return await coro_factory()
+
+
+def slow_submit(service):
+    async def submit(topic, num_questions, priority):
+        await asyncio.sleep(0.05)
+        return make_questions(num_questions)
+    service.question_batcher.submit = submit
+
+
+def test_coalesced_caller_is_not_charged(service):
+    slow_submit(service)
+
+    async def run():
+        return await asyncio.gather(
+            as_user(1, lambda: service.generate_questions(TOPIC, 2)),
+            as_user(2, lambda: service.generate_questions(TOPIC, 2))
+        )
+
+    first, second = asyncio.run(run())
+    assert len(first) == len(second) == 2
+    assert service.single_flight.coalesced == 1
+    assert calls(service, 1) == 1
+    assert calls(service, 2) == 0
+
+
+def test_exhausted_user_can_join_but_not_start_a_request(service):
+    slow_submit(service)
+    service.quota.set_override(2, {"calls_per_hour": 0})
+
+    async def run():
+        joined = await asyncio.gather(
+            as_user(1, lambda: service.generate_questions(TOPIC, 2)),
+            as_user(2, lambda: service.generate_questions(TOPIC, 2))
+        )
+        alone = await as_user(2, lambda: service.generate_questions(TOPIC, 2))
+        return joined, alone
+
+    (first, second), alone = asyncio.run(run())
+    # Присоединение к чужому запросу ничего не стоит, собственный запрос отклонен квотой
+    assert len(second) == 2
+    assert alone == []
+    assert service.quota.rejected == 1
+
+
+def test_coalesced_stream_reader_is_not_charged(service):
+    async def run():
+        script = Script(questions_text(make_questions(2)), hold_after='"tags"')
+        async with FakeSSEServer({config.ai_model: script}) as server:
+            service.api_url = server.url
+
+            async def consume():
+                return [question async for question in service.generate_questions_stream(TOPIC, 2)]
+
+            first = asyncio.create_task(as_user(1, consume))
+            await asyncio.sleep(0.05)
+            second = asyncio.create_task(as_user(2, consume))
+            await asyncio.sleep(0.05)
+            server.release.set()
+            results = await asyncio.gather(first, second)
+            await service.close()
+            return server, results
+
+    server, (first, second) = asyncio.run(run())
+    assert len(server.requests) == 1
+    assert len(first) == len(second) == 2
+    assert calls(service, 1) == 1
+    assert calls(service, 2) == 0
+
+
+def test_coalesced_checklist_caller_is_not_charged(service):
+    failed_tags = [("сетка", 2), ("цвет", 1)]
+    service.quota.set_override(2, {"calls_per_hour": 0})
+
+    async def request_checklist(tags, topic):
+        await asyncio.sleep(0.05)
+        return {"resources": [{"title": "Модульные сетки"}], "explanation": "Повторите сетки"}
+    service._request_checklist = request_checklist
+
+    async def run():
+        return await asyncio.gather(
+            as_user(1, lambda: service.generate_personalized_checklist(failed_tags, TOPIC)),
+            as_user(2, lambda: service.generate_personalized_checklist(failed_tags, TOPIC))
+        )
+
+    first, second = asyncio.run(run())
+    # Пользователь без квоты получает чек-лист, присоединившись к чужому запросу
+    assert first == second
+    assert second["resources"]
+    assert service.single_flight.coalesced == 1
+    assert calls(service, 1) == 1
+    assert calls(service, 2) == 0
+    assert service.quota.rejected == 0
+
+
+def test_batched_request_tokens_are_split_between_users(service):
+    service.question_batcher.enabled = True
+    service.question_batcher.window = 0.05
+
+    async def post_completion_once(payload, priority=0, completion_tokens=1000):
+        AICallMetrics.add_transport_usage(service.model, {"prompt_tokens": 400, "completion_tokens": 500})
+        groups = [{"group": 1, "questions": make_questions(1)}, {"group": 2, "questions": make_questions(2)}]
+        text = json.dumps({"groups": groups}, ensure_ascii=False)
+        return {"choices": [{"message": {"content": text}}], "usage": {"total_tokens": 900}}
+    service._post_completion_once = post_completion_once
+
+    async def run():
+        return await asyncio.gather(
+            as_user(1, lambda: service.generate_questions("Тема 1. Сетки", 1)),
+            as_user(2, lambda: service.generate_questions("Тема 2. Цвет", 2))
+        )
+
+    first, second = asyncio.run(run())
+    assert len(first) == 1 and len(second) == 2
+    assert service.question_batcher.batches == 1
+    # 900 токенов батча делятся по количеству запрошенных вопросов: 1 к 2
+    assert service.quota._get_usage(1).hour_tokens == 300
+    assert service.quota._get_usage(2).hour_tokens == 600
@@ -0,0 +1,160 @@
+"""
+Потоковая генерация вопросов через поддельный SSE-сервер: инкрементальный
+разбор, ошибки API, хеджирование медленного потока и отмена потребителя
+"""
+import asyncio
+
+import pytest
+
+from config import config
+from services.ai_response_parser import IncrementalQuestionParser
+from services.ai_service import AIService
+from tests.fake_sse_server import FakeSSEServer, Script, make_questions, questions_text
+
+MODEL = config.ai_model
+TOPIC = "Тема 1. Сетки"
+QUESTIONS = make_questions(3)
+# Второй вопрос без вариантов ответа: поток его пропускает
+TEXT = questions_text([QUESTIONS[0], {"question": "Без вариантов", "correct_answer": 0}] + QUESTIONS[1:])
+FIRST_QUESTION_END = '"tags": ["сетка", "модульность"]}'
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(config, "ai_quota_file", None)
+    monkeypatch.setattr(config, "checklist_cache_file", None)
+    monkeypatch.setattr(config, "ai_streaming_enabled", True)
+    service = AIService()
+    service.api_key = "test"
+    return service
+
+
+async def wait_for(condition, timeout: float = 2.0) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() >= deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_incremental_parser_handles_any_chunking(chunk_size):
+    parser = IncrementalQuestionParser()
+    parsed = []
+    for start in range(0, len(TEXT), chunk_size):
+        parsed.extend(parser.feed(TEXT[start:start + chunk_size]))
+    # Скобки и кавычки внутри строк не завершают объект раньше времени
+    assert [q["question"] for q in parsed if "options" in q] == [q["question"] for q in QUESTIONS]
+
+
+def test_stream_yields_first_question_before_response_ends(service):
+    async def run():
+        script = Script(TEXT, hold_after=FIRST_QUESTION_END, garbage=True)
+        async with FakeSSEServer({MODEL: script}) as server:
+            service.api_url = server.url
+            stream = service.generate_questions_stream(TOPIC, 3)
+            # Сервер держит поток после первого вопроса: вопрос должен прийти до конца ответа
+            first = await asyncio.wait_for(stream.__anext__(), timeout=5)
+            assert server.completed == []
+            server.release.set()
+            rest = [question async for question in stream]
+            await service.close()
+            return server, [first] + rest
+
+    server, questions = asyncio.run(run())
+    assert [q["question"] for q in questions] == [q["question"] for q in QUESTIONS]
+    assert server.requests[0]["stream"] is True
+    assert server.requests[0]["stream_options"] == {"include_usage": True}
+    assert server.completed == [MODEL]
+    assert service.single_flight.get_stats()["in_flight"] == 0
+
+
+def test_stream_provider_error_yields_nothing(service):
+    async def run():
+        async with FakeSSEServer({MODEL: Script(status=503)}) as server:
+            service.api_url = server.url
+            questions = [question async for question in service.generate_questions_stream(TOPIC, 3)]
+            await service.close()
+            return server, questions
+
+    server, questions = asyncio.run(run())
+    assert questions == []
+    assert len(server.requests) == 1
+
+
+def test_hedge_stream_wins_and_stalled_primary_is_closed(service):
+    service.hedge_policy.enabled = True
+    service.hedge_policy.fixed_delay = 0.05
+    service.hedge_policy.max_ratio = 1.0
+    service.hedge_policy.model = "hedge-model"
+
+    async def run():
+        scripts = {MODEL: Script(TEXT, first_byte_delay=10), "hedge-model": Script(TEXT)}
+        async with FakeSSEServer(scripts) as server:
+            service.api_url = server.url
+            questions = [question async for question in service.generate_questions_stream(TOPIC, 3)]
+            # Основной запрос отменен: соединение закрыто, не дожидаясь его ответа
+            closed = await wait_for(lambda: MODEL in server.disconnected)
+            await service.close()
+            return server, questions, closed
+
+    server, questions, closed = asyncio.run(run())
+    assert [q["question"] for q in questions] == [q["question"] for q in QUESTIONS]
+    assert [request["model"] for request in server.requests] == [MODEL, "hedge-model"]
+    assert service.hedge_policy.hedge_wins == 1
+    assert closed
+
+
+def test_cancelled_consumer_closes_upstream_stream(service):
+    async def run():
+        async with FakeSSEServer({MODEL: Script(TEXT, hold_after=FIRST_QUESTION_END)}) as server:
+            service.api_url = server.url
+            received = []
+
+            async def consume():
+                async for question in service.generate_questions_stream(TOPIC, 3):
+                    received.append(question)
+
+            # Так фоновая генерация сессии отменяется по таймауту ожидания вопроса
+            task = asyncio.create_task(consume())
+            assert await wait_for(lambda: received)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            closed = await wait_for(lambda: MODEL in server.disconnected)
+            await service.close()
+            return server, received, closed
+
+    server, received, closed = asyncio.run(run())
+    assert len(received) == 1
+    assert closed
+    assert server.completed == []
+    assert service.single_flight.get_stats()["in_flight"] == 0
+
+
+def test_cancelled_joiner_does_not_stop_shared_stream(service):
+    async def run():
+        async with FakeSSEServer({MODEL: Script(TEXT, hold_after=FIRST_QUESTION_END)}) as server:
+            service.api_url = server.url
+            received = {"first": [], "second": []}
+
+            async def consume(name):
+                async for question in service.generate_questions_stream(TOPIC, 3):
+                    received[name].append(question)
+
+            first = asyncio.create_task(consume("first"))
+            second = asyncio.create_task(consume("second"))
+            assert await wait_for(lambda: received["first"] and received["second"])
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+            server.release.set()
+            await asyncio.wait_for(second, timeout=5)
+            await service.close()
+            return server, received
+
+    server, received = asyncio.run(run())
+    # Один запрос к API на двоих; оставшийся потребитель получил все вопросы
+    assert len(server.requests) == 1
+    assert len(received["second"]) == 3
+    assert server.completed == [MODEL]
@@ -0,0 +1,42 @@
+"""
+Метрики запросов к AI API пишутся в базу аналитики пакетами, не на цикле событий
+"""
+import asyncio
+import sqlite3
+
+from services.analytics_service import analytics_service
+
+RECORD = {"kind": "questions", "model": "fake", "priority": 1, "status": "ok", "parse_ok": True,
+          "latency": 1.5, "ttfb": 0.2, "prompt_tokens": 100, "completion_tokens": 50, "cost": 0.001}
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM ai_calls").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_ai_calls_are_buffered_until_flush(analytics_db):
+    for _ in range(3):
+        analytics_service.log_ai_call(RECORD)
+    assert count_rows(analytics_db) == 0
+
+    analytics_service.flush_ai_calls()
+    assert count_rows(analytics_db) == 3
+
+
+def test_background_writer_inserts_batches(analytics_db):
+    async def run():
+        task = asyncio.create_task(analytics_service.write_ai_calls(0.01))
+        analytics_service.log_ai_call(RECORD)
+        analytics_service.log_ai_call(RECORD)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if count_rows(analytics_db) == 2:
+                break
+        task.cancel()
+
+    asyncio.run(run())
+    assert count_rows(analytics_db) == 2
@@ -0,0 +1,48 @@
+"""
+Ограниченные хранилища данных пользователей
+"""
+import time
+
+from services.ai_quota import AIQuota
+from services.question_sampler import QuestionSampler
+from utils.bounded_store import BoundedStore
+
+
+def test_lru_eviction_and_ttl_sweep():
+    evicted = []
+    store = BoundedStore("test", ttl=0.05, max_entries=3, on_evict=lambda key, value: evicted.append(key))
+    for i in range(5):
+        store[i] = i
+    assert list(store) == [2, 3, 4]
+    assert evicted == [0, 1]
+
+    store[2]  # обращение продлевает жизнь записи и переносит ее в конец
+    time.sleep(0.06)
+    store[9] = 9
+    assert store.sweep() == 2
+    assert list(store) == [9]
+    assert store.get_stats()["expired"] == 2
+
+
+def test_setdefault_keeps_nested_counters():
+    store = BoundedStore("errors", ttl=60)
+    store.setdefault(1, {})[7] = 2
+    store.setdefault(1, {})[7] += 1
+    assert store[1] == {7: 3}
+
+
+def test_sampler_masks_are_bounded(monkeypatch):
+    sampler = QuestionSampler()
+    sampler._seen.max_entries = 2
+    for user_id in range(4):
+        sampler.sample(user_id, "full:theme", 100, 5)
+    assert len(sampler._seen) == 2
+    assert sampler.get_stats()["evicted"] == 2
+
+
+def test_quota_sweep_forgets_idle_users():
+    quota = AIQuota(file_path="")
+    quota.get_user_usage(1)
+    quota.acquire(2)
+    assert quota.sweep() == 1
+    assert quota.get_stats()["users_tracked"] == 1
@@ -0,0 +1,117 @@
+"""
+Выключатель AI API размыкается при большой доле ошибок и замыкается после
+успешных пробных запросов; планировщик отклоняет запросы сверх лимитов
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from config import config
+from services import circuit_breaker as circuit_module
+from services.ai_scheduler import AIScheduler, AdmissionRejected, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_module, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    monkeypatch.setattr(config, "ai_breaker_min_calls", 4)
+    monkeypatch.setattr(config, "ai_breaker_error_rate", 0.5)
+    monkeypatch.setattr(config, "ai_breaker_open_seconds", 30)
+    monkeypatch.setattr(config, "ai_breaker_half_open_probes", 2)
+    return CircuitBreaker("test")
+
+
+def test_breaker_opens_on_errors_and_closes_after_probes(breaker, clock):
+    breaker.record(False, 1.0)
+    breaker.record(False, 1.0)
+    breaker.record(True, 1.0)
+    # Запросов меньше min_calls — выключатель не срабатывает
+    assert breaker.state == CLOSED
+    breaker.record(False, 1.0)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    assert breaker.short_circuited == 1
+    assert breaker.retry_after() == 30
+
+    clock.now += 30
+    # Полуоткрытое состояние пропускает не больше half_open_probes запросов
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record(True, 1.0)
+    assert breaker.state == HALF_OPEN
+    breaker.record(True, 1.0)
+    assert breaker.state == CLOSED
+    assert breaker.times_opened == 1
+
+
+def test_failed_probe_reopens_breaker(breaker, clock):
+    for _ in range(4):
+        breaker.record(False, 1.0)
+    clock.now += 30
+    breaker.check()
+
+    breaker.record(False, 1.0)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+    assert not breaker.allow_request()
+
+
+def test_slow_calls_open_breaker(breaker):
+    breaker.latency_threshold = 10.0
+    for _ in range(4):
+        breaker.record(True, 15.0)
+    assert breaker.state == OPEN
+
+
+def test_old_errors_leave_the_window(breaker, clock):
+    for _ in range(3):
+        breaker.record(False, 1.0)
+    clock.now += breaker.window_seconds + 1
+    breaker.record(False, 1.0)
+    assert breaker.state == CLOSED
+    assert breaker.error_rate() == 1.0
+
+
+def test_scheduler_rejects_when_wait_exceeds_deadline(monkeypatch):
+    monkeypatch.setattr(config, "ai_max_concurrency", 1)
+    monkeypatch.setattr(config, "ai_admission_deadlines", {PRIORITY_INTERACTIVE: 0.5, PRIORITY_BACKGROUND: None})
+
+    async def run():
+        scheduler = AIScheduler()
+        await scheduler.acquire(PRIORITY_INTERACTIVE, 100)
+        # Слот занят, ожидание по оценке длительности запроса больше срока
+        with pytest.raises(AdmissionRejected):
+            await scheduler.acquire(PRIORITY_INTERACTIVE, 100)
+
+        # Фоновый запрос без срока ждет освобождения слота
+        waiter = asyncio.ensure_future(scheduler.acquire(PRIORITY_BACKGROUND, 100))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        scheduler.release(100, 80, 1.0)
+        await asyncio.wait_for(waiter, 1)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.admitted == 2
+    assert scheduler.rejected == 1
@@ -0,0 +1,91 @@
+"""
+Скомпилированная база хранит сигнатуры вопросов: индекс дубликатов
+строится без разбора вопросов базы
+"""
+import json
+import sqlite3
+
+from services.content_store import SqliteQuestionStore, compile_content_store
+from services.question_signatures import SignatureCache, iter_question_signatures
+from utils.text_similarity import MinHasher
+
+
+class StoreQuestionService:
+    """Вопросы базы и вопросы, добавленные в память после компиляции"""
+
+    def __init__(self, store, memory):
+        self.store = store
+        self.memory = memory
+
+    def iter_questions(self, source_type=None, include_store=True):
+        if include_store:
+            yield from self.store.iter_questions(source_type)
+        for question in self.memory:
+            if source_type is None or question.get("source", {}).get("type") == source_type:
+                yield "ux_ui_basics", question
+
+
+def make_question(i, source=None):
+    question = {"id": f"q{i}", "question": f"Какой принцип гештальта описывает пример номер {i}?",
+                "options": ["близость", "сходство", "замкнутость", "непрерывность"], "correct_answer": 0,
+                "tags": ["гештальт"]}
+    if source:
+        question["source"] = {"type": source}
+    return question
+
+
+def build(tmp_path):
+    content_file = tmp_path / "content.json"
+    content_file.write_text(json.dumps({"themes": [{
+        "id": "ux_ui_basics", "name": "Основы", "questions": [make_question(i) for i in range(20)]
+    }]}, ensure_ascii=False), encoding="utf-8")
+    packs_dir = tmp_path / "packs"
+    packs_dir.mkdir()
+    with open(packs_dir / "generated.jsonl", "w", encoding="utf-8") as file:
+        for i in range(20, 25):
+            file.write(json.dumps(dict(make_question(i, "ai"), theme="ux_ui_basics"), ensure_ascii=False) + "\n")
+    output = str(tmp_path / "content.sqlite")
+    compile_content_store(str(content_file), str(packs_dir), output)
+    return output
+
+
+def test_signatures_come_from_store_without_parsing_rows(tmp_path, monkeypatch):
+    store = SqliteQuestionStore(build(tmp_path), 100)
+    assert store.signature_params == MinHasher().params
+    # Вопросы базы не разбираются
+    monkeypatch.setattr(store, "iter_questions", lambda source_type=None: iter(()))
+
+    cache = SignatureCache(None, MinHasher())
+    added = make_question(99, "ai")
+    service = StoreQuestionService(store, [added])
+    items = list(iter_question_signatures(service, cache))
+
+    assert len(items) == 26
+    # Сигнатура считается только для вопроса, добавленного после компиляции
+    assert cache.computed == 1
+    signatures = {question_id: sig for _, question_id, sig in items}
+    assert signatures["q3"] == SignatureCache(None, MinHasher()).signatures([make_question(3)])[0]
+
+
+def test_store_filters_questions_by_source(tmp_path):
+    store = SqliteQuestionStore(build(tmp_path), 100)
+    assert [question["id"] for _, question in store.iter_questions("ai")] == [f"q{i}" for i in range(20, 25)]
+    assert len(list(store.iter_questions())) == 25
+
+
+def test_store_without_signatures_falls_back_to_questions(tmp_path):
+    path = build(tmp_path)
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE question_signatures")
+    conn.execute("DELETE FROM meta WHERE key = 'signature_params'")
+    conn.commit()
+    conn.close()
+
+    store = SqliteQuestionStore(path, 100)
+    assert store.signature_params is None
+    cache = SignatureCache(None, MinHasher())
+    items = list(iter_question_signatures(StoreQuestionService(store, []), cache))
+    assert len(items) == 25
+    assert cache.computed == 25
+    # Фильтр по источнику работает и без таблицы сигнатур
+    assert len(list(store.iter_questions("ai"))) == 5
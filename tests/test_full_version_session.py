@@ -0,0 +1,101 @@
+"""
+Полный проход теста полной версии до экрана результатов (без ИИ и Telegram)
+"""
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from config import config
+from handlers.full_version_handler import FullVersionHandler, FullVersionSession
+from services.session_store import FakeRedis, RedisSessionBackend, SessionStore
+
+
+def make_callback(user_id: int, data: str):
+    message = MagicMock()
+    message.answer = AsyncMock(return_value=SimpleNamespace(delete=AsyncMock()))
+    return SimpleNamespace(
+        from_user=SimpleNamespace(id=user_id),
+        data=data,
+        message=message,
+        answer=AsyncMock(),
+        bot=MagicMock()
+    )
+
+
+def test_full_version_session_reaches_results(monkeypatch):
+    # Без ключа API вопросы берутся только из базы
+    monkeypatch.setattr(config, "ai_api_key", "")
+    handler = FullVersionHandler()
+    user_id = 424242
+    state = AsyncMock()
+
+    async def run():
+        await handler.handle_topic_selection(make_callback(user_id, "topic_ux_ui_basics"), state)
+        session = handler.user_sessions[user_id]
+        assert session.questions
+
+        callback = None
+        for _ in range(handler.total_questions + 1):
+            if session.current >= len(session.questions):
+                break
+            callback = make_callback(user_id, "answer_0")
+            await handler.handle_answer(callback, state)
+        return session, callback
+
+    session, callback = asyncio.run(run())
+
+    assert session.answered == len(session.questions)
+    # Экран результатов отправлен, теги с ошибками сохранены для чек-листа
+    result_text = callback.message.answer.call_args_list[-1].args[0]
+    assert "Результаты теста" in result_text
+    # Состояние ответа на вопросы сброшено, пользователь не застревает в ANSWERING
+    state.clear.assert_awaited_once()
+    assert session.last_failed_tags == session.failed_tags()
+    assert sum(count for _, count in session.last_failed_tags) >= session.answered - session.correct_count
+
+
+def test_restored_session_resumes_ai_generation(monkeypatch):
+    monkeypatch.setattr(config, "ai_api_key", "test")
+    handler = FullVersionHandler()
+    backend = RedisSessionBackend(FakeRedis())
+    handler.user_sessions.backend = backend
+    user_id = 515151
+    state = AsyncMock()
+    streams = []
+    stopped = {"before_restart": True}
+
+    async def stream_questions(user_id, topic_key, topic_name, tags, count):
+        streams.append(count)
+        if stopped["before_restart"]:
+            # Процесс «остановился», не дождавшись генерации
+            await asyncio.Event().wait()
+        for i in range(count):
+            yield {"id": f"ai_{i}", "question": f"ИИ-вопрос {i}", "options": ["a", "b", "c", "d"],
+                   "correct_answer": 0, "tags": tags[:1]}
+    handler.question_pool.stream_questions = stream_questions
+
+    async def run():
+        await handler.handle_topic_selection(make_callback(user_id, "topic_ux_ui_basics"), state)
+        session = handler.user_sessions[user_id]
+        await handler.handle_answer(make_callback(user_id, "answer_0"), state)
+        await asyncio.sleep(0)
+        handler.user_sessions.flush()
+        handler._cancel_ai_prefetch(session)
+        stopped["before_restart"] = False
+
+        # Перезапуск: новое хранилище в памяти, то же внешнее хранилище
+        handler.user_sessions = SessionStore("full", "full", FullVersionSession, backend,
+                                             on_load=handler._resume_ai_prefetch)
+        restored = handler.user_sessions[user_id]
+        messages = []
+        while restored.current < len(restored.questions) and restored.current < handler.total_questions:
+            callback = make_callback(user_id, "answer_0")
+            await handler.handle_answer(callback, state)
+            messages.extend(call.args[0] for call in callback.message.answer.call_args_list)
+        return restored, messages
+
+    restored, messages = asyncio.run(run())
+    # Генерация недостающих ИИ-вопросов запущена заново, тест идет до конца
+    assert streams[:2] == [5, 5]
+    assert restored.answered == handler.total_questions
+    assert not any("ИИ-генерация отключена" in text for text in messages)
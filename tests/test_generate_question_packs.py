@@ -0,0 +1,87 @@
+"""
+Офлайн-генерация пакетов: отказы API без ответа не расходуют попытки комбинаций
+"""
+import argparse
+import asyncio
+import json
+import os
+
+import services.ai_service
+from config import config
+from generate_question_packs import run
+from services.ai_service import AIProviderError
+from services.circuit_breaker import CircuitOpenError
+
+
+class FakeCircuitBreaker:
+    def retry_after(self):
+        return 0.0
+
+
+WORDS = ["выбираешь шрифт для заголовков", "проектируешь онбординг", "строишь модульную сетку",
+         "тестируешь прототип с пользователями", "подбираешь палитру для графиков", "пишешь микротексты кнопок"]
+
+
+class FakeAIService:
+    """Сначала выключатель разомкнут и API отвечает ошибкой, затем приходят вопросы"""
+    model = "fake"
+    errors = []
+    served = []
+
+    def __init__(self):
+        self.circuit_breaker = FakeCircuitBreaker()
+        self.calls = 0
+
+    async def request_questions(self, topic, num, priority=None):
+        self.calls += 1
+        if FakeAIService.errors:
+            raise FakeAIService.errors.pop(0)
+        questions = []
+        for _ in range(num):
+            word = WORDS[len(FakeAIService.served) % len(WORDS)]
+            FakeAIService.served.append(word)
+            questions.append({"question": f"Что важно учитывать, когда {word}?",
+                              "options": [f"{word} {j}" for j in ("быстро", "медленно", "никогда", "всегда")],
+                              "correct_answer": 0, "tags": ["контраст"]})
+        return questions
+
+    async def close(self):
+        pass
+
+
+def make_args(output_dir, **overrides):
+    args = dict(topic=["ux_ui_basics"], tags_per_combo=2, max_combos=1, per_combo=4, batch_size=2, workers=1,
+                rpm=None, tpm=None, output_dir=output_dir, max_failures=20, max_backoff=0.0)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def read_checkpoint(output_dir):
+    with open(os.path.join(output_dir, "generated_ux_ui_basics.jsonl.checkpoint.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_outage_does_not_burn_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ai_api_key", "test")
+    monkeypatch.setattr(services.ai_service, "AIService", FakeAIService)
+    # Больше отказов подряд, чем попыток на комбинацию (ceil(4 / 2) * 3 = 6)
+    FakeAIService.errors = [CircuitOpenError("open")] * 5 + [AIProviderError("API Error: 503")] * 3
+
+    asyncio.run(run(make_args(str(tmp_path))))
+
+    checkpoint = read_checkpoint(str(tmp_path))
+    # Засчитаны только два ответа API, комбинация заполнена целиком
+    assert list(checkpoint["attempts"].values()) == [2]
+    assert list(checkpoint["generated"].values()) == [4]
+
+
+def test_generation_stops_after_max_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ai_api_key", "test")
+    monkeypatch.setattr(services.ai_service, "AIService", FakeAIService)
+    FakeAIService.errors = [CircuitOpenError("open")] * 10
+
+    asyncio.run(run(make_args(str(tmp_path), max_failures=3)))
+
+    # Попытки не записаны: повторный запуск начнет комбинацию заново
+    assert not os.path.exists(os.path.join(str(tmp_path), "generated_ux_ui_basics.jsonl.checkpoint.json"))
+    FakeAIService.errors = []
@@ -0,0 +1,62 @@
+"""
+Сбор ИИ-вопросов: индекс дубликатов строится в фоне по сохраненным сигнатурам
+"""
+import asyncio
+
+from config import config
+from services.question_harvest_service import QuestionHarvester
+
+
+class StubQuestionService:
+    def __init__(self, questions):
+        self.questions_by_theme = {"ux_ui_basics": list(questions)}
+
+    def iter_questions(self, source_type=None, include_store=True):
+        for theme_id, questions in list(self.questions_by_theme.items()):
+            for question in list(questions):
+                if source_type is None or question.get("source", {}).get("type") == source_type:
+                    yield theme_id, question
+
+    def add_questions(self, theme_id, questions):
+        self.questions_by_theme.setdefault(theme_id, []).extend(questions)
+        return questions
+
+
+BANK = [
+    {"id": f"q{i}", "question": f"Какой принцип гештальта описывает пример номер {i}?",
+     "options": ["близость", "сходство", "замкнутость", "непрерывность"], "correct_answer": 0, "tags": ["гештальт"]}
+    for i in range(30)
+]
+
+
+def make_question(text):
+    return {"question": text, "options": ["да", "нет", "иногда", "никогда"], "correct_answer": 0, "tags": ["сетка"]}
+
+
+def test_harvest_waits_for_index_and_reuses_signatures(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "harvest_signature_cache_file", str(tmp_path / "signatures.db"))
+    service = StubQuestionService(BANK)
+    harvester = QuestionHarvester(service, pack_file=str(tmp_path / "harvested.jsonl"))
+
+    # Индекс еще не построен: без проверки дубликатов вопрос не собирается
+    assert not harvester.harvest(make_question("Нужна ли модульная сетка в мобильном макете?"), "ux_ui_basics", ["сетка"])
+    assert harvester.skipped_not_ready == 1
+
+    asyncio.run(harvester.build_index())
+    assert harvester.ready
+    assert len(harvester.index) == len(BANK)
+    assert harvester.signature_cache.computed == len(BANK)
+
+    paraphrase = dict(BANK[3], question=BANK[3]["question"].upper() + "!")
+    assert not harvester.harvest(paraphrase, "ux_ui_basics", ["гештальт"])
+    assert harvester.duplicates == 1
+    assert harvester.harvest(make_question("Нужна ли модульная сетка в мобильном макете?"), "ux_ui_basics", ["сетка"])
+    harvester.close()
+
+    # После перезапуска сигнатуры всех вопросов, включая собранный, берутся из кэша
+    restarted = QuestionHarvester(service, pack_file=str(tmp_path / "harvested.jsonl"))
+    asyncio.run(restarted.build_index())
+    assert len(restarted.index) == len(BANK) + 1
+    assert restarted.signature_cache.computed == 0
+    assert restarted.signature_cache.reused == len(BANK) + 1
+    restarted.close()
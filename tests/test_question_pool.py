@@ -0,0 +1,113 @@
+"""
+Пул ИИ-вопросов: ключи по отдельным тегам и пополнение только повторно запрошенных ключей
+"""
+import asyncio
+import itertools
+import random
+
+from services.question_pool_service import QuestionPool
+
+TAGS = [f"тег_{i}" for i in range(20)]
+
+
+class FakeAIService:
+    """Генерирует уникальные вопросы с частью запрошенных тегов и считает обращения к API"""
+    model = "fake"
+
+    def __init__(self):
+        self.calls = 0
+        self._ids = itertools.count()
+
+    def _make(self, topic: str, num_questions: int):
+        requested = topic.split(": ", 1)[1].split(", ")
+        questions = []
+        for _ in range(num_questions):
+            n = next(self._ids)
+            questions.append({
+                "question": f"Сгенерированный вопрос {n}",
+                "options": ["a", "b", "c", "d"],
+                "correct_answer": 0,
+                "tags": random.sample(requested, min(2, len(requested)))
+            })
+        return questions
+
+    async def generate_questions_stream(self, topic: str, num_questions: int):
+        self.calls += 1
+        for question in self._make(topic, num_questions):
+            yield question
+
+    async def generate_questions(self, topic: str, num_questions: int, priority=None):
+        self.calls += 1
+        return self._make(topic, num_questions)
+
+
+def run_sessions(pool, sessions: int, count: int = 5):
+    async def run():
+        for user_id in range(sessions):
+            tags = random.sample(TAGS, 5)
+            questions = await pool.get_questions(user_id, "ux_ui_basics", "UX/UI", tags, count)
+            assert len(questions) == count
+            # Даем фоновым пополнениям выполниться
+            for _ in range(3):
+                await asyncio.sleep(0)
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_keys_are_per_tag_and_reused():
+    random.seed(1)
+    ai_service = FakeAIService()
+    pool = QuestionPool(ai_service, db_path="")
+
+    run_sessions(pool, 500)
+
+    # Ключи — теги темы и общий ключ темы, а не случайные наборы тегов
+    assert len(pool._entries) <= len(TAGS) + 1
+    # Большая часть сессий обслуживается из пула без обращения к API
+    assert pool.hits > pool.misses * 5
+    assert ai_service.calls < 500 * 0.2
+
+
+def test_first_request_of_key_does_not_trigger_refill():
+    random.seed(2)
+    ai_service = FakeAIService()
+    pool = QuestionPool(ai_service, db_path="")
+
+    async def run():
+        await pool.get_questions(1, "ux_ui_basics", "UX/UI", ["сетка", "цвет"], 5)
+        await asyncio.sleep(0)
+        assert ai_service.calls == 1
+        assert pool.refills == 0
+        # Повторный запрос тех же тегов: ключи востребованы и пополняются (одним запросом)
+        await pool.get_questions(2, "ux_ui_basics", "UX/UI", ["цвет", "сетка"], 5)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert pool.refills == 1
+        await pool.close()
+
+    asyncio.run(run())
+    # Пул пополнен вопросами одного тега
+    assert max(len(pool._entries[pool.make_key("ux_ui_basics", tag)]) for tag in ("сетка", "цвет")) >= 10
+
+
+def test_pool_writes_are_batched_and_survive_restart(tmp_path):
+    random.seed(3)
+    db_path = str(tmp_path / "pool.db")
+    ai_service = FakeAIService()
+    pool = QuestionPool(ai_service, db_path=db_path)
+
+    async def run():
+        for user_id in range(20):
+            await pool.get_questions(user_id, "ux_ui_basics", "UX/UI", random.sample(TAGS, 3), 5)
+            await asyncio.sleep(0)
+        # До записи пакета изменения только копятся
+        assert pool.get_stats()["pending_writes"] > 0
+        assert pool.flush() > 0
+        assert pool.get_stats()["pending_writes"] == 0
+        await pool.close()
+
+    asyncio.run(run())
+    restored = QuestionPool(FakeAIService(), db_path=db_path)
+    assert restored.get_stats()["questions"] == pool.get_stats()["questions"]
+    asyncio.run(restored.close())
@@ -0,0 +1,83 @@
+"""
+Выборка вопросов без повторов: пользователь не видит вопрос повторно, пока
+в наборе есть непоказанные, а после перезагрузки контента маски сбрасываются
+"""
+import json
+
+from services.content_repository import ContentSnapshot
+from services.question_sampler import QuestionSampler
+from services.question_service import QuestionService
+from services.weighted_sampler import WeaknessSampler
+
+
+def test_no_repeats_until_pool_is_exhausted():
+    sampler = QuestionSampler()
+
+    seen = []
+    for _ in range(4):
+        seen.extend(sampler.sample(1, "full:theme", 20, 5))
+    assert sorted(seen) == list(range(20))
+    assert sampler.resets == 0
+
+    # Набор исчерпан: маска сбрасывается, в одной выборке повторов нет
+    picked = sampler.sample(1, "full:theme", 20, 5)
+    assert len(set(picked)) == 5
+    assert sampler.resets == 1
+    # Другой пользователь выбирает независимо
+    assert len(sampler.sample(2, "full:theme", 20, 20)) == 20
+
+
+def test_reset_after_partial_pool_does_not_repeat_last_picks():
+    sampler = QuestionSampler()
+    first = sampler.sample(1, "full:theme", 10, 7)
+    second = sampler.sample(1, "full:theme", 10, 7)
+
+    assert len(set(second)) == 7
+    # Сначала выдаются 3 непоказанных вопроса, затем остальные из всего набора
+    assert set(range(10)) - set(first) <= set(second)
+
+
+def test_appended_questions_are_offered_first():
+    sampler = QuestionSampler()
+    sampler.sample(1, "full:theme", 10, 10)
+
+    # В конец набора добавились собранные вопросы: показанные позиции остаются верными
+    assert sorted(sampler.sample(1, "full:theme", 13, 3)) == [10, 11, 12]
+    assert sampler.resets == 0
+
+
+def test_weighted_sampling_skips_seen_and_prefers_weak_tags():
+    sampler = QuestionSampler()
+    tag_positions = {"сетка": [0, 1]}
+    draw = WeaknessSampler().drawer(1, "full:theme", 100, tag_positions, {"сетка": 10 ** 9})
+
+    picked = sampler.sample_weighted(1, "full:theme", 100, 2, draw)
+    assert sorted(picked) == [0, 1]
+    # Вопросы слабого тега уже показаны — следующая выборка их не повторяет
+    assert not {0, 1} & set(sampler.sample_weighted(1, "full:theme", 100, 5, draw))
+
+
+def test_content_reload_drops_seen_sets(tmp_path, monkeypatch):
+    sampler = QuestionSampler()
+    monkeypatch.setattr("services.question_service.question_sampler", sampler)
+
+    def content(prefix):
+        return {"themes": [{"id": "theme", "name": "Тема", "questions": [
+            {"id": f"{prefix}{i}", "question": f"Вопрос {prefix}{i}?", "options": ["a", "b"],
+             "correct_answer": 0} for i in range(6)
+        ]}]}
+
+    content_file = tmp_path / "demo.json"
+    content_file.write_text(json.dumps(content("old")), encoding="utf-8")
+    monkeypatch.setattr("config.config.demo_content_file", str(content_file))
+    service = QuestionService(use_demo_mode=True)
+    sampler.sample(7, "full:theme", 6, 3)
+
+    assert len(service.get_questions_by_theme("theme", 4, user_id=7)) == 4
+    service._on_content_reloaded(ContentSnapshot(str(content_file), content("new"), 0.0, "", 2))
+
+    # Маски демо-наборов удалены, маски полной версии не затронуты
+    assert sampler.dropped == 1
+    assert len(service.get_questions_by_theme("theme", 6, user_id=7)) == 6
+    assert sampler.resets == 0
+    assert (7, "full:theme") in sampler._seen
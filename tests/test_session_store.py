@@ -0,0 +1,144 @@
+"""
+Хранилище сессий: восстановление после перезапуска и объединение записей
+"""
+import pytest
+
+from handlers.full_version_handler import FullVersionSession
+from services.quiz_session import QuizSession
+from services.session_store import (
+    FakeRedis, MemorySessionBackend, RedisSessionBackend, SessionStore, SqliteSessionBackend
+)
+
+QUESTIONS = [
+    {"id": f"q{i}", "question": f"Вопрос {i}", "options": ["a", "b", "c"], "correct_answer": 1,
+     "tags": ["сетка", f"тег_{i % 2}"]}
+    for i in range(4)
+]
+
+
+class CountingBackend(RedisSessionBackend):
+    def __init__(self):
+        super().__init__(FakeRedis())
+        self.saved = []
+
+    def save_many(self, items):
+        self.saved.extend(items)
+        super().save_many(items)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SqliteSessionBackend(str(tmp_path / "sessions.db"))
+        yield backend
+        backend.close()
+    else:
+        yield RedisSessionBackend(FakeRedis(), ttl=3600)
+
+
+def test_session_survives_restart(backend):
+    store = SessionStore("demo", "demo", QuizSession, backend)
+    store[1] = QuizSession(list(QUESTIONS))
+    store[1].answer(0)
+    store[1].answer(1)
+    store.flush()
+
+    # Новый процесс: пустая память, то же внешнее хранилище
+    restored_store = SessionStore("demo", "demo", QuizSession, backend)
+    assert 1 in restored_store
+    session = restored_store[1]
+    assert session.current == 2
+    assert session.correct_count == 1
+    assert [session.answer_at(i) for i in range(2)] == [(0, False), (1, True)]
+    assert session.failed_tags() == [("сетка", 1), ("тег_0", 1)]
+    assert session.current_question()["id"] == "q2"
+
+
+def test_deleted_session_is_not_restored(backend):
+    store = SessionStore("demo", "demo", QuizSession, backend)
+    store[1] = QuizSession(list(QUESTIONS))
+    store.flush()
+    del store[1]
+    assert 1 not in store
+    store.flush()
+    assert 1 not in SessionStore("demo", "demo", QuizSession, backend)
+
+
+def test_answers_are_coalesced_into_small_writes():
+    backend = CountingBackend()
+    store = SessionStore("demo", "demo", QuizSession, backend)
+    store[1] = QuizSession(list(QUESTIONS))
+    store.flush()
+    assert set(backend.saved[-1][1]) == {"questions", "state"}
+
+    # Несколько обращений между записями — одна запись, и только состояние
+    store[1].answer(1)
+    store.get(1)
+    store.flush()
+    assert len(backend.saved) == 2
+    assert set(backend.saved[-1][1]) == {"state"}
+
+    # Без изменений ничего не пишется
+    store.get(1)
+    assert store.flush() == 0
+
+    # Дополненный список вопросов записывается заново
+    store[1].questions.append(dict(QUESTIONS[0], id="ai_1"))
+    store.flush()
+    assert "questions" in backend.saved[-1][1]
+
+
+def test_full_version_session_metadata_roundtrip():
+    backend = RedisSessionBackend(FakeRedis())
+    store = SessionStore("full", "full", FullVersionSession, backend)
+    session = FullVersionSession("ux_ui_basics", "Основы UX")
+    session.questions.extend(QUESTIONS)
+    session.tags = ["сетка"]
+    session.answer(0)
+    session.last_failed_tags = session.failed_tags()
+    store[7] = session
+    store.flush()
+
+    restored = SessionStore("full", "full", FullVersionSession, backend)[7]
+    assert isinstance(restored, FullVersionSession)
+    assert restored.topic_name == "Основы UX"
+    assert restored.tags == ["сетка"]
+    assert restored.last_failed_tags == session.last_failed_tags
+    assert restored.ai_prefetch is None
+
+
+def test_evicted_session_is_saved_and_reloaded():
+    backend = RedisSessionBackend(FakeRedis())
+    store = SessionStore("demo", "demo", QuizSession, backend, max_entries=1)
+    store[1] = QuizSession(list(QUESTIONS))
+    store[1].answer(1)
+    store[2] = QuizSession(list(QUESTIONS))
+    assert len(store) == 1
+    assert store[1].correct_count == 1
+
+
+def test_memory_backend_keeps_no_copies_of_evicted_sessions():
+    backend = CountingBackend()
+    backend.durable = False
+    store = SessionStore("demo", "demo", QuizSession, backend, max_entries=100)
+    for user_id in range(5000):
+        store[user_id] = QuizSession(list(QUESTIONS))
+        store[user_id].answer(1)
+        if user_id % 50 == 0:
+            store.flush()
+    store.flush()
+
+    # В памяти только сессии в пределах ограничения; вытесненные нигде не копятся
+    assert len(store) == 100
+    assert backend.saved == []
+    assert backend.client._hashes == {}
+    assert 0 not in store
+
+
+def test_memory_backend_is_not_durable():
+    backend = MemorySessionBackend()
+    store = SessionStore("demo", "demo", QuizSession, backend)
+    store[1] = QuizSession(list(QUESTIONS))
+    assert store.flush() == 0
+    assert backend.load("demo:1") is None
+    assert 1 not in SessionStore("demo", "demo", QuizSession, backend)
@@ -0,0 +1,103 @@
+"""
+Хранилище FSM в SQLite: чтение своих записей до записи в базу, пакетная запись,
+восстановление после перезапуска и устаревание ключей
+"""
+import asyncio
+import sqlite3
+
+from aiogram.fsm.storage.base import StorageKey
+
+from handlers.full_version_handler import FullVersionStates
+from utils.sqlite_fsm_storage import SqliteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=100, user_id=100)
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_read_your_writes_before_flush(tmp_path):
+    path = str(tmp_path / "fsm.db")
+    storage = SqliteStorage(path)
+
+    async def run():
+        await storage.set_state(KEY, FullVersionStates.ANSWERING)
+        await storage.update_data(KEY, {"topic": "ux"})
+        assert await storage.get_state(KEY) == FullVersionStates.ANSWERING.state
+        assert await storage.get_data(KEY) == {"topic": "ux"}
+        # Копия данных: изменение результата не меняет хранилище
+        (await storage.get_data(KEY))["topic"] = "other"
+        assert await storage.get_data(KEY) == {"topic": "ux"}
+
+    asyncio.run(run())
+    assert count_rows(path) == 0
+    storage.flush()
+    assert count_rows(path) == 1
+    asyncio.run(storage.close())
+
+
+def test_state_survives_restart_and_clear_removes_row(tmp_path):
+    path = str(tmp_path / "fsm.db")
+    other = StorageKey(bot_id=1, chat_id=200, user_id=200)
+
+    async def first_run():
+        storage = SqliteStorage(path)
+        for _ in range(10):
+            await storage.set_state(KEY, FullVersionStates.SELECTING_TOPIC)
+            await storage.set_state(KEY, FullVersionStates.ANSWERING)
+        await storage.set_state(other, FullVersionStates.ANSWERING)
+        # Двадцать одно обновление — одна пакетная запись двух ключей
+        assert storage.flush() == 2
+        assert storage.flushes == 1
+        await storage.close()
+
+    async def second_run():
+        storage = SqliteStorage(path)
+        assert await storage.get_state(KEY) == FullVersionStates.ANSWERING.state
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+    assert count_rows(path) == 1
+
+
+def test_expired_state_is_reset(tmp_path):
+    path = str(tmp_path / "fsm.db")
+    storage = SqliteStorage(path, ttl=60)
+
+    async def run():
+        await storage.set_state(KEY, FullVersionStates.ANSWERING)
+        storage.flush()
+        storage._cache.peek(storage._key(KEY)).updated_at -= 120
+        with storage._conn:
+            storage._conn.execute("UPDATE fsm SET updated_at = updated_at - 120")
+        assert await storage.get_state(KEY) is None
+        storage.sweep()
+
+    asyncio.run(run())
+    assert count_rows(path) == 0
+    asyncio.run(storage.close())
+
+
+def test_evicted_changes_are_written(tmp_path):
+    path = str(tmp_path / "fsm.db")
+    storage = SqliteStorage(path, max_entries=1)
+    other = StorageKey(bot_id=1, chat_id=200, user_id=200)
+
+    async def run():
+        await storage.set_state(KEY, FullVersionStates.ANSWERING)
+        await storage.set_state(other, FullVersionStates.SELECTING_TOPIC)
+        # Первый ключ вытеснен из кэша и записан, чтение идет из базы
+        assert count_rows(path) == 1
+        assert await storage.get_state(KEY) == FullVersionStates.ANSWERING.state
+        await storage.close()
+
+    asyncio.run(run())
+    assert count_rows(path) == 2
@@ -0,0 +1,30 @@
+"""
+Словарь тегов: теги контента добавляются всегда, теги свободного текста — в пределах лимита
+"""
+from services.question_model import OTHER_TAG, QuestionRecord, TagVocabulary
+
+
+def test_free_tags_are_bounded():
+    vocabulary = TagVocabulary(max_free_tags=3)
+    content_ids = vocabulary.intern_all(["сетка", "цвет"])
+
+    free_ids = [vocabulary.intern_free(f"ии_тег_{i}") for i in range(100)]
+
+    # Известные теги сохраняют свой ID, новых тегов свободного текста не больше лимита
+    assert vocabulary.intern_free("сетка") == content_ids[0]
+    assert len(set(free_ids)) == 4
+    assert vocabulary.name(free_ids[-1]) == OTHER_TAG
+    assert len(vocabulary) == 2 + 3 + 1
+    assert vocabulary.overflowed == 97
+    # Теги контента добавляются и после исчерпания лимита
+    assert vocabulary.name(vocabulary.intern("типографика")) == "типографика"
+
+
+def test_harvested_record_uses_free_tags(monkeypatch):
+    vocabulary = TagVocabulary(max_free_tags=0)
+    monkeypatch.setattr("services.question_model.tag_vocabulary", vocabulary)
+    vocabulary.intern("сетка")
+
+    record = QuestionRecord.from_dict(1, {"question": "?", "options": ["a"], "correct_answer": 0,
+                                          "tags": ["сетка", "новый_тег"]}, free_tags=True)
+    assert record.tags == ["сетка", OTHER_TAG]
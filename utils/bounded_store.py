@@ -0,0 +1,171 @@
+"""
+Ограниченное хранилище данных пользователей в памяти.
+
+Сессии тестов, результаты и последние сообщения хранятся по ID
+пользователя, и без ограничений словари растут с каждым новым
+пользователем. BoundedStore — словарь с порядком последнего обращения:
+- запись, к которой не обращались дольше ttl, удаляется при очистке
+  (sweep), которую периодически вызывает фоновая задача sweep_stores;
+- при превышении числа записей или бюджета памяти вытесняются давно
+  не использованные записи (LRU).
+Записи упорядочены по времени последнего обращения, поэтому очистка
+просматривает только устаревшие записи в начале словаря.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Any, Callable, Hashable, Iterator, List, Optional
+from utils.logger import logger
+
+
+class _Entry:
+    __slots__ = ("value", "touched", "size")
+
+    def __init__(self, value: Any, touched: float, size: int):
+        self.value = value
+        self.touched = touched
+        self.size = size
+
+
+class BoundedStore(MutableMapping):
+    """
+    Словарь с удалением по TTL и вытеснением LRU по числу записей и памяти
+    """
+
+    def __init__(self, name: str, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, sizer: Optional[Callable[[Any], int]] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        """
+        Args:
+            name: название для журнала и статистики
+            ttl: время жизни записи без обращений, сек (None или 0 — без ограничения)
+            max_entries: максимум записей (None или 0 — без ограничения)
+            max_bytes: бюджет памяти (учитывается только вместе с sizer)
+            sizer: оценка размера значения в байтах
+            on_evict: вызывается для удаленной по TTL или вытесненной записи
+        """
+        self.name = name
+        self.ttl = ttl or None
+        self.max_entries = max_entries or None
+        self.max_bytes = (max_bytes or None) if sizer is not None else None
+        self.sizer = sizer
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.total_bytes = 0
+
+        # Счетчики для статистики
+        self.expired = 0
+        self.evicted = 0
+
+    def _size(self, value: Any) -> int:
+        return self.sizer(value) if self.sizer is not None else 0
+
+    def __getitem__(self, key: Hashable) -> Any:
+        entry = self._entries[key]
+        entry.touched = time.monotonic()
+        self._entries.move_to_end(key)
+        if self.sizer is not None:
+            # Значение могло измениться с момента записи (например, сессия с новыми ответами)
+            size = self.sizer(entry.value)
+            self.total_bytes += size - entry.size
+            entry.size = size
+        return entry.value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        size = self._size(value)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.total_bytes -= entry.size
+        self._entries[key] = _Entry(value, time.monotonic(), size)
+        self._entries.move_to_end(key)
+        self.total_bytes += size
+        self._enforce_limits()
+
+    def __delitem__(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.size
+
+    def peek(self, key: Hashable) -> Any:
+        """Значение без обращения (не продлевает жизнь записи); None, если записи нет"""
+        entry = self._entries.get(key)
+        return entry.value if entry is not None else None
+
+    def __contains__(self, key: object) -> bool:
+        # Проверка наличия не считается обращением и не продлевает жизнь записи
+        return key in self._entries
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.size
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, entry.value)
+            except Exception as e:
+                logger.error(f"Error in eviction callback of store '{self.name}': {str(e)}")
+
+    def _enforce_limits(self) -> None:
+        """Вытесняет давно не использованные записи сверх лимитов (последнюю запись оставляет)"""
+        while len(self._entries) > 1 and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            self._evict(next(iter(self._entries)))
+            self.evicted += 1
+
+    def sweep(self) -> int:
+        """
+        Удаляет записи, к которым не обращались дольше ttl
+
+        Returns:
+            int: количество удаленных записей
+        """
+        if self.ttl is None:
+            return 0
+        deadline = time.monotonic() - self.ttl
+        removed = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.touched > deadline:
+                break
+            self._evict(key)
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику хранилища"""
+        stats = {
+            "live": f"{len(self._entries)} / {self.max_entries}" if self.max_entries else len(self._entries),
+            "expired": self.expired,
+            "evicted": self.evicted
+        }
+        if self.sizer is not None:
+            budget = f" / {self.max_bytes / 1024 / 1024:.0f} МБ" if self.max_bytes else ""
+            stats["memory"] = f"{self.total_bytes / 1024 / 1024:.1f} МБ{budget}"
+        return stats
+
+
+async def sweep_stores(stores: List[Any], interval: float) -> None:
+    """
+    Периодически удаляет устаревшие записи хранилищ (запускается задачей при старте бота).
+    Кроме BoundedStore подходят любые объекты с атрибутом name и методом sweep() -> int
+    """
+    if not interval:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        for store in stores:
+            try:
+                removed = store.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping store '{store.name}': {str(e)}")
+                continue
+            if removed:
+                logger.info(f"Store '{store.name}': {removed} expired entries removed")
@@ -3,6 +3,8 @@
 """
 from typing import Dict, Optional
 from aiogram import types
+from config import config
+from utils.bounded_store import BoundedStore
 from utils.logger import logger
 
 class MessageManager:
@@ -12,8 +14,11 @@ class MessageManager:
     """
     def __init__(self):
         # Словарь для хранения последнего сообщения, отправленного каждому пользователю
-        # Ключ - ID пользователя, значение - объект сообщения
-        self.last_messages: Dict[int, Optional[types.Message]] = {}
+        # Ключ - ID пользователя, значение - объект сообщения.
+        # Сообщения старше 48 часов Telegram удалить не даст, поэтому они забываются
+        self.last_messages: Dict[int, Optional[types.Message]] = BoundedStore(
+            "Последние сообщения", ttl=config.last_message_ttl, max_entries=config.last_message_max_entries
+        )
     
     async def send_message(self, chat_id: int, text: str, **kwargs) -> types.Message:
         """
@@ -117,12 +122,12 @@ class MessageManager:
         if last_message:
             try:
                 await last_message.delete()
-                self.last_messages[chat_id] = None
+                self.last_messages.pop(chat_id, None)
                 return True
             except Exception as e:
                 logger.error(f"Error deleting message for user {chat_id}: {e}")
                 # В случае ошибки удаления (например, сообщение уже удалено) сбрасываем запись
-                self.last_messages[chat_id] = None
+                self.last_messages.pop(chat_id, None)
                 return False
         return False
     
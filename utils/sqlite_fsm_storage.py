@@ -0,0 +1,202 @@
+"""
+Хранилище состояний FSM aiogram в SQLite с отложенной пакетной записью.
+
+MemoryStorage теряет состояния (например, FullVersionStates.ANSWERING)
+при перезапуске бота. SqliteStorage хранит состояние и данные каждого
+ключа в таблице SQLite (WAL), но не пишет в базу на каждое обновление:
+- записи попадают в кэш в памяти (BoundedStore) и помечаются, а flush()
+  раз в config.fsm_flush_interval записывает все помеченные ключи одной
+  транзакцией;
+- чтение сначала смотрит в кэш, поэтому только что записанное состояние
+  видно сразу, еще до записи в базу;
+- ключ, который не обновлялся дольше ttl, считается пустым и удаляется
+  из базы при очистке (sweep);
+- вытесняемая из кэша запись с несохраненными изменениями записывается
+  сразу, а close() записывает все оставшиеся изменения.
+"""
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Any, Hashable, Optional, Set, Tuple
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from utils.bounded_store import BoundedStore
+from utils.logger import logger
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+
+class SqliteStorage(BaseStorage):
+    """
+    Хранилище FSM в SQLite: кэш в памяти и пакетная запись изменений
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        """
+        Args:
+            path: файл базы SQLite
+            ttl: ключ без обновлений дольше ttl сбрасывается, сек (None или 0 — без ограничения)
+            max_entries: максимум ключей в кэше (LRU, вытесненные читаются из базы)
+        """
+        self.name = "Состояния FSM"
+        self.path = path
+        self.ttl = ttl or None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm (updated_at)")
+        self._conn.commit()
+        self._cache = BoundedStore(self.name, ttl=ttl, max_entries=max_entries, on_evict=self._evicted)
+        # Ключи с изменениями, которые еще не записаны в базу
+        self._dirty: Set[str] = set()
+
+        # Счетчики для статистики
+        self.updates = 0
+        self.writes = 0
+        self.flushes = 0
+        self.loads = 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        thread_id = "" if key.thread_id is None else key.thread_id
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+    def _expired(self, record: _Record, now: float) -> bool:
+        return self.ttl is not None and record.updated_at < now - self.ttl
+
+    def _load(self, key: str) -> _Record:
+        """Запись ключа из кэша или из базы (пустая, если ключа нет или он устарел)"""
+        record = self._cache.get(key)
+        now = time.time()
+        if record is None:
+            row = self._conn.execute("SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.loads += 1
+                record = _Record(row[0], json.loads(row[1]) if row[1] else {}, row[2])
+            else:
+                record = _Record(None, {}, now)
+            self._cache[key] = record
+        if self._expired(record, now):
+            record.state, record.data, record.updated_at = None, {}, now
+        return record
+
+    def _update(self, key: str, state: Any = ..., data: Any = ...) -> None:
+        record = self._load(key)
+        if state is not ...:
+            record.state = state
+        if data is not ...:
+            record.data = data
+        record.updated_at = time.time()
+        self._dirty.add(key)
+        self.updates += 1
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._update(self._key(key), state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._load(self._key(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._update(self._key(key), data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._load(self._key(key)).data.copy()
+
+    def _write(self, items: List[Tuple[str, _Record]]) -> int:
+        """Записывает записи одной транзакцией; пустые записи удаляются из базы"""
+        upserts = []
+        deletes = []
+        for key, record in items:
+            if record.state is None and not record.data:
+                deletes.append((key,))
+                continue
+            try:
+                data = json.dumps(record.data, ensure_ascii=False) if record.data else None
+            except (TypeError, ValueError) as e:
+                logger.error(f"FSM data of {key} is not JSON serializable, state saved without data: {str(e)}")
+                data = None
+            upserts.append((key, record.state, data, record.updated_at))
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+        return len(items)
+
+    def flush(self) -> int:
+        """
+        Записывает изменения всех помеченных ключей
+
+        Returns:
+            int: количество записанных ключей
+        """
+        if not self._dirty:
+            return 0
+        keys, self._dirty = self._dirty, set()
+        items = [(key, self._cache.peek(key)) for key in keys]
+        try:
+            written = self._write([(key, record) for key, record in items if record is not None])
+        except Exception as e:
+            logger.error(f"Error saving FSM states: {str(e)}")
+            # Повторим при следующей записи
+            self._dirty.update(keys)
+            return 0
+        self.writes += written
+        self.flushes += 1
+        return written
+
+    def _evicted(self, key: Hashable, record: _Record) -> None:
+        """Запись вытеснена из кэша: несохраненные изменения записываются сразу"""
+        if key in self._dirty:
+            self._dirty.discard(key)
+            try:
+                self.writes += self._write([(key, record)])
+            except Exception as e:
+                logger.error(f"Error saving evicted FSM state {key}: {str(e)}")
+
+    def sweep(self) -> int:
+        """Удаляет из кэша давно не использованные записи, а из базы — устаревшие ключи"""
+        removed = self._cache.sweep()
+        if self.ttl is not None:
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.ttl,))
+            except Exception as e:
+                logger.error(f"Error purging FSM states: {str(e)}")
+        return removed
+
+    async def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику хранилища"""
+        stats = self._cache.get_stats()
+        stats.update({
+            "pending": len(self._dirty),
+            "updates": self.updates,
+            "writes": self.writes,
+            "batches": self.flushes,
+            "restored": self.loads
+        })
+        return stats
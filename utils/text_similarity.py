@@ -0,0 +1,125 @@
+"""
+Поиск почти одинаковых текстов: шинглы, MinHash и LSH-индекс
+"""
+import hashlib
+import random
+from array import array
+from typing import Dict, List, Set, Hashable
+
+# Простое число Мерсенна для универсального хеширования
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к нижнему регистру, убирает пунктуацию и лишние пробелы"""
+    cleaned = "".join(ch if ch.isalnum() else " " for ch in str(text).lower())
+    return " ".join(cleaned.split())
+
+
+def shingles(text: str, k: int = 5) -> Set[str]:
+    """Возвращает множество символьных k-грамм нормализованного текста"""
+    normalized = normalize_text(text)
+    if len(normalized) <= k:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+
+
+class MinHasher:
+    """
+    Вычисляет MinHash-сигнатуру множества шинглов. Доля совпадающих позиций
+    двух сигнатур оценивает коэффициент Жаккара исходных множеств.
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        self.num_perm = num_perm
+        self.seed = seed
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    @staticmethod
+    def _base_hash(shingle: str) -> int:
+        return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+
+    def signature(self, items: Set[str]) -> List[int]:
+        """Возвращает сигнатуру длины num_perm"""
+        if not items:
+            return [_MAX_HASH] * self.num_perm
+        hashes = [self._base_hash(item) for item in items]
+        return [
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        ]
+
+    @property
+    def params(self) -> str:
+        """Параметры, от которых зависит сигнатура (сохраненные сигнатуры годны только при совпадении)"""
+        return f"minhash:{self.num_perm}:{self.seed}"
+
+    @staticmethod
+    def to_bytes(sig: List[int]) -> bytes:
+        """Сигнатура в компактном виде для хранения (4 байта на позицию)"""
+        return array("I", sig).tobytes()
+
+    @staticmethod
+    def from_bytes(data: bytes) -> List[int]:
+        return array("I", data).tolist()
+
+    @staticmethod
+    def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+        """Оценка коэффициента Жаккара по двум сигнатурам"""
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class LSHIndex:
+    """
+    LSH-индекс MinHash-сигнатур: сигнатура делится на bands полос, и кандидатами
+    считаются тексты, совпавшие хотя бы в одной полосе. Затем кандидаты
+    проверяются по оценке сходства сигнатур.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.7):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets: List[Dict[tuple, List[Hashable]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Hashable, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, text: str) -> List[int]:
+        return self.hasher.signature(shingles(text))
+
+    def _bands(self, sig: List[int]):
+        for band in range(self.bands):
+            yield band, tuple(sig[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, key: Hashable, text: str) -> List[int]:
+        """Добавляет текст в индекс под ключом key и возвращает его сигнатуру"""
+        sig = self.signature(text)
+        self.add_signature(key, sig)
+        return sig
+
+    def add_signature(self, key: Hashable, sig: List[int]) -> None:
+        """Добавляет готовую сигнатуру (например, сохраненную ранее) под ключом key"""
+        self._signatures[key] = sig
+        for band, band_key in self._bands(sig):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def query(self, text: str) -> List[Hashable]:
+        """Возвращает ключи текстов, похожих на text не меньше порога"""
+        sig = self.signature(text)
+        candidates = set()
+        for band, band_key in self._bands(sig):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        return [
+            key for key in candidates
+            if MinHasher.similarity(sig, self._signatures[key]) >= self.threshold
+        ]